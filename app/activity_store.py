@@ -0,0 +1,358 @@
+"""
+Local SQLite store for Strava activity summaries.
+
+The store keeps every synced activity together with a high-water mark (the
+latest stored `start_date`), so a sync only has to ask Strava for activities
+newer than that mark. A periodic reconcile pass re-reads a recent window to
+pick up edits and deletions made on Strava after an activity was first synced.
+"""
+
+import sqlite3
+from contextlib import closing
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+
+ACTIVITY_FIELDS = [
+    'id', 'name', 'type', 'distance', 'moving_time', 'elapsed_time',
+    'total_elevation_gain', 'start_date', 'average_speed', 'max_speed',
+    'average_cadence', 'average_heartrate', 'weighted_average_watts',
+    'kudos_count', 'max_heartrate', 'suffer_score', 'calories',
+]
+
+
+def _plain(value: Any) -> Any:
+    """Unwrap stravalib root models and unit types into plain Python values."""
+    value = getattr(value, 'root', value)
+    if value is None or isinstance(value, (str, datetime)):
+        return value
+    if isinstance(value, int):
+        return int(value)
+    if isinstance(value, float):
+        return float(value)
+    return str(value)
+
+
+def activity_to_record(activity: Any) -> Dict[str, Any]:
+    """
+    Convert a stravalib activity model into a flat store record.
+
+    Args:
+        activity: A `SummaryActivity` (or compatible) instance
+
+    Returns:
+        Dict[str, Any]: Record keyed by `ACTIVITY_FIELDS`
+    """
+    return {
+        'id': int(activity.id),
+        'name': activity.name,
+        'type': _plain(activity.type),
+        'distance': _plain(activity.distance),  # In meters
+        'moving_time': _plain(activity.moving_time),  # In seconds
+        'elapsed_time': _plain(activity.elapsed_time),  # In seconds
+        'total_elevation_gain': _plain(activity.total_elevation_gain),  # In meters
+        'start_date': activity.start_date,
+        'average_speed': _plain(activity.average_speed),  # Speed in m/s
+        'max_speed': _plain(activity.max_speed) if activity.max_speed else None,
+        'average_cadence': _plain(activity.average_cadence),
+        'average_heartrate': _plain(activity.average_heartrate),
+        'weighted_average_watts': _plain(activity.weighted_average_watts),
+        'kudos_count': _plain(activity.kudos_count),
+        'max_heartrate': _plain(activity.max_heartrate),
+        'suffer_score': _plain(activity.suffer_score),
+        'calories': _plain(activity.kilojoules) if activity.kilojoules else None,
+    }
+
+
+def _column_arrays(
+    fields: List[str],
+    dtypes: Dict[str, Any],
+    rows: Sequence[Tuple[Any, ...]]
+) -> Dict[str, np.ndarray]:
+    """Transpose rows into one typed array per field; NULLs become 0 in integer columns."""
+    columns = zip(*rows) if rows else (() for _ in fields)
+    arrays = {}
+    for field, column in zip(fields, columns):
+        dtype = np.dtype(dtypes[field])
+        if dtype.kind in 'iu':
+            column = [0 if value is None else value for value in column]
+        arrays[field] = np.array(column, dtype=dtype)
+    return arrays
+
+
+def _to_timestamp(value: Any) -> int:
+    """Convert a datetime or ISO-8601 string into a UTC epoch timestamp."""
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return int(value.timestamp())
+
+
+class ActivityStore:
+    """
+    Persistent store of activity summaries with a sync high-water mark.
+    """
+
+    def __init__(self, db_path: str) -> None:
+        """Initialize the store and create its tables if needed."""
+        self.db_path = db_path
+        self.initialize()
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path)
+
+    def initialize(self) -> None:
+        """Create the activities and sync_state tables if they don't exist."""
+        with closing(self._connect()) as conn, conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS activities (
+                    id INTEGER PRIMARY KEY,
+                    name TEXT,
+                    type TEXT,
+                    distance REAL,
+                    moving_time REAL,
+                    elapsed_time REAL,
+                    total_elevation_gain REAL,
+                    start_date TEXT,
+                    start_ts INTEGER NOT NULL,
+                    average_speed REAL,
+                    max_speed REAL,
+                    average_cadence REAL,
+                    average_heartrate REAL,
+                    weighted_average_watts REAL,
+                    kudos_count INTEGER,
+                    max_heartrate REAL,
+                    suffer_score REAL,
+                    calories REAL,
+                    synced_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_activities_start_ts ON activities (start_ts)"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_activities_type_start_ts ON activities (type, start_ts)"
+            )
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS sync_state (
+                    key TEXT PRIMARY KEY,
+                    value TEXT
+                )
+            """)
+
+    def upsert_activities(self, records: Iterable[Dict[str, Any]]) -> int:
+        """
+        Insert new activities and overwrite changed ones.
+
+        Args:
+            records: Records as produced by `activity_to_record`
+
+        Returns:
+            int: Number of records written
+        """
+        rows = []
+        for record in records:
+            start_date = record['start_date']
+            if isinstance(start_date, datetime):
+                record = {**record, 'start_date': start_date.isoformat()}
+            rows.append(
+                tuple(record.get(field) for field in ACTIVITY_FIELDS)
+                + (_to_timestamp(start_date),)
+            )
+        if not rows:
+            return 0
+
+        columns = ', '.join(ACTIVITY_FIELDS + ['start_ts'])
+        placeholders = ', '.join('?' for _ in range(len(ACTIVITY_FIELDS) + 1))
+        with closing(self._connect()) as conn, conn:
+            conn.executemany(
+                f"INSERT OR REPLACE INTO activities ({columns}) VALUES ({placeholders})",
+                rows
+            )
+        return len(rows)
+
+    def delete_activities(self, activity_ids: Iterable[int]) -> int:
+        """Delete activities by id and return how many were removed."""
+        ids = [(int(activity_id),) for activity_id in activity_ids]
+        if not ids:
+            return 0
+        with closing(self._connect()) as conn, conn:
+            cursor = conn.executemany("DELETE FROM activities WHERE id = ?", ids)
+            return cursor.rowcount
+
+    def load_activities(self) -> List[Dict[str, Any]]:
+        """Load all stored activities, newest first."""
+        columns = ', '.join(ACTIVITY_FIELDS)
+        with closing(self._connect()) as conn:
+            cursor = conn.execute(
+                f"SELECT {columns} FROM activities ORDER BY start_ts DESC"
+            )
+            return [dict(zip(ACTIVITY_FIELDS, row)) for row in cursor]
+
+    def _iter_rows(
+        self,
+        fields: List[str],
+        where: str,
+        params: Tuple[Any, ...],
+        chunk_size: int,
+        newest_first: bool
+    ) -> Iterator[List[Tuple[Any, ...]]]:
+        """
+        Page through matching rows with keyset pagination on (start_ts, id).
+
+        Each page is read in its own short transaction, so syncs writing to the
+        store are never blocked while the pages are processed.
+        """
+        order, compare = ('DESC', '<') if newest_first else ('ASC', '>')
+        query = (
+            f"SELECT {', '.join(fields)}, start_ts, id FROM activities WHERE {where} {{}} "
+            f"ORDER BY start_ts {order}, id {order} LIMIT ?"
+        )
+        position = None
+        while True:
+            with closing(self._connect()) as conn:
+                if position is None:
+                    rows = conn.execute(query.format(''), params + (chunk_size,)).fetchall()
+                else:
+                    rows = conn.execute(
+                        query.format(f'AND (start_ts {compare} ? OR (start_ts = ? AND id {compare} ?))'),
+                        params + (position[0], position[0], position[1], chunk_size)
+                    ).fetchall()
+            if not rows:
+                return
+            position = rows[-1][-2:]
+            yield [row[:-2] for row in rows]
+            if len(rows) < chunk_size:
+                return
+
+    def iter_activities(self, chunk_size: int = 1000) -> Iterator[List[Dict[str, Any]]]:
+        """Yield all stored activities in chunks, oldest first."""
+        for rows in self._iter_rows(ACTIVITY_FIELDS, '1 = 1', (), chunk_size, newest_first=False):
+            yield [dict(zip(ACTIVITY_FIELDS, row)) for row in rows]
+
+    def load_columns(self, activity_type: str, dtypes: Dict[str, Any]) -> Dict[str, np.ndarray]:
+        """
+        Load selected fields of one activity type as typed column arrays, newest first.
+
+        Filtering happens in SQLite, so other sports are never materialized in Python.
+        Missing values become NaN in float columns and 0 in integer columns.
+
+        Args:
+            activity_type: Activity type to select, e.g. 'Run'
+            dtypes: Mapping of column name (any stored column, including `start_ts`)
+                to the NumPy dtype it should be loaded as
+
+        Returns:
+            Dict[str, np.ndarray]: One array per requested column
+        """
+        fields = list(dtypes)
+        with closing(self._connect()) as conn:
+            rows = conn.execute(
+                f"SELECT {', '.join(fields)} FROM activities WHERE type = ? ORDER BY start_ts DESC",
+                (activity_type,)
+            ).fetchall()
+        return _column_arrays(fields, dtypes, rows)
+
+    def load_columns_for(self, activity_ids: Iterable[int], dtypes: Dict[str, Any]) -> Dict[str, np.ndarray]:
+        """
+        Like `load_columns`, but for the given activities of any type; ids that are
+        not stored are left out.
+
+        Args:
+            activity_ids: Strava ids of the activities to load
+            dtypes: Mapping of column name to the NumPy dtype it should be loaded as
+
+        Returns:
+            Dict[str, np.ndarray]: One array per requested column
+        """
+        fields = list(dtypes)
+        ids = [int(activity_id) for activity_id in activity_ids]
+        rows = []
+        with closing(self._connect()) as conn:
+            # Stays below SQLite's limit on query parameters.
+            for start in range(0, len(ids), 500):
+                batch = ids[start:start + 500]
+                rows += conn.execute(
+                    f"SELECT {', '.join(fields)} FROM activities WHERE id IN ({', '.join('?' for _ in batch)})",
+                    batch
+                ).fetchall()
+        return _column_arrays(fields, dtypes, rows)
+
+    def iter_columns(
+        self,
+        activity_type: str,
+        dtypes: Dict[str, Any],
+        chunk_size: int = 5000
+    ) -> Iterator[Dict[str, np.ndarray]]:
+        """
+        Like `load_columns`, but yield the columns in chunks of `chunk_size` rows,
+        newest first, so memory stays bounded however many activities are stored.
+
+        Args:
+            activity_type: Activity type to select, e.g. 'Run'
+            dtypes: Mapping of column name to the NumPy dtype it should be loaded as
+            chunk_size: Rows per chunk
+
+        Returns:
+            Iterator[Dict[str, np.ndarray]]: One dict of column arrays per chunk
+        """
+        fields = list(dtypes)
+        for rows in self._iter_rows(fields, 'type = ?', (activity_type,), chunk_size, newest_first=True):
+            yield _column_arrays(fields, dtypes, rows)
+
+    def recent_ids(self, activity_type: str, limit: int) -> List[int]:
+        """Return the ids of the `limit` most recent activities of a type, newest first."""
+        with closing(self._connect()) as conn:
+            rows = conn.execute(
+                "SELECT id FROM activities WHERE type = ? ORDER BY start_ts DESC, id DESC LIMIT ?",
+                (activity_type, limit)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def count(self) -> int:
+        """Return the number of stored activities."""
+        with closing(self._connect()) as conn:
+            return conn.execute("SELECT COUNT(*) FROM activities").fetchone()[0]
+
+    def activity_ids_since(self, after: datetime) -> Set[int]:
+        """Return the ids of stored activities that started after `after`."""
+        with closing(self._connect()) as conn:
+            cursor = conn.execute(
+                "SELECT id FROM activities WHERE start_ts > ?",
+                (_to_timestamp(after),)
+            )
+            return {row[0] for row in cursor}
+
+    def get_high_water_mark(self) -> Optional[datetime]:
+        """Return the start date of the most recent stored activity, if any."""
+        with closing(self._connect()) as conn:
+            (latest,) = conn.execute("SELECT MAX(start_ts) FROM activities").fetchone()
+        if latest is None:
+            return None
+        return datetime.fromtimestamp(latest, tz=timezone.utc)
+
+    def get_state(self, key: str) -> Optional[str]:
+        """Read a value from the sync_state table."""
+        with closing(self._connect()) as conn:
+            row = conn.execute(
+                "SELECT value FROM sync_state WHERE key = ?", (key,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def set_state(self, key: str, value: str) -> None:
+        """Write a value to the sync_state table."""
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO sync_state (key, value) VALUES (?, ?)",
+                (key, value)
+            )
+
+    def clear_state(self, key: str, expected: Optional[str] = None) -> None:
+        """Remove a value from the sync_state table, only if it still equals `expected` when given."""
+        with closing(self._connect()) as conn, conn:
+            if expected is None:
+                conn.execute("DELETE FROM sync_state WHERE key = ?", (key,))
+            else:
+                conn.execute("DELETE FROM sync_state WHERE key = ? AND value = ?", (key, expected))
@@ -0,0 +1,350 @@
+"""
+Per-second activity streams: storage and derived run metrics.
+
+Strava's streams endpoint returns the time series recorded during an activity
+(time, distance, heart rate, speed, cadence, altitude, grade, position). Each
+stream is stored as a NumPy `.npy` file in a directory per activity:
+
+    <streams_dir>/<activity_id>/time.npy, heartrate.npy, latlng.npy, ...
+
+Files are opened memory-mapped, so reading a slice of a multi-hour activity only
+pages in the part that is used. From the streams of a run the module computes
+vectorized metrics for the prompt:
+
+- km splits: time, pace, average heart rate and elevation change per kilometre
+- time in each heart-rate zone (Karvonen zones on the heart-rate reserve)
+- cardiac drift: aerobic decoupling of pace and heart rate between the two halves
+- grade-adjusted pace, from Minetti's energy cost of running on a slope
+"""
+
+import os
+import shutil
+import tempfile
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+
+import config
+
+# Streams requested for runs and the dtype each is stored as.
+STREAM_DTYPES = {
+    'time': np.int32,  # Seconds since the start
+    'distance': np.float32,  # Meters
+    'heartrate': np.float32,  # Beats per minute
+    'velocity_smooth': np.float32,  # Meters per second
+    'cadence': np.float32,  # Steps per minute, one foot
+    'altitude': np.float32,  # Meters
+    'grade_smooth': np.float32,  # Percent
+    'latlng': np.float32,  # (n, 2) degrees
+    'moving': np.bool_,
+}
+
+
+def streams_to_arrays(streams: Dict[str, Any]) -> Dict[str, np.ndarray]:
+    """
+    Convert the streams returned by `Client.get_activity_streams` into typed arrays.
+
+    Args:
+        streams: Mapping of stream type to a stravalib `Stream` (or a raw dict with `data`)
+
+    Returns:
+        Dict[str, np.ndarray]: One array per known stream type; missing readings are NaN
+    """
+    arrays = {}
+    for stream_type, stream in streams.items():
+        if stream_type not in STREAM_DTYPES:
+            continue
+        data = stream['data'] if isinstance(stream, dict) else stream.data
+        if data is None:
+            continue
+        dtype = np.dtype(STREAM_DTYPES[stream_type])
+        if dtype.kind == 'f' and stream_type != 'latlng':
+            data = [np.nan if value is None else value for value in data]
+        arrays[stream_type] = np.asarray(data, dtype=dtype)
+    return arrays
+
+
+class StreamStore:
+    """
+    Directory of memory-mapped per-activity stream files.
+    """
+
+    def __init__(self, root: str) -> None:
+        """Initialize the store under `root`, creating the directory if needed."""
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, activity_id: int) -> str:
+        return os.path.join(self.root, str(int(activity_id)))
+
+    def has(self, activity_id: int) -> bool:
+        """Check whether streams of the activity are stored."""
+        return os.path.isdir(self._path(activity_id))
+
+    def save(self, activity_id: int, arrays: Dict[str, np.ndarray]) -> None:
+        """
+        Store an activity's streams, replacing any stored before.
+
+        The files are written to a temporary directory that is renamed into place,
+        so readers never see a partially written activity. If another process
+        stores the same activity at the same time, whichever copy lands first is
+        kept.
+
+        Args:
+            activity_id: Strava activity id
+            arrays: Stream arrays, e.g. from `streams_to_arrays`
+        """
+        tmp_dir = tempfile.mkdtemp(dir=self.root, prefix='.tmp-')
+        try:
+            for stream_type, array in arrays.items():
+                np.save(os.path.join(tmp_dir, f'{stream_type}.npy'), array)
+            path = self._path(activity_id)
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            try:
+                os.replace(tmp_dir, path)
+            except OSError:
+                # Another writer renamed its copy into place after the rmtree.
+                if not os.path.isdir(path):
+                    raise
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+        except BaseException:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+
+    def delete(self, activity_ids: Iterable[int]) -> int:
+        """Delete the streams of the given activities and return how many were stored."""
+        removed = 0
+        for activity_id in activity_ids:
+            path = self._path(activity_id)
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+                removed += 1
+        return removed
+
+    def load(self, activity_id: int, types: Optional[Sequence[str]] = None) -> Dict[str, np.ndarray]:
+        """
+        Open an activity's streams memory-mapped; nothing is read until used.
+
+        Args:
+            activity_id: Strava activity id
+            types: Stream types to open (default: all stored)
+
+        Returns:
+            Dict[str, np.ndarray]: Read-only memory-mapped arrays per stream type
+        """
+        path = self._path(activity_id)
+        available = {name[:-4] for name in os.listdir(path) if name.endswith('.npy')}
+        wanted = available if types is None else available.intersection(types)
+        return {
+            stream_type: np.load(os.path.join(path, f'{stream_type}.npy'), mmap_mode='r')
+            for stream_type in sorted(wanted)
+        }
+
+    def window(
+        self,
+        activity_id: int,
+        start_seconds: float,
+        end_seconds: float,
+        types: Optional[Sequence[str]] = None
+    ) -> Dict[str, np.ndarray]:
+        """
+        Read the samples between two elapsed times, touching only that part of the files.
+
+        Args:
+            activity_id: Strava activity id
+            start_seconds: Start of the window, in seconds since the activity start
+            end_seconds: End of the window (exclusive)
+            types: Stream types to read (default: all stored)
+
+        Returns:
+            Dict[str, np.ndarray]: In-memory arrays of the window, including `time`
+        """
+        streams = self.load(activity_id)
+        time = streams['time']
+        lo, hi = np.searchsorted(time, [start_seconds, end_seconds])
+        wanted = streams if types is None else {t: streams[t] for t in ('time', *types) if t in streams}
+        return {stream_type: np.array(array[lo:hi]) for stream_type, array in wanted.items()}
+
+
+def _sample_seconds(time: np.ndarray) -> np.ndarray:
+    """Seconds each sample stands for; gaps longer than the pause threshold count as stopped."""
+    dt = np.diff(time.astype(np.float64), append=float(time[-1]) if len(time) else 0.0)
+    dt[(dt < 0) | (dt > config.STREAM_MAX_GAP_SECONDS)] = 0.0
+    return dt
+
+
+def km_splits(streams: Dict[str, np.ndarray]) -> List[Dict[str, Any]]:
+    """
+    Split a run into whole kilometres.
+
+    Boundary times are interpolated on the distance stream. Heart rate and altitude
+    are read from cumulative integrals at the boundaries, so each split costs O(1)
+    after one pass over the samples.
+
+    Args:
+        streams: Arrays with at least `time` and `distance`
+
+    Returns:
+        List[Dict[str, Any]]: Per split: km, seconds, pace (min/km), and average heart
+        rate and elevation change when those streams are available
+    """
+    time = np.asarray(streams['time'], dtype=np.float64)
+    distance = np.maximum.accumulate(np.nan_to_num(np.asarray(streams['distance'], dtype=np.float64)))
+    if len(time) < 2 or distance[-1] < 1000:
+        return []
+
+    boundaries = np.arange(0, distance[-1] + 1e-9, 1000.0)
+    # Interpolate on the last sample reaching each distance so pauses count in the split they end.
+    last = np.r_[distance[1:] != distance[:-1], True]
+    boundary_times = np.interp(boundaries, distance[last], time[last])
+    seconds = np.diff(boundary_times)
+    splits = [
+        {'km': n + 1, 'seconds': int(round(s)), 'pace_min_per_km': round(float(s) / 60, 2)}
+        for n, s in enumerate(seconds)
+    ]
+
+    heartrate = streams.get('heartrate')
+    if heartrate is not None and np.isfinite(heartrate).any():
+        hr = np.asarray(heartrate, dtype=np.float64)
+        valid = np.isfinite(hr)
+        dt = _sample_seconds(time) * valid
+        beats = np.r_[0.0, np.cumsum(np.where(valid, hr, 0.0) * dt)]
+        weights = np.r_[0.0, np.cumsum(dt)]
+        edges = np.searchsorted(time, boundary_times)
+        beat_sums, weight_sums = np.diff(beats[edges]), np.diff(weights[edges])
+        with np.errstate(invalid='ignore', divide='ignore'):
+            averages = beat_sums / weight_sums
+        for split, average in zip(splits, averages):
+            if np.isfinite(average):
+                split['avg_heartrate'] = round(float(average))
+
+    altitude = streams.get('altitude')
+    if altitude is not None and np.isfinite(altitude).any():
+        alt = np.asarray(altitude, dtype=np.float64)
+        valid = np.isfinite(alt)
+        elevations = np.interp(boundary_times, time[valid], alt[valid])
+        for split, change in zip(splits, np.diff(elevations)):
+            split['elevation_change_m'] = round(float(change), 1)
+    return splits
+
+
+def heart_rate_zones(
+    streams: Dict[str, np.ndarray],
+    rest_heartrate: float = config.ATHLETE_REST_HEARTRATE,
+    max_heartrate: float = config.ATHLETE_MAX_HEARTRATE,
+    bounds: Sequence[float] = config.HEART_RATE_ZONE_BOUNDS
+) -> Dict[str, int]:
+    """
+    Seconds spent in each heart-rate zone.
+
+    Zones are bounded at fractions of the heart-rate reserve (Karvonen); time below
+    the first bound is counted as zone 0.
+
+    Args:
+        streams: Arrays with `time` and `heartrate`
+        rest_heartrate: Resting heart rate, bpm
+        max_heartrate: Maximum heart rate, bpm
+        bounds: Lower bounds of zones 1..n as fractions of the reserve
+
+    Returns:
+        Dict[str, int]: Seconds per zone, keyed 'z0'..'zn'
+    """
+    heartrate = streams.get('heartrate')
+    if heartrate is None or not len(heartrate):
+        return {}
+    hr = np.asarray(heartrate, dtype=np.float64)
+    dt = _sample_seconds(np.asarray(streams['time']))
+    valid = np.isfinite(hr)
+    thresholds = rest_heartrate + np.asarray(bounds) * (max_heartrate - rest_heartrate)
+    zones = np.searchsorted(thresholds, hr[valid], side='right')
+    seconds = np.bincount(zones, weights=dt[valid], minlength=len(bounds) + 1)
+    return {f'z{zone}': int(round(s)) for zone, s in enumerate(seconds)}
+
+
+def cardiac_drift(streams: Dict[str, np.ndarray]) -> Optional[float]:
+    """
+    Aerobic decoupling between the first and second half of the moving time.
+
+    The efficiency factor (speed per heartbeat) of each half is compared; a positive
+    result means heart rate rose relative to pace.
+
+    Args:
+        streams: Arrays with `time`, `heartrate` and `velocity_smooth`
+
+    Returns:
+        Optional[float]: Decoupling in percent, or None without heart rate or speed
+    """
+    heartrate, velocity = streams.get('heartrate'), streams.get('velocity_smooth')
+    if heartrate is None or velocity is None or len(heartrate) < 2:
+        return None
+    hr = np.asarray(heartrate, dtype=np.float64)
+    speed = np.asarray(velocity, dtype=np.float64)
+    dt = _sample_seconds(np.asarray(streams['time']))
+    dt[~(np.isfinite(hr) & np.isfinite(speed) & (hr > 0))] = 0.0
+    elapsed = np.cumsum(dt)
+    if not elapsed[-1]:
+        return None
+    first = elapsed <= elapsed[-1] / 2
+    efficiency = []
+    for half in (first, ~first):
+        weight = dt[half].sum()
+        if not weight:
+            return None
+        efficiency.append(np.dot(speed[half], dt[half]) / np.dot(hr[half], dt[half]))
+    return round(float((efficiency[0] - efficiency[1]) / efficiency[0] * 100), 1)
+
+
+def grade_adjusted_pace(streams: Dict[str, np.ndarray]) -> Optional[float]:
+    """
+    Pace on flat ground that would have cost the same energy, in min/km.
+
+    Each sample's speed is scaled by Minetti et al.'s (2002) energy cost of running
+    at its grade relative to the cost on the flat (3.6 J/kg/m).
+
+    Args:
+        streams: Arrays with `time`, `velocity_smooth` and `grade_smooth`
+
+    Returns:
+        Optional[float]: Grade-adjusted pace, or None without speed or grade
+    """
+    velocity, grade = streams.get('velocity_smooth'), streams.get('grade_smooth')
+    if velocity is None or grade is None or not len(velocity):
+        return None
+    g = np.clip(np.nan_to_num(np.asarray(grade, dtype=np.float64)) / 100, -0.45, 0.45)
+    cost = 155.4 * g**5 - 30.4 * g**4 - 43.3 * g**3 + 46.3 * g**2 + 19.5 * g + 3.6
+    speed = np.nan_to_num(np.asarray(velocity, dtype=np.float64))
+    dt = _sample_seconds(np.asarray(streams['time']))
+    moving = speed > 0.5
+    adjusted_distance = np.dot(speed[moving] * cost[moving] / 3.6, dt[moving])
+    if adjusted_distance <= 0:
+        return None
+    return round(float(dt[moving].sum() / 60 / (adjusted_distance / 1000)), 2)
+
+
+def stream_metrics(streams: Dict[str, np.ndarray]) -> Dict[str, Any]:
+    """
+    Compute every derived metric available from an activity's streams.
+
+    Args:
+        streams: Arrays as returned by `StreamStore.load`
+
+    Returns:
+        Dict[str, Any]: `splits`, `hr_zone_seconds`, `cardiac_drift_pct` and
+        `grade_adjusted_pace_min_per_km`, each only if its inputs were recorded
+    """
+    if 'time' not in streams or not len(streams['time']):
+        return {}
+    metrics: Dict[str, Any] = {}
+    if 'distance' in streams:
+        metrics['splits'] = km_splits(streams)
+    zones = heart_rate_zones(streams)
+    if zones:
+        metrics['hr_zone_seconds'] = zones
+    drift = cardiac_drift(streams)
+    if drift is not None:
+        metrics['cardiac_drift_pct'] = drift
+    gap = grade_adjusted_pace(streams)
+    if gap is not None:
+        metrics['grade_adjusted_pace_min_per_km'] = gap
+    return metrics
@@ -0,0 +1,260 @@
+"""
+Content-addressed cache for generated advice.
+
+Advice is keyed on a hash of the formatted prompt, model name and temperature,
+so an unchanged prompt is answered from disk instead of a paid inference call.
+Entries keep the original stream chunks so cached streams replay with the same
+chunking, and are evicted by TTL and then least-recently-used order once the
+entry or size caps are exceeded.
+"""
+
+import asyncio
+import hashlib
+import json
+import sqlite3
+import time
+from contextlib import closing
+from typing import AsyncGenerator, Dict, List, Optional
+
+from app.llm_processor import LLMAdapter
+
+
+class AdviceCache:
+    """
+    SQLite-backed LRU/TTL cache of advice chunks with hit/miss counters.
+    """
+
+    def __init__(
+        self,
+        db_path: str,
+        ttl_seconds: float,
+        max_entries: int,
+        max_bytes: int
+    ) -> None:
+        """Initialize the cache and create its tables if needed."""
+        self.db_path = db_path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.initialize()
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    def initialize(self) -> None:
+        """Create the advice_cache and advice_cache_stats tables if they don't exist."""
+        with closing(self._connect()) as conn, conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS advice_cache (
+                    key TEXT PRIMARY KEY,
+                    chunks TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_accessed REAL NOT NULL
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS advice_cache_stats (
+                    name TEXT PRIMARY KEY,
+                    value INTEGER NOT NULL
+                )
+            """)
+            conn.executemany(
+                "INSERT OR IGNORE INTO advice_cache_stats (name, value) VALUES (?, 0)",
+                [('hits',), ('misses',)]
+            )
+
+    @staticmethod
+    def make_key(prompt: str, model_name: str, temperature: float) -> str:
+        """Hash the prompt inputs into a cache key."""
+        digest = hashlib.sha256()
+        for part in (model_name, repr(float(temperature)), prompt):
+            digest.update(part.encode('utf-8'))
+            digest.update(b'\0')
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[List[str]]:
+        """
+        Look up cached chunks and record a hit or miss.
+
+        Args:
+            key: Cache key from `make_key`
+
+        Returns:
+            Optional[List[str]]: Cached chunks, or None on a miss or expired entry
+        """
+        now = time.time()
+        with closing(self._connect()) as conn, conn:
+            row = conn.execute(
+                "SELECT chunks FROM advice_cache WHERE key = ? AND created_at > ?",
+                (key, now - self.ttl_seconds)
+            ).fetchone()
+            if row is not None:
+                conn.execute(
+                    "UPDATE advice_cache SET last_accessed = ? WHERE key = ?", (now, key)
+                )
+            conn.execute(
+                "UPDATE advice_cache_stats SET value = value + 1 WHERE name = ?",
+                ('hits' if row is not None else 'misses',)
+            )
+        return json.loads(row[0]) if row is not None else None
+
+    def put(self, key: str, chunks: List[str]) -> None:
+        """Store generated chunks under `key` and evict entries over the caps."""
+        payload = json.dumps(chunks)
+        now = time.time()
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                """
+                INSERT OR REPLACE INTO advice_cache (key, chunks, size, created_at, last_accessed)
+                VALUES (?, ?, ?, ?, ?)
+                """,
+                (key, payload, len(payload.encode('utf-8')), now, now)
+            )
+            self._evict(conn, now)
+
+    def _evict(self, conn: sqlite3.Connection, now: float) -> None:
+        conn.execute(
+            "DELETE FROM advice_cache WHERE created_at <= ?", (now - self.ttl_seconds,)
+        )
+        conn.execute(
+            """
+            DELETE FROM advice_cache WHERE key IN (
+                SELECT key FROM advice_cache ORDER BY last_accessed DESC LIMIT -1 OFFSET ?
+            )
+            """,
+            (self.max_entries,)
+        )
+        conn.execute(
+            """
+            DELETE FROM advice_cache WHERE key IN (
+                SELECT key FROM (
+                    SELECT key, SUM(size) OVER (ORDER BY last_accessed DESC) AS running_size
+                    FROM advice_cache
+                ) WHERE running_size > ?
+            )
+            """,
+            (self.max_bytes,)
+        )
+
+    def stats(self) -> Dict[str, int]:
+        """Return hit/miss counters and the current entry count and size."""
+        with closing(self._connect()) as conn:
+            counters = dict(conn.execute(
+                "SELECT name, value FROM advice_cache_stats"
+            ).fetchall())
+            entries, size = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM advice_cache"
+            ).fetchone()
+        return {
+            'hits': counters.get('hits', 0),
+            'misses': counters.get('misses', 0),
+            'entries': entries,
+            'bytes': size,
+        }
+
+
+class CachingLLMAdapter:
+    """
+    Drop-in wrapper around `LLMAdapter` that serves repeated prompts from an `AdviceCache`.
+    """
+
+    def __init__(self, adapter: LLMAdapter, cache: AdviceCache) -> None:
+        """Initialize with the adapter to wrap and the cache to use."""
+        self.adapter = adapter
+        self.cache = cache
+
+    @property
+    def model_name(self) -> str:
+        return self.adapter.model_name
+
+    @property
+    def timeout(self) -> float:
+        return self.adapter.timeout
+
+    def _key(self, prompt: str) -> str:
+        return self.cache.make_key(prompt, self.adapter.model_name, self.adapter.temperature)
+
+    async def complete(self, prompt: str) -> str:
+        """
+        Return cached advice for the prompt, generating and caching it on a miss.
+
+        Args:
+            prompt: Input text for LLM
+
+        Returns:
+            Complete generated text
+
+        Raises:
+            Exception: If generation fails; failures are not cached
+        """
+        key = self._key(prompt)
+        chunks = await asyncio.to_thread(self.cache.get, key)
+        if chunks is not None:
+            return ''.join(chunks)
+
+        advice = await self.adapter.complete(prompt)
+        await asyncio.to_thread(self.cache.put, key, [advice])
+        return advice
+
+    async def stream(self, prompt: str) -> AsyncGenerator[str, None]:
+        """
+        Replay cached chunks for the prompt, or stream and cache a new generation.
+
+        A generation is only cached once the stream has been consumed completely.
+
+        Args:
+            prompt: Input text for LLM
+
+        Returns:
+            AsyncGenerator yielding text chunks
+
+        Raises:
+            Exception: If generation fails; failures are not cached
+        """
+        key = self._key(prompt)
+        chunks = await asyncio.to_thread(self.cache.get, key)
+        if chunks is not None:
+            for chunk in chunks:
+                yield chunk
+            return
+
+        chunks = []
+        async for chunk in self.adapter.stream(prompt):
+            chunks.append(chunk)
+            yield chunk
+        if chunks:
+            await asyncio.to_thread(self.cache.put, key, chunks)
+
+    async def generate_summary(self, prompt: str) -> str:
+        """
+        Like `complete`, but returns a failure as an "Error: ..." message.
+
+        Args:
+            prompt: Input text for LLM
+
+        Returns:
+            Complete generated text, or an "Error: ..." message if generation failed
+        """
+        try:
+            return await self.complete(prompt)
+        except Exception as e:
+            print(f"Exception occurred: {str(e) or type(e).__name__}")
+            return f"Error: {str(e) or type(e).__name__}"
+
+    async def generate_summary_stream(self, prompt: str) -> AsyncGenerator[str, None]:
+        """
+        Like `stream`, but ends with an "Error: ..." chunk if generation fails.
+
+        Args:
+            prompt: Input text for LLM
+
+        Returns:
+            AsyncGenerator yielding text chunks
+        """
+        try:
+            async for chunk in self.stream(prompt):
+                yield chunk
+        except Exception as e:
+            print(f"Exception occurred in stream: {str(e) or type(e).__name__}")
+            yield f"Error: {str(e) or type(e).__name__}"
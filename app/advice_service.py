@@ -18,7 +18,7 @@ class FitnessAdviceService:
        self.prompt_handler = PromptHandler(prompt_path)
        self.llm_adapter = LLMAdapter(model_name=model_name)
 
-   def generate_advice(self, activity_data_path: str, summary_stats_path: str) -> str:
+   async def generate_advice(self, activity_data_path: str, summary_stats_path: str) -> str:
        """
        Generate fitness advice from activity data and statistics.
        
@@ -35,4 +35,4 @@ class FitnessAdviceService:
            summary_statistics: Dict[str, Any] = json.load(file)
 
        prompt: str = self.prompt_handler.format_prompt(activity_data, summary_statistics)
-       return self.llm_adapter.generate_summary(prompt)
\ No newline at end of file
+       return await self.llm_adapter.generate_summary(prompt)
\ No newline at end of file
@@ -0,0 +1,555 @@
+"""
+Materialized per-sport activity aggregates, maintained incrementally in SQLite.
+
+For every activity type the store keeps count, sum, mean and variance of each
+metric in `METRICS`, over:
+
+- `lifetime`: the whole history (bucket '')
+- `week`: calendar weeks in UTC (bucket: the Monday, 'YYYY-MM-DD')
+- `month`: calendar months in UTC (bucket: 'YYYY-MM')
+- `rolling`: the last `config.AGGREGATE_WINDOWS_DAYS` days (bucket: e.g. '28d')
+
+Each row holds a Welford accumulator (n, total, mean, M2), so adding, editing or
+removing an activity updates the rows it falls in with O(1) work and no rescan.
+What each activity contributed is kept alongside, so an edit or deletion
+subtracts exactly that. A rolling window also remembers its cutoff; moving the
+window forward removes the activities that fell out of it, each of them once.
+Reads are a single indexed lookup.
+
+`rebuild` recomputes everything from the activity store by a different route:
+two-pass statistics per chunk, merged with Chan's parallel formula. `verify`
+compares that against the incremental rows.
+
+Example:
+    aggregates = ActivityAggregates(store.db_path, athlete_id)
+    aggregates.apply(records)
+    runs_28d = aggregates.get('Run', 'rolling', '28d')
+"""
+
+import math
+import sqlite3
+import time
+from contextlib import closing
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import config
+from app.training_load import DAY_SECONDS, start_timestamp
+
+# Metric -> function of an activity store record; None when the record lacks it
+METRICS = {
+    'activities': lambda record: 1.0,
+    'distance_km': lambda record: (
+        record['distance'] / 1000 if record.get('distance') is not None else None
+    ),
+    'moving_time_min': lambda record: (
+        record['moving_time'] / 60 if record.get('moving_time') is not None else None
+    ),
+    'pace_min_per_km': lambda record: (
+        record['moving_time'] / 60 / (record['distance'] / 1000)
+        if record.get('moving_time') and record.get('distance') else None
+    ),
+    'elevation_gain_m': lambda record: record.get('total_elevation_gain'),
+    'average_heartrate': lambda record: record.get('average_heartrate'),
+}
+PERIODS = ('lifetime', 'week', 'month', 'rolling')
+
+# (type, period, bucket, metric)
+Key = Tuple[str, str, str, str]
+
+
+def calendar_buckets(start_ts: float) -> List[Tuple[str, str]]:
+    """The lifetime, week and month buckets an activity starting at `start_ts` falls in."""
+    day = datetime.fromtimestamp(start_ts, tz=timezone.utc).date()
+    return [
+        ('lifetime', ''),
+        ('week', (day - timedelta(days=day.weekday())).isoformat()),
+        ('month', day.strftime('%Y-%m')),
+    ]
+
+
+def _values(record: Dict[str, Any]) -> Dict[str, float]:
+    values = {}
+    for metric, extract in METRICS.items():
+        value = extract(record)
+        if value is not None and math.isfinite(value):
+            values[metric] = float(value)
+    return values
+
+
+def _add(stats: List[float], value: float) -> None:
+    """Welford update: add one value to [n, total, mean, m2]."""
+    n = stats[0] + 1
+    delta = value - stats[2]
+    mean = stats[2] + delta / n
+    stats[:] = [n, stats[1] + value, mean, stats[3] + delta * (value - mean)]
+
+
+def _remove(stats: List[float], value: float) -> None:
+    """Inverse Welford update: remove one previously added value."""
+    n = stats[0] - 1
+    if n <= 0:
+        stats[:] = [0, 0.0, 0.0, 0.0]
+        return
+    delta = value - stats[2]
+    mean = stats[2] - delta / n
+    stats[:] = [n, stats[1] - value, mean, max(stats[3] - delta * (value - mean), 0.0)]
+
+
+def _combine(a: List[float], b: List[float]) -> List[float]:
+    """Chan et al.: merge two [n, total, mean, m2] accumulators of disjoint samples."""
+    n = a[0] + b[0]
+    if not n:
+        return [0, 0.0, 0.0, 0.0]
+    delta = b[2] - a[2]
+    return [n, a[1] + b[1], a[2] + delta * b[0] / n, a[3] + b[3] + delta * delta * a[0] * b[0] / n]
+
+
+def _two_pass(values: List[float]) -> List[float]:
+    n = len(values)
+    mean = math.fsum(values) / n
+    return [n, math.fsum(values), mean, math.fsum((value - mean) ** 2 for value in values)]
+
+
+def _describe(stats: Tuple[int, float, float, float]) -> Dict[str, float]:
+    n, total, mean, m2 = stats
+    return {
+        'n': int(n),
+        'total': total,
+        'mean': mean,
+        'std': math.sqrt(m2 / (n - 1)) if n > 1 else 0.0,
+    }
+
+
+class ActivityAggregates:
+    """
+    Persisted per-type, per-period Welford aggregates of one athlete's activities.
+    """
+
+    def __init__(
+        self,
+        db_path: str,
+        athlete_id: int = 0,
+        windows_days: Iterable[int] = config.AGGREGATE_WINDOWS_DAYS
+    ) -> None:
+        """Initialize the aggregates of one athlete and create their tables if needed."""
+        self.db_path = db_path
+        self.athlete_id = athlete_id
+        self.windows_days = tuple(windows_days)
+        self.initialize()
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    def initialize(self) -> None:
+        """Create the activity_aggregates, aggregate_contributions and aggregate_windows tables."""
+        metric_columns = ', '.join(f'{metric} REAL' for metric in METRICS)
+        with closing(self._connect()) as conn, conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS activity_aggregates (
+                    athlete_id INTEGER NOT NULL,
+                    type TEXT NOT NULL,
+                    period TEXT NOT NULL,
+                    bucket TEXT NOT NULL,
+                    metric TEXT NOT NULL,
+                    n INTEGER NOT NULL,
+                    total REAL NOT NULL,
+                    mean REAL NOT NULL,
+                    m2 REAL NOT NULL,
+                    PRIMARY KEY (athlete_id, type, period, bucket, metric)
+                )
+            """)
+            conn.execute(f"""
+                CREATE TABLE IF NOT EXISTS aggregate_contributions (
+                    athlete_id INTEGER NOT NULL,
+                    activity_id INTEGER NOT NULL,
+                    type TEXT NOT NULL,
+                    start_ts REAL NOT NULL,
+                    {metric_columns},
+                    PRIMARY KEY (athlete_id, activity_id)
+                )
+            """)
+            conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_aggregate_contributions_start
+                ON aggregate_contributions (athlete_id, start_ts)
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS aggregate_windows (
+                    athlete_id INTEGER NOT NULL,
+                    days INTEGER NOT NULL,
+                    cutoff_ts REAL NOT NULL,
+                    PRIMARY KEY (athlete_id, days)
+                )
+            """)
+
+    def has_state(self) -> bool:
+        """Check whether the aggregates have been built for this athlete."""
+        with closing(self._connect()) as conn:
+            row = conn.execute(
+                "SELECT 1 FROM aggregate_windows WHERE athlete_id = ? LIMIT 1", (self.athlete_id,)
+            ).fetchone()
+        return row is not None
+
+    def _load_contribution(
+        self,
+        conn: sqlite3.Connection,
+        activity_id: int
+    ) -> Optional[Tuple[str, float, Dict[str, float]]]:
+        row = conn.execute(
+            f"""
+            SELECT type, start_ts, {', '.join(METRICS)} FROM aggregate_contributions
+            WHERE athlete_id = ? AND activity_id = ?
+            """,
+            (self.athlete_id, activity_id)
+        ).fetchone()
+        if row is None:
+            return None
+        values = {metric: value for metric, value in zip(METRICS, row[2:]) if value is not None}
+        return row[0], row[1], values
+
+    def _load_windows(self, conn: sqlite3.Connection, now: float) -> Dict[int, float]:
+        rows = dict(conn.execute(
+            "SELECT days, cutoff_ts FROM aggregate_windows WHERE athlete_id = ?", (self.athlete_id,)
+        ).fetchall())
+        return {days: rows.get(days, now - days * DAY_SECONDS) for days in self.windows_days}
+
+    def _buckets(self, start_ts: float, windows: Dict[int, float]) -> List[Tuple[str, str]]:
+        buckets = calendar_buckets(start_ts)
+        buckets += [('rolling', f'{days}d') for days, cutoff in windows.items() if start_ts > cutoff]
+        return buckets
+
+    def _update(
+        self,
+        conn: sqlite3.Connection,
+        rows: Dict[Key, List[float]],
+        activity_type: str,
+        buckets: List[Tuple[str, str]],
+        values: Dict[str, float],
+        remove: bool = False
+    ) -> None:
+        """Add (or remove) one activity's values to the cached rows of its buckets."""
+        for period, bucket in buckets:
+            for metric, value in values.items():
+                key = (activity_type, period, bucket, metric)
+                stats = rows.get(key)
+                if stats is None:
+                    row = conn.execute(
+                        """
+                        SELECT n, total, mean, m2 FROM activity_aggregates
+                        WHERE athlete_id = ? AND type = ? AND period = ? AND bucket = ? AND metric = ?
+                        """,
+                        (self.athlete_id, *key)
+                    ).fetchone()
+                    stats = rows[key] = list(row) if row else [0, 0.0, 0.0, 0.0]
+                (_remove if remove else _add)(stats, value)
+
+    def _advance(
+        self,
+        conn: sqlite3.Connection,
+        rows: Dict[Key, List[float]],
+        windows: Dict[int, float],
+        now: float
+    ) -> None:
+        """Move the rolling windows to end at `now`, removing the activities that left them."""
+        for days, cutoff in windows.items():
+            new_cutoff = now - days * DAY_SECONDS
+            if new_cutoff <= cutoff:
+                continue
+            expired = conn.execute(
+                f"""
+                SELECT type, {', '.join(METRICS)} FROM aggregate_contributions
+                WHERE athlete_id = ? AND start_ts > ? AND start_ts <= ?
+                """,
+                (self.athlete_id, cutoff, new_cutoff)
+            ).fetchall()
+            for row in expired:
+                values = {metric: value for metric, value in zip(METRICS, row[1:]) if value is not None}
+                self._update(conn, rows, row[0], [('rolling', f'{days}d')], values, remove=True)
+            windows[days] = new_cutoff
+
+    def _save(self, conn: sqlite3.Connection, rows: Dict[Key, List[float]], windows: Dict[int, float]) -> None:
+        conn.executemany(
+            """
+            DELETE FROM activity_aggregates
+            WHERE athlete_id = ? AND type = ? AND period = ? AND bucket = ? AND metric = ?
+            """,
+            [(self.athlete_id, *key) for key, stats in rows.items() if stats[0] <= 0]
+        )
+        conn.executemany(
+            """
+            INSERT OR REPLACE INTO activity_aggregates
+                (athlete_id, type, period, bucket, metric, n, total, mean, m2)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            [(self.athlete_id, *key, *stats) for key, stats in rows.items() if stats[0] > 0]
+        )
+        conn.executemany(
+            "INSERT OR REPLACE INTO aggregate_windows (athlete_id, days, cutoff_ts) VALUES (?, ?, ?)",
+            [(self.athlete_id, days, cutoff) for days, cutoff in windows.items()]
+        )
+
+    def apply(self, records: Iterable[Dict[str, Any]], now: Optional[float] = None) -> int:
+        """
+        Add new or edited activities to the aggregates.
+
+        Records already applied unchanged are skipped; edited ones replace their
+        previous contribution.
+
+        Args:
+            records: Activity store records
+            now: Epoch time the rolling windows end at (default: current time)
+
+        Returns:
+            int: Number of activities added or changed
+        """
+        now = time.time() if now is None else now
+        changed = 0
+        rows: Dict[Key, List[float]] = {}
+        with closing(self._connect()) as conn, conn:
+            windows = self._load_windows(conn, now)
+            self._advance(conn, rows, windows, now)
+            for record in records:
+                activity_id = int(record['id'])
+                activity_type = record.get('type') or 'Unknown'
+                start_ts = start_timestamp(record)
+                values = _values(record)
+                previous = self._load_contribution(conn, activity_id)
+                if previous == (activity_type, start_ts, values):
+                    continue
+                if previous is not None:
+                    previous_type, previous_start, previous_values = previous
+                    self._update(
+                        conn, rows, previous_type, self._buckets(previous_start, windows),
+                        previous_values, remove=True
+                    )
+                self._update(conn, rows, activity_type, self._buckets(start_ts, windows), values)
+                conn.execute(
+                    f"""
+                    INSERT OR REPLACE INTO aggregate_contributions
+                        (athlete_id, activity_id, type, start_ts, {', '.join(METRICS)})
+                    VALUES (?, ?, ?, ?, {', '.join('?' for _ in METRICS)})
+                    """,
+                    (self.athlete_id, activity_id, activity_type, start_ts, *(values.get(metric) for metric in METRICS))
+                )
+                changed += 1
+            self._save(conn, rows, windows)
+        return changed
+
+    def remove(self, activity_ids: Iterable[int], now: Optional[float] = None) -> int:
+        """
+        Remove deleted activities from the aggregates.
+
+        Args:
+            activity_ids: Ids of deleted activities
+            now: Epoch time the rolling windows end at (default: current time)
+
+        Returns:
+            int: Number of activities removed
+        """
+        now = time.time() if now is None else now
+        removed = 0
+        rows: Dict[Key, List[float]] = {}
+        with closing(self._connect()) as conn, conn:
+            windows = self._load_windows(conn, now)
+            self._advance(conn, rows, windows, now)
+            for activity_id in activity_ids:
+                previous = self._load_contribution(conn, int(activity_id))
+                if previous is None:
+                    continue
+                activity_type, start_ts, values = previous
+                self._update(conn, rows, activity_type, self._buckets(start_ts, windows), values, remove=True)
+                conn.execute(
+                    "DELETE FROM aggregate_contributions WHERE athlete_id = ? AND activity_id = ?",
+                    (self.athlete_id, int(activity_id))
+                )
+                removed += 1
+            self._save(conn, rows, windows)
+        return removed
+
+    def get(
+        self,
+        activity_type: Optional[str] = None,
+        period: str = 'lifetime',
+        bucket: str = '',
+        now: Optional[float] = None
+    ) -> Dict[str, Dict[str, Dict[str, float]]]:
+        """
+        Read the aggregates of one period bucket.
+
+        Args:
+            activity_type: Activity type, e.g. 'Run'; None for every type
+            period: One of `PERIODS`
+            bucket: '' for lifetime, the week's Monday ('YYYY-MM-DD'), the month
+                ('YYYY-MM') or the rolling window (e.g. '28d')
+            now: Epoch time the rolling windows end at (default: current time)
+
+        Returns:
+            Dict[str, Dict[str, Dict[str, float]]]: type -> metric -> n, total, mean and
+            sample standard deviation
+        """
+        if period == 'rolling':
+            self.advance(now)
+        query = """
+            SELECT type, metric, n, total, mean, m2 FROM activity_aggregates
+            WHERE athlete_id = ? AND period = ? AND bucket = ?
+        """
+        params: Tuple[Any, ...] = (self.athlete_id, period, bucket)
+        if activity_type is not None:
+            query += " AND type = ?"
+            params += (activity_type,)
+        result: Dict[str, Dict[str, Dict[str, float]]] = {}
+        with closing(self._connect()) as conn:
+            for row in conn.execute(query, params):
+                result.setdefault(row[0], {})[row[1]] = _describe(row[2:])
+        return result
+
+    def series(self, activity_type: str, period: str, limit: int = 12) -> List[Dict[str, Any]]:
+        """
+        Read the most recent week or month buckets of one activity type, newest first.
+
+        Returns:
+            List[Dict[str, Any]]: Per bucket: `bucket` and metric -> statistics
+        """
+        with closing(self._connect()) as conn:
+            rows = conn.execute(
+                """
+                SELECT bucket, metric, n, total, mean, m2 FROM activity_aggregates
+                WHERE athlete_id = ? AND type = ? AND period = ? AND bucket IN (
+                    SELECT DISTINCT bucket FROM activity_aggregates
+                    WHERE athlete_id = ? AND type = ? AND period = ?
+                    ORDER BY bucket DESC LIMIT ?
+                )
+                ORDER BY bucket DESC
+                """,
+                (self.athlete_id, activity_type, period, self.athlete_id, activity_type, period, limit)
+            ).fetchall()
+        buckets: Dict[str, Dict[str, Any]] = {}
+        for row in rows:
+            buckets.setdefault(row[0], {'bucket': row[0]})[row[1]] = _describe(row[2:])
+        return list(buckets.values())
+
+    def advance(self, now: Optional[float] = None) -> None:
+        """Move the rolling windows forward to end at `now` (default: current time)."""
+        now = time.time() if now is None else now
+        rows: Dict[Key, List[float]] = {}
+        with closing(self._connect()) as conn, conn:
+            windows = self._load_windows(conn, now)
+            self._advance(conn, rows, windows, now)
+            self._save(conn, rows, windows)
+
+    def _recompute(
+        self,
+        chunks: Iterable[List[Dict[str, Any]]],
+        now: float
+    ) -> Tuple[Dict[Key, List[float]], List[Tuple[Any, ...]], Dict[int, float]]:
+        """Compute every row from scratch: two-pass statistics per chunk, merged with Chan's formula."""
+        windows = {days: now - days * DAY_SECONDS for days in self.windows_days}
+        rows: Dict[Key, List[float]] = {}
+        contributions = []
+        for records in chunks:
+            samples: Dict[Key, List[float]] = {}
+            for record in records:
+                activity_type = record.get('type') or 'Unknown'
+                start_ts = start_timestamp(record)
+                values = _values(record)
+                contributions.append((
+                    self.athlete_id, int(record['id']), activity_type, start_ts,
+                    *(values.get(metric) for metric in METRICS)
+                ))
+                for period, bucket in self._buckets(start_ts, windows):
+                    for metric, value in values.items():
+                        samples.setdefault((activity_type, period, bucket, metric), []).append(value)
+            for key, values in samples.items():
+                rows[key] = _combine(rows.get(key, [0, 0.0, 0.0, 0.0]), _two_pass(values))
+        return rows, contributions, windows
+
+    def rebuild(self, chunks: Iterable[List[Dict[str, Any]]], now: Optional[float] = None) -> int:
+        """
+        Replace the aggregates with ones recomputed from every stored activity.
+
+        Args:
+            chunks: Chunks of activity store records, e.g. `ActivityStore.iter_activities()`
+            now: Epoch time the rolling windows end at (default: current time)
+
+        Returns:
+            int: Number of activities aggregated
+        """
+        now = time.time() if now is None else now
+        rows, contributions, windows = self._recompute(chunks, now)
+        with closing(self._connect()) as conn, conn:
+            for table in ('activity_aggregates', 'aggregate_contributions', 'aggregate_windows'):
+                conn.execute(f"DELETE FROM {table} WHERE athlete_id = ?", (self.athlete_id,))
+            conn.executemany(
+                f"""
+                INSERT INTO aggregate_contributions
+                    (athlete_id, activity_id, type, start_ts, {', '.join(METRICS)})
+                VALUES (?, ?, ?, ?, {', '.join('?' for _ in METRICS)})
+                """,
+                contributions
+            )
+            self._save(conn, rows, windows)
+        return len(contributions)
+
+    def verify(
+        self,
+        chunks: Iterable[List[Dict[str, Any]]],
+        now: Optional[float] = None,
+        rel_tol: float = 1e-6
+    ) -> List[str]:
+        """
+        Compare the incremental aggregates with a rebuild from every stored activity.
+
+        Args:
+            chunks: Chunks of activity store records, e.g. `ActivityStore.iter_activities()`
+            now: Epoch time the rolling windows end at (default: current time)
+            rel_tol: Relative tolerance for totals, means and variances
+
+        Returns:
+            List[str]: One description per row that is missing, extra or differs; empty
+            if the aggregates are consistent
+        """
+        now = time.time() if now is None else now
+        self.advance(now)
+        expected, _, _ = self._recompute(chunks, now)
+        with closing(self._connect()) as conn:
+            actual = {
+                tuple(row[:4]): list(row[4:]) for row in conn.execute(
+                    """
+                    SELECT type, period, bucket, metric, n, total, mean, m2 FROM activity_aggregates
+                    WHERE athlete_id = ?
+                    """,
+                    (self.athlete_id,)
+                )
+            }
+        mismatches = []
+        for key in sorted(set(expected) | set(actual)):
+            want, have = expected.get(key), actual.get(key)
+            if want is None or have is None:
+                mismatches.append(f"{'/'.join(key)}: {'extra' if want is None else 'missing'}")
+            elif want[0] != have[0] or not all(
+                math.isclose(w, h, rel_tol=rel_tol, abs_tol=rel_tol) for w, h in zip(want[1:], have[1:])
+            ):
+                mismatches.append(f"{'/'.join(key)}: expected {want}, stored {have}")
+        return mismatches
+
+
+if __name__ == '__main__':
+    import argparse
+
+    from app.activity_store import ActivityStore
+    from app.athletes import activity_store_path
+
+    parser = argparse.ArgumentParser(description='Verify or rebuild the materialized activity aggregates.')
+    parser.add_argument('--athlete-id', type=int, help='Strava athlete id; omit for the default athlete')
+    parser.add_argument('--rebuild', action='store_true', help='Rebuild the aggregates after verifying them')
+    args = parser.parse_args()
+
+    store = ActivityStore(activity_store_path(args.athlete_id))
+    aggregates = ActivityAggregates(store.db_path, args.athlete_id or 0)
+    mismatches = aggregates.verify(store.iter_activities(config.PROCESS_CHUNK_SIZE))
+    for mismatch in mismatches:
+        print(mismatch)
+    print(f"{len(mismatches)} aggregate rows differ from a rebuild.")
+    if args.rebuild:
+        count = aggregates.rebuild(store.iter_activities(config.PROCESS_CHUNK_SIZE))
+        print(f"Rebuilt the aggregates of {count} activities.")
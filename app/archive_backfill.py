@@ -0,0 +1,454 @@
+"""
+Offline backfill of an athlete's history from a Strava account export.
+
+Paging through `get_activities` for years of history takes one rate-limited
+request per 200 activities. Strava's "Download your data" archive has the same
+history offline: `activities.csv` with one row per activity, and the recorded
+GPX/TCX/FIT files under `activities/`. This module loads such an archive (the
+zip, or the directory it was extracted to) into the athlete's activity store:
+
+1. `activities.csv` is streamed into store records (`ACTIVITY_FIELDS`, the schema
+   `DataPreprocessor.process_run_data` reads), one batch at a time, after a
+   first pass that finds the most recent runs.
+2. The GPX and TCX files of each batch are parsed in a process pool. Each yields
+   a summary that fills fields the CSV left empty (older exports have fewer
+   columns) and per-second streams, which are kept for the most recent runs.
+3. Each batch is written in one transaction and added to the training load.
+   Finally the activity aggregates are rebuilt and the similarity index is
+   marked for reload.
+
+Only one batch of rows and track summaries is held at a time, so memory does
+not grow with the length of the history.
+
+The store's high-water mark then sits at the newest archived activity, so the
+next sync only asks Strava for what was uploaded after the export. The reconcile
+pass is marked due, so that sync also re-reads the recent window for edits made
+since. FIT files need a decoder that is not a dependency; their activities are
+loaded from the CSV alone.
+
+Usage:
+    python -m app.archive_backfill export_12345.zip --athlete-id 12345
+"""
+
+import csv
+import gzip
+import heapq
+import io
+import math
+import os
+import time
+import zipfile
+import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from itertools import islice
+from typing import Any, Dict, Iterable, Iterator, List, Optional, TextIO, Tuple, Union
+
+import numpy as np
+
+import config
+from app.activity_store import ACTIVITY_FIELDS, ActivityStore
+from app.activity_streams import STREAM_DTYPES, StreamStore
+from app.aggregates import ActivityAggregates
+from app.athletes import activity_store_path, streams_dir
+from app.similarity_index import similarity_index
+from app.training_load import TrainingLoadTracker
+
+TRACK_SUFFIXES = ('.gpx', '.gpx.gz', '.tcx', '.tcx.gz')
+# Speed below which a sample counts as stopped, m/s
+MOVING_SPEED = 0.5
+EARTH_RADIUS_M = 6371008.8
+
+# activities.csv columns per store field. Fields that appear twice (a display
+# value, then the detailed one in base units) are read from the last non-empty one.
+CSV_COLUMNS = {
+    'distance': 'Distance',  # Meters in the detailed columns, km in the first
+    'moving_time': 'Moving Time',
+    'elapsed_time': 'Elapsed Time',
+    'total_elevation_gain': 'Elevation Gain',
+    'average_speed': 'Average Speed',
+    'max_speed': 'Max Speed',
+    'average_cadence': 'Average Cadence',
+    'average_heartrate': 'Average Heart Rate',
+    'weighted_average_watts': 'Weighted Average Power',
+    'max_heartrate': 'Max Heart Rate',
+    'suffer_score': 'Relative Effort',
+}
+CSV_DATE_FORMATS = ('%b %d, %Y, %I:%M:%S %p', '%Y-%m-%d %H:%M:%S')
+
+# Archive the pool's worker processes read track files from, see `_open_archive`
+_archive: Optional['Archive'] = None
+
+
+class Archive:
+    """
+    Read access to a Strava export, zipped or extracted.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._zip = zipfile.ZipFile(path) if zipfile.is_zipfile(path) else None
+
+    def read(self, name: str) -> bytes:
+        """Read a member by its path inside the archive, e.g. `activities/123.gpx.gz`."""
+        if self._zip is not None:
+            return self._zip.read(name)
+        with open(os.path.join(self.path, name), 'rb') as file:
+            return file.read()
+
+    def open_text(self, name: str) -> TextIO:
+        """Open a UTF-8 text member for streaming, e.g. `activities.csv`."""
+        if self._zip is not None:
+            return io.TextIOWrapper(self._zip.open(name), encoding='utf-8-sig', newline='')
+        return open(os.path.join(self.path, name), encoding='utf-8-sig', newline='')
+
+    def close(self) -> None:
+        if self._zip is not None:
+            self._zip.close()
+
+
+def _number(value: Optional[str]) -> Optional[float]:
+    try:
+        return float(value) if value else None
+    except ValueError:
+        return None
+
+
+def _parse_csv_date(value: str) -> Optional[datetime]:
+    for date_format in CSV_DATE_FORMATS:
+        try:
+            return datetime.strptime(value, date_format).replace(tzinfo=timezone.utc)
+        except ValueError:
+            continue
+    return None
+
+
+def read_activities_csv(text: Union[str, Iterable[str]]) -> Iterator[Tuple[Dict[str, Any], Optional[str]]]:
+    """
+    Read the rows of an export's `activities.csv` into store records, lazily.
+
+    Args:
+        text: Contents of `activities.csv`, or a text file opened on it
+
+    Returns:
+        Iterator of (record keyed by `ACTIVITY_FIELDS`, path of its track file in the
+        archive or None); rows without an id or a readable date are skipped
+    """
+    reader = csv.reader(io.StringIO(text) if isinstance(text, str) else text)
+    header = next(reader, [])
+    columns: Dict[str, List[int]] = {}
+    for index, name in enumerate(header):
+        columns.setdefault(name.strip(), []).append(index)
+
+    def cell(row: List[str], name: str) -> Optional[str]:
+        # The last non-empty occurrence: the detailed column, else the display one.
+        for index in reversed(columns.get(name, [])):
+            value = row[index].strip() if index < len(row) else ''
+            if value:
+                return value
+        return None
+
+    for row in reader:
+        activity_id = _number(cell(row, 'Activity ID'))
+        start_date = _parse_csv_date(cell(row, 'Activity Date') or '')
+        if activity_id is None or start_date is None:
+            continue
+        record: Dict[str, Any] = {field: None for field in ACTIVITY_FIELDS}
+        record.update({field: _number(cell(row, column)) for field, column in CSV_COLUMNS.items()})
+        record['id'] = int(activity_id)
+        record['name'] = cell(row, 'Activity Name')
+        # Types are spelled with spaces in the export ("Virtual Run"), not in the API.
+        record['type'] = (cell(row, 'Activity Type') or '').replace(' ', '') or None
+        record['start_date'] = start_date.isoformat()
+        if len(columns.get('Distance', [])) < 2 and record['distance'] is not None:
+            record['distance'] *= 1000  # Only the km display column was exported
+        total_work = _number(cell(row, 'Total Work'))
+        record['calories'] = total_work / 1000 if total_work else None  # kJ, as synced from the API
+        yield record, cell(row, 'Filename') or None
+
+
+def _local(tag: str) -> str:
+    return tag.rsplit('}', 1)[-1]
+
+
+def _timestamp(value: str) -> float:
+    return datetime.fromisoformat(value.strip().replace('Z', '+00:00')).timestamp()
+
+
+# Track point fields by the local name of the element holding them, in GPX and TCX
+TRACK_FIELDS = {
+    'time': 'time', 'Time': 'time', 'ele': 'altitude', 'AltitudeMeters': 'altitude',
+    'DistanceMeters': 'distance', 'hr': 'heartrate', 'cad': 'cadence', 'Cadence': 'cadence',
+    'RunCadence': 'cadence', 'LatitudeDegrees': 'lat', 'LongitudeDegrees': 'lon',
+    'Value': 'heartrate',  # TCX nests heart rate in HeartRateBpm
+}
+POINT_COLUMNS = ('time', 'lat', 'lon', 'altitude', 'distance', 'heartrate', 'cadence')
+
+
+def _track_points(data: bytes, track_format: str) -> Dict[str, List[float]]:
+    """Read time, position, altitude, distance, heart rate and cadence of each track point."""
+    point_path = './/{*}trkpt' if track_format == 'gpx' else './/{*}Trackpoint'
+    fields: Dict[str, Optional[str]] = {}  # Namespaced tag -> field, resolved once per tag
+    points: Dict[str, List[float]] = {key: [] for key in POINT_COLUMNS}
+    for element in ET.fromstring(data.strip()).iterfind(point_path):
+        values: Dict[str, Optional[float]] = {}
+        if track_format == 'gpx':
+            values['lat'] = _number(element.get('lat'))
+            values['lon'] = _number(element.get('lon'))
+        for child in element.iter():
+            tag = child.tag
+            if tag not in fields:
+                fields[tag] = TRACK_FIELDS.get(_local(tag))
+            name = fields[tag]
+            text = child.text
+            if name is None or not text or text.isspace():
+                continue
+            values[name] = _timestamp(text) if name == 'time' else _number(text.strip())
+        if values.get('time') is None:
+            continue
+        for key, column in points.items():
+            value = values.get(key)
+            column.append(np.nan if value is None else value)
+    return points
+
+
+def _smooth(values: np.ndarray, window: int = 5) -> np.ndarray:
+    """Centered moving average that ignores NaN."""
+    valid = np.isfinite(values)
+    kernel = np.ones(window)
+    totals = np.convolve(np.where(valid, values, 0.0), kernel, mode='same')
+    counts = np.convolve(valid.astype(np.float64), kernel, mode='same')
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return totals / counts
+
+
+def track_to_streams(data: bytes, track_format: str) -> Optional[Dict[str, np.ndarray]]:
+    """
+    Convert a GPX or TCX track into streams like those `StreamStore` holds.
+
+    Distance comes from the file when it records it (TCX), otherwise from the
+    great-circle distance between positions. Speed, grade and the moving flag are
+    derived from distance, altitude and time.
+
+    Args:
+        data: Contents of the track file, uncompressed
+        track_format: 'gpx' or 'tcx'
+
+    Returns:
+        Optional[Dict[str, np.ndarray]]: Streams keyed as `STREAM_DTYPES`, or None if
+        the file has fewer than two timed points
+    """
+    points = {key: np.asarray(values, dtype=np.float64) for key, values in _track_points(data, track_format).items()}
+    timestamps = points['time']
+    if len(timestamps) < 2:
+        return None
+    order = np.argsort(timestamps, kind='stable')
+    points = {key: values[order] for key, values in points.items()}
+    elapsed = points['time'] - points['time'][0]
+
+    lat, lon = np.radians(points['lat']), np.radians(points['lon'])
+    has_position = np.isfinite(lat).any()
+    if np.isfinite(points['distance']).any():
+        distance = np.fmax.accumulate(np.nan_to_num(points['distance']))
+    elif has_position:
+        # Haversine distance between consecutive positions; gaps in the fix add nothing.
+        a = (np.sin(np.diff(lat) / 2) ** 2
+             + np.cos(lat[:-1]) * np.cos(lat[1:]) * np.sin(np.diff(lon) / 2) ** 2)
+        steps = 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.clip(np.nan_to_num(a), 0.0, 1.0)))
+        distance = np.r_[0.0, np.cumsum(steps)]
+    else:
+        return None
+
+    dt, dd = np.diff(elapsed), np.diff(distance)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        speed = np.where(dt > 0, dd / dt, np.nan)
+        grade = np.where(dd > 1.0, np.diff(points['altitude']) / dd * 100, np.nan)
+    velocity = _smooth(np.r_[speed[:1], speed])
+    streams = {
+        'time': elapsed,
+        'distance': distance,
+        'heartrate': points['heartrate'],
+        'velocity_smooth': velocity,
+        'cadence': points['cadence'],
+        'altitude': points['altitude'],
+        'grade_smooth': _smooth(np.r_[grade[:1], grade]),
+        'moving': np.nan_to_num(velocity) > MOVING_SPEED,
+    }
+    if has_position:
+        streams['latlng'] = np.column_stack([points['lat'], points['lon']])
+    return {
+        key: np.asarray(values, dtype=STREAM_DTYPES[key]) for key, values in streams.items()
+        if key in ('time', 'distance', 'moving', 'latlng') or np.isfinite(values).any()
+    }
+
+
+def streams_summary(streams: Dict[str, np.ndarray]) -> Dict[str, Any]:
+    """Summarize streams into the store fields they determine."""
+    elapsed = streams['time'].astype(np.float64)
+    dt = np.diff(elapsed, append=elapsed[-1])
+    dt[dt > config.STREAM_MAX_GAP_SECONDS] = 0.0
+    moving_time = float(dt[streams['moving']].sum())
+    distance = float(streams['distance'][-1])
+    summary: Dict[str, Any] = {
+        'distance': distance,
+        'moving_time': moving_time,
+        'elapsed_time': float(elapsed[-1]),
+        'average_speed': distance / moving_time if moving_time else None,
+    }
+    if 'velocity_smooth' in streams:
+        summary['max_speed'] = float(np.nanmax(streams['velocity_smooth']))
+    if 'altitude' in streams:
+        climbs = np.diff(_smooth(streams['altitude'].astype(np.float64)))
+        summary['total_elevation_gain'] = float(np.nansum(climbs[climbs > 0]))
+    if 'heartrate' in streams:
+        summary['average_heartrate'] = float(np.nanmean(streams['heartrate']))
+        summary['max_heartrate'] = float(np.nanmax(streams['heartrate']))
+    if 'cadence' in streams and streams['moving'].any():
+        cadence = streams['cadence'][streams['moving']]
+        if np.isfinite(cadence).any():
+            summary['average_cadence'] = float(np.nanmean(cadence))
+    return summary
+
+
+def _open_archive(path: str) -> None:
+    """Pool initializer: open the archive once per worker process."""
+    global _archive
+    _archive = Archive(path)
+
+
+def parse_track(task: Tuple[int, str, bool]) -> Tuple[int, Optional[Dict[str, Any]], Optional[Dict[str, np.ndarray]]]:
+    """
+    Parse one track file of the archive opened by `_open_archive`; runs in a pool worker.
+
+    Args:
+        task: Activity id, path of the file in the archive, and whether to return its streams
+
+    Returns:
+        Tuple of the activity id, its summary (None if the file could not be read)
+        and its streams if they were asked for
+    """
+    activity_id, name, keep_streams = task
+    try:
+        data = _archive.read(name)
+        if name.endswith('.gz'):
+            data = gzip.decompress(data)
+        streams = track_to_streams(data, 'tcx' if '.tcx' in name else 'gpx')
+    except Exception as e:
+        print(f"Could not parse {name}: {str(e)}")
+        return activity_id, None, None
+    if streams is None:
+        return activity_id, None, None
+    return activity_id, streams_summary(streams), streams if keep_streams else None
+
+
+def _batched(iterable: Iterator[Any], size: int) -> Iterator[List[Any]]:
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def _recent_runs(archive: Archive, count: int) -> set:
+    """Ids of the `count` most recent runs in the archive, in one streaming pass."""
+    if count <= 0:
+        return set()
+    newest: List[Tuple[str, int]] = []
+    with archive.open_text('activities.csv') as file:
+        for record, _ in read_activities_csv(file):
+            if record['type'] != 'Run':
+                continue
+            entry = (record['start_date'], record['id'])
+            if len(newest) < count:
+                heapq.heappush(newest, entry)
+            elif entry > newest[0]:
+                heapq.heapreplace(newest, entry)
+    return {activity_id for _, activity_id in newest}
+
+
+def backfill_archive(
+    path: str,
+    athlete_id: Optional[int] = None,
+    workers: Optional[int] = None,
+    batch_size: int = config.BACKFILL_BATCH_SIZE,
+    stream_runs: int = config.STREAMS_FETCH_RECENT_RUNS
+) -> Dict[str, int]:
+    """
+    Load a Strava export archive into an athlete's activity store.
+
+    Args:
+        path: The export zip, or the directory it was extracted to
+        athlete_id: Strava athlete id, or None for the default athlete
+        workers: Processes parsing track files; defaults to the CPU count
+        batch_size: Records read, parsed and written together
+        stream_runs: Most recent runs whose streams are stored
+
+    Returns:
+        Dict[str, int]: Activities written, track files parsed and streams stored
+    """
+    store_path = activity_store_path(athlete_id)
+    os.makedirs(os.path.dirname(store_path) or '.', exist_ok=True)
+    store = ActivityStore(store_path)
+    training_load = TrainingLoadTracker(store.db_path, athlete_id or 0)
+    stream_store = StreamStore(streams_dir(athlete_id))
+    stats = {'activities': 0, 'tracks': 0, 'streams': 0}
+    chunk_divisor = (workers or os.cpu_count() or 1) * 4
+
+    archive = Archive(path)
+    try:
+        recent_runs = _recent_runs(archive, stream_runs)
+        with ProcessPoolExecutor(workers, initializer=_open_archive, initargs=(path,)) as pool, \
+                archive.open_text('activities.csv') as file:
+            for rows in _batched(read_activities_csv(file), batch_size):
+                tasks = [
+                    (record['id'], name, record['id'] in recent_runs) for record, name in rows
+                    if name and name.lower().endswith(TRACK_SUFFIXES)
+                ]
+                summaries: Dict[int, Dict[str, Any]] = {}
+                chunksize = max(1, len(tasks) // chunk_divisor)
+                for activity_id, summary, streams in pool.map(parse_track, tasks, chunksize=chunksize):
+                    if summary is None:
+                        continue
+                    summaries[activity_id] = summary
+                    stats['tracks'] += 1
+                    if streams is not None:
+                        stream_store.save(activity_id, streams)
+                        stats['streams'] += 1
+
+                records = [record for record, _ in rows]
+                for record in records:
+                    for field, value in summaries.get(record['id'], {}).items():
+                        if record.get(field) is None and value is not None and math.isfinite(value):
+                            record[field] = value
+                stats['activities'] += store.upsert_activities(records)
+                training_load.apply(records)
+    finally:
+        archive.close()
+
+    if stats['activities']:
+        # Cheaper in one pass than incrementally for a whole history.
+        ActivityAggregates(store.db_path, athlete_id or 0).rebuild(store.iter_activities(config.PROCESS_CHUNK_SIZE))
+        # Running apps reload their similarity index from the store.
+        similarity_index(store.db_path, athlete_id or 0).invalidate()
+        # The next sync reconciles the recent window against Strava.
+        store.clear_state('last_reconciled_at')
+    return stats
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Backfill activity history from a Strava export archive.')
+    parser.add_argument('archive', help='Export zip, or the directory it was extracted to')
+    parser.add_argument('--athlete-id', type=int, help='Strava athlete id; omit for the default athlete')
+    parser.add_argument('--workers', type=int, help='Processes parsing track files (default: CPU count)')
+    parser.add_argument('--batch-size', type=int, default=config.BACKFILL_BATCH_SIZE,
+                        help='Activities read, parsed and written together')
+    parser.add_argument('--stream-runs', type=int, default=config.STREAMS_FETCH_RECENT_RUNS,
+                        help='Most recent runs to keep per-second streams for')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    stats = backfill_archive(args.archive, args.athlete_id, args.workers, args.batch_size, args.stream_runs)
+    print(
+        f"Backfilled {stats['activities']} activities ({stats['tracks']} track files parsed, "
+        f"{stats['streams']} with streams stored) in {time.perf_counter() - start:.1f}s"
+    )
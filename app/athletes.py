@@ -0,0 +1,179 @@
+"""
+Athlete registry and per-athlete storage layout.
+
+Webhook events are routed by their `owner_id`. Each onboarded athlete has
+delivery settings in the registry, Strava tokens in their own token file and
+a data directory holding their activity store and snapshots, so athletes
+never share files. When no athletes are registered the app runs in
+single-athlete mode with the default token file, `EMAIL_RECEIVER` and the
+paths in `config`; that athlete is represented by an id of None.
+"""
+
+import os
+import sqlite3
+from contextlib import closing
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+import config
+
+
+@dataclass
+class AthleteSettings:
+    """Delivery settings for one athlete; `athlete_id` is None for the default athlete."""
+
+    athlete_id: Optional[int]
+    email_receiver: Optional[str]
+    enabled: bool = True
+
+
+def athlete_data_dir(athlete_id: int) -> str:
+    """Return (and create) the data directory of an onboarded athlete."""
+    path = os.path.join(config.ATHLETE_DATA_DIR, str(int(athlete_id)))
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def activity_store_path(athlete_id: Optional[int]) -> str:
+    """Return the activity store database of an athlete."""
+    if athlete_id is None:
+        return config.ACTIVITY_STORE_PATH
+    return os.path.join(athlete_data_dir(athlete_id), 'activities.db')
+
+
+def snapshot_paths(athlete_id: Optional[int]) -> Tuple[str, str]:
+    """Return the processed data and summary statistics snapshot files of an athlete."""
+    if athlete_id is None:
+        return config.ACTIVITY_DATA_PATH, config.SUMMARY_STATS_PATH
+    directory = athlete_data_dir(athlete_id)
+    return (
+        os.path.join(directory, 'processed_run_data.json'),
+        os.path.join(directory, 'summary_statistics.json'),
+    )
+
+
+def streams_dir(athlete_id: Optional[int]) -> str:
+    """Return the directory holding an athlete's activity streams."""
+    if athlete_id is None:
+        return config.STREAMS_DIR
+    return os.path.join(athlete_data_dir(athlete_id), 'streams')
+
+
+def partition_key(athlete_id: Optional[int]) -> str:
+    """Return the job queue partition that serializes an athlete's events."""
+    return 'default' if athlete_id is None else f'athlete:{int(athlete_id)}'
+
+
+class AthleteRegistry:
+    """
+    SQLite registry of onboarded athletes and their delivery settings.
+    """
+
+    def __init__(self, db_path: str) -> None:
+        """Initialize the registry and create its table if needed."""
+        self.db_path = db_path
+        self.initialize()
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    def initialize(self) -> None:
+        """Create the athletes table if it doesn't exist."""
+        with closing(self._connect()) as conn, conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS athletes (
+                    athlete_id INTEGER PRIMARY KEY,
+                    email_receiver TEXT,
+                    enabled INTEGER NOT NULL DEFAULT 1,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+
+    def register(
+        self,
+        athlete_id: int,
+        email_receiver: str,
+        tokens: Optional[Dict[str, str]] = None
+    ) -> AthleteSettings:
+        """
+        Onboard an athlete or update their delivery settings.
+
+        Args:
+            athlete_id: Strava athlete id (the webhook `owner_id`)
+            email_receiver: Address advice emails are sent to
+            tokens: Strava tokens from the athlete's OAuth exchange, if new
+
+        Returns:
+            AthleteSettings: The stored settings
+        """
+        if tokens is not None:
+            from utils.token_utils import token_manager
+
+            token_manager.store(tokens, athlete_id)
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                """
+                INSERT INTO athletes (athlete_id, email_receiver, enabled) VALUES (?, ?, 1)
+                ON CONFLICT (athlete_id) DO UPDATE SET email_receiver = excluded.email_receiver
+                """,
+                (int(athlete_id), email_receiver)
+            )
+        return AthleteSettings(athlete_id=int(athlete_id), email_receiver=email_receiver)
+
+    def get(self, athlete_id: int) -> Optional[AthleteSettings]:
+        """Return the settings of a registered athlete, or None."""
+        with closing(self._connect()) as conn:
+            row = conn.execute(
+                "SELECT athlete_id, email_receiver, enabled FROM athletes WHERE athlete_id = ?",
+                (int(athlete_id),)
+            ).fetchone()
+        if row is None:
+            return None
+        return AthleteSettings(athlete_id=row[0], email_receiver=row[1], enabled=bool(row[2]))
+
+    def list(self) -> List[AthleteSettings]:
+        """Return all registered athletes."""
+        with closing(self._connect()) as conn:
+            rows = conn.execute(
+                "SELECT athlete_id, email_receiver, enabled FROM athletes ORDER BY athlete_id"
+            ).fetchall()
+        return [AthleteSettings(athlete_id=r[0], email_receiver=r[1], enabled=bool(r[2])) for r in rows]
+
+    def resolve(self, owner_id: Optional[int]) -> Optional[AthleteSettings]:
+        """
+        Map a webhook owner to the athlete whose data and settings to use.
+
+        Args:
+            owner_id: `owner_id` from the webhook payload
+
+        Returns:
+            Optional[AthleteSettings]: The registered athlete; the default athlete
+            when no athletes are registered; None if the owner is unknown
+        """
+        if owner_id is not None:
+            settings = self.get(owner_id)
+            if settings is not None:
+                return settings if settings.enabled else None
+        with closing(self._connect()) as conn:
+            (registered,) = conn.execute("SELECT COUNT(*) FROM athletes").fetchone()
+        if registered:
+            return None
+        return AthleteSettings(athlete_id=None, email_receiver=os.getenv('EMAIL_RECEIVER'))
+
+
+if __name__ == '__main__':
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description='Onboard an athlete for webhook processing.')
+    parser.add_argument('athlete_id', type=int, help='Strava athlete id (webhook owner_id)')
+    parser.add_argument('email', help='Address advice emails are sent to')
+    parser.add_argument('--tokens', help='JSON file with the athlete\'s Strava OAuth tokens')
+    args = parser.parse_args()
+
+    tokens = None
+    if args.tokens:
+        with open(args.tokens, 'r') as file:
+            tokens = json.load(file)
+    settings = AthleteRegistry(config.ATHLETE_REGISTRY_PATH).register(args.athlete_id, args.email, tokens)
+    print(f"Registered athlete {settings.athlete_id} -> {settings.email_receiver}")
@@ -5,27 +5,54 @@ This script handles authentication with the Strava API using tokens
 and provides functions to fetch activity data.
 """
 
-from typing import List, Dict
+from typing import Any, List, Dict, Optional
+import requests
 from stravalib import Client
-from utils.token_utils import load_tokens, refresh_tokens
+from app.metrics import count_strava_request
+from app.strava_scheduler import StravaScheduler, strava_scheduler
+from utils.token_utils import token_manager
 
-def get_strava_client() -> Client:
+
+class ScheduledSession(requests.Session):
+    """
+    Requests session that admits Strava API calls through a `StravaScheduler`.
+    """
+
+    def __init__(self, scheduler: StravaScheduler) -> None:
+        super().__init__()
+        self.scheduler = scheduler
+
+    def request(self, method: str, url: str, *args: Any, **kwargs: Any) -> requests.Response:
+        # OAuth token refreshes do not count against the API quota.
+        if '/api/v3/' in url:
+            self.scheduler.acquire()
+            count_strava_request(self.scheduler.current_priority().name.lower())
+        return super().request(method, url, *args, **kwargs)
+
+
+def create_client() -> Client:
+    """Create a Strava client whose requests go through the shared scheduler."""
+    return Client(
+        rate_limiter=strava_scheduler.record,
+        requests_session=ScheduledSession(strava_scheduler)
+    )
+
+
+def get_strava_client(athlete_id: Optional[int] = None) -> Client:
     """
     Get an authenticated Strava client.
 
+    Clients are cached per athlete and their tokens are refreshed shortly
+    before they expire, so repeated calls are cheap. All API requests of the
+    client go through the shared Strava rate-limit scheduler.
+
+    Args:
+        athlete_id (Optional[int]): Strava athlete id, or None for the default athlete.
+
     Returns:
         Client: An authenticated Strava client instance.
 
     Raises:
         RuntimeError: If no tokens are found or the tokens are invalid.
     """
-    tokens = load_tokens()
-    if not tokens:
-        raise RuntimeError("Tokens not found. You need to authenticate first.")
-    
-    client = Client()
-    tokens = refresh_tokens(client, tokens)
-    client.access_token = tokens['access_token']
-    client.refresh_token = tokens['refresh_token']
-    client.token_expires_at = tokens['expires_at']
-    return client
\ No newline at end of file
+    return token_manager.get_client(athlete_id, client_factory=create_client)
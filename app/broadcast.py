@@ -0,0 +1,163 @@
+"""
+Single-flight sharing of streamed generations between concurrent requests.
+
+Identical requests that arrive while a generation is running attach to it
+instead of starting their own: `GenerationBroadcaster.subscribe(key, start)`
+runs `start` once per key, and every subscriber receives the whole token
+stream. Chunks are kept in a buffer for the life of the generation, so a
+subscriber that joins late first receives everything generated so far.
+
+The generation runs in its own task and never waits for its subscribers. Each
+subscriber reads the buffer at its own pace and gets whatever has accumulated
+since its last read as one batch, so a slow consumer receives fewer, larger
+batches and cannot hold back the generation or the other subscribers. Once the
+generation ends the key is released and the next request starts a new one. If
+the stream fails part-way, every subscriber receives the error after the chunks
+generated before it.
+
+Example:
+    broadcaster = GenerationBroadcaster()
+    generation = broadcaster.subscribe(athlete_id, lambda: open_advice_stream(athlete_id))
+    await generation.opened()
+    async for batch in generation.follow():
+        ...
+"""
+
+import asyncio
+from typing import AsyncGenerator, AsyncIterator, Awaitable, Callable, Dict, Hashable, List, Optional
+
+from app import metrics
+
+
+class SharedGeneration:
+    """
+    One in-progress generation and the chunks it has produced so far.
+    """
+
+    def __init__(self, key: Hashable) -> None:
+        self.key = key
+        self.chunks: List[str] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self._opened: asyncio.Future = asyncio.get_running_loop().create_future()
+        self._changed = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def _notify(self) -> None:
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def _run(self, start: Callable[[], Awaitable[AsyncGenerator[str, None]]]) -> None:
+        try:
+            stream = await start()
+        except asyncio.CancelledError:
+            self._opened.cancel()
+            self._finish()
+            raise
+        except Exception as e:
+            self._opened.set_exception(e)
+            # Marks the exception retrieved, in case no subscriber is waiting for it.
+            self._opened.exception()
+            self._finish()
+            return
+        self._opened.set_result(None)
+        try:
+            async for chunk in stream:
+                if chunk:
+                    self.chunks.append(chunk)
+                    self._notify()
+        except Exception as e:
+            self.error = e
+        finally:
+            await stream.aclose()
+            self._finish()
+
+    def _finish(self) -> None:
+        self.done = True
+        self._notify()
+
+    async def opened(self) -> None:
+        """
+        Wait until the generation has started streaming.
+
+        Raises:
+            Exception: Whatever preparing the generation raised, e.g. processing the
+                activity data failed
+        """
+        await asyncio.shield(self._opened)
+
+    async def follow(self, heartbeat_seconds: Optional[float] = None) -> AsyncIterator[Optional[str]]:
+        """
+        Replay the chunks generated so far, then the new ones as they arrive.
+
+        Args:
+            heartbeat_seconds: If set, yield None whenever this long passes without
+                new chunks, so the caller can keep the connection alive
+
+        Returns:
+            AsyncIterator yielding every chunk not yet seen, joined into one batch,
+            or None for a heartbeat
+
+        Raises:
+            Exception: Whatever the stream raised part-way; the chunks yielded before
+                it are incomplete
+        """
+        sent = 0
+        while True:
+            if sent < len(self.chunks):
+                end = len(self.chunks)
+                yield ''.join(self.chunks[sent:end])
+                sent = end
+                continue
+            if self.done:
+                if self.error is not None:
+                    raise self.error
+                return
+            changed = self._changed
+            try:
+                await asyncio.wait_for(changed.wait(), heartbeat_seconds)
+            except asyncio.TimeoutError:
+                yield None
+
+
+class GenerationBroadcaster:
+    """
+    Shares one generation between concurrent requests with the same key.
+    """
+
+    def __init__(self) -> None:
+        self._generations: Dict[Hashable, SharedGeneration] = {}
+
+    def subscribe(self, key: Hashable, start: Callable[[], Awaitable[AsyncGenerator[str, None]]]) -> SharedGeneration:
+        """
+        Attach to the running generation for a key, starting it if there is none.
+
+        Args:
+            key: Identifies requests that would produce the same output
+            start: Prepares the generation and returns its chunk stream; only called
+                when no generation for `key` is running
+
+        Returns:
+            SharedGeneration: The generation to follow
+        """
+        generation = self._generations.get(key)
+        if generation is None:
+            generation = SharedGeneration(key)
+            self._generations[key] = generation
+            generation._task = asyncio.create_task(generation._run(start))
+            generation._task.add_done_callback(lambda _: self._release(generation))
+            metrics.STREAM_SUBSCRIBERS.labels(role='started').inc()
+        else:
+            metrics.STREAM_SUBSCRIBERS.labels(role='joined').inc()
+        return generation
+
+    def _release(self, generation: SharedGeneration) -> None:
+        if self._generations.get(generation.key) is generation:
+            del self._generations[generation.key]
+
+    async def close(self) -> None:
+        """Cancel the running generations."""
+        tasks = [generation._task for generation in self._generations.values() if generation._task is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -1,15 +1,171 @@
 """
 Data Preprocessing Script for Strava Activities - mainly runs.
 
-This script encapsulates functionality for fetching activity data from the Strava API,
-preprocessing it to generate a semi-structured dataset for run activities,
-and computing summary statistics. The processed data and statistics are saved in JSON format
-for further use.
+This script encapsulates functionality for syncing activity data from the Strava API
+into a local activity store, preprocessing it to generate a semi-structured dataset
+for run activities, and computing summary statistics. The processed data and statistics
+are handed on in memory as a `ProcessedActivities` result and can optionally be saved
+as compact JSON snapshots.
+
+Activities are written to the store page by page as they arrive from Strava,
+and only the most recent runs are read back as records, so memory does not grow
+with the length of the history. Summary statistics and the weekly and monthly
+rollups are read from aggregates that syncs keep up to date (see
+`app.aggregates`).
+The per-second streams of the latest runs are fetched into a `StreamStore`, and
+metrics derived from them (splits, heart-rate zones, drift, grade-adjusted pace)
+are added to the result.
 """
 
+import json
+import os
+import tempfile
+import threading
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from itertools import islice
+from typing import Iterable, Iterator, List, Dict, Any, Optional
+
+import numpy as np
 import pandas as pd
+
+import config
+from app.activity_store import ActivityStore, activity_to_record
+from app.activity_streams import STREAM_DTYPES, StreamStore, stream_metrics, streams_to_arrays
+from app.aggregates import ActivityAggregates, calendar_buckets
+from app.athletes import activity_store_path, streams_dir
 from app.auth import get_strava_client
-from typing import List, Dict, Any
+from app.prompt_handler import Rollups, rollup_row
+from app.similarity_index import similarity_index
+from app.strava_scheduler import Priority, StravaBudgetExhausted, strava_scheduler
+from app.training_load import TrainingLoadTracker, advice_time
+
+# Stored columns needed for run processing and the dtypes they are loaded as.
+RUN_COLUMN_DTYPES = {
+    'id': np.int64,
+    'name': object,
+    'type': object,
+    'start_ts': np.int64,
+    'distance': np.float32,  # In meters
+    'moving_time': np.float32,  # In seconds
+    'elapsed_time': np.float32,  # In seconds
+    'total_elevation_gain': np.float32,  # In meters
+    'average_speed': np.float32,  # Speed in m/s
+    'max_speed': np.float32,  # Speed in m/s
+    'kudos_count': np.int32,
+}
+# Summary statistic -> (metric, statistic) read from the lifetime aggregates
+SUMMARY_STATISTICS = {
+    'avg_distance_km': ('distance_km', 'mean'),
+    'avg_moving_time_min': ('moving_time_min', 'mean'),
+    'avg_pace_min_per_km': ('pace_min_per_km', 'mean'),
+    'total_distance_km': ('distance_km', 'total'),
+    'total_moving_time_min': ('moving_time_min', 'total'),
+}
+# Aggregate metrics summed into the prompt's rollup rows, in `rollup_row` order
+ROLLUP_METRICS = ('activities', 'distance_km', 'moving_time_min', 'elevation_gain_m')
+
+
+@dataclass
+class ProcessedActivities:
+    """
+    Processed run records, summary statistics and training load, ready for prompt formatting.
+
+    `activities` holds the most recent runs only; `rollups` covers every run but
+    the latest. `stream_metrics` are derived from the latest run's streams, if stored,
+    and `similar_efforts` are the past runs most like it.
+    """
+
+    activities: List[Dict[str, Any]]
+    summary_statistics: List[Dict[str, Any]]
+    training_load: Dict[str, Any] = field(default_factory=dict)
+    rollups: Optional[Rollups] = None
+    stream_metrics: Dict[str, Any] = field(default_factory=dict)
+    similar_efforts: Dict[str, Any] = field(default_factory=dict)
+
+
+def _chunked(items: Iterable[Any], size: int) -> Iterator[List[Any]]:
+    """
+    Split an iterable into lists of at most `size` items, consuming it lazily.
+
+    stravalib's `BatchedResultsIterator` resets itself when it raises
+    StopIteration, and the next `next()` fetches page 1 again. So the iterator
+    must not be advanced after it was exhausted: a short chunk means the results
+    ran out, and the loop ends there. After a full chunk, the next `islice` hits
+    the end at most once, and returns a short or empty chunk.
+    """
+    iterator = iter(items)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+        if len(chunk) < size:
+            return
+
+
+def _run_frame(columns: Dict[str, np.ndarray]) -> pd.DataFrame:
+    """Build unit-converted run rows from stored column arrays in single vectorized passes."""
+    distance_km = columns['distance'] / np.float32(1000)
+    moving_time_min = columns['moving_time'] / np.float32(60)
+    elapsed_time_min = columns['elapsed_time'] / np.float32(60)
+    average_speed_kmh = columns['average_speed'] * np.float32(3.6)
+    max_speed_kmh = columns['max_speed'] * np.float32(3.6)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        pace_min_per_km = moving_time_min / distance_km
+
+    return pd.DataFrame({
+        'id': columns['id'],
+        'name': columns['name'],
+        'type': pd.Categorical(columns['type']),
+        'start_date': pd.to_datetime(columns['start_ts'], unit='s', utc=True),
+        'distance_km': distance_km,
+        'moving_time_min': moving_time_min,
+        'elapsed_time_min': elapsed_time_min,
+        'total_elevation_gain': columns['total_elevation_gain'],
+        'average_speed_kmh': average_speed_kmh,
+        'kudos_count': columns['kudos_count'],
+        'max_speed_kmh': max_speed_kmh,
+        'pace_min_per_km': pace_min_per_km,
+        'speed_diff_kmh': max_speed_kmh - average_speed_kmh,
+        'rest_time_min': elapsed_time_min - moving_time_min,
+    })
+
+
+def _to_records(df: pd.DataFrame) -> List[Dict[str, Any]]:
+    """Convert a DataFrame to JSON-ready records with ISO dates and None for missing values."""
+    if 'start_date' in df:
+        df = df.assign(start_date=df['start_date'].map(pd.Timestamp.isoformat))
+    # float32 columns are widened and rounded to their real precision so records
+    # don't carry float32 representation noise such as 1.9543000459671.
+    float32_columns = df.select_dtypes(include=[np.float32]).columns
+    if len(float32_columns):
+        df = df.astype({column: np.float64 for column in float32_columns})
+        df[float32_columns] = df[float32_columns].round(4)
+    return df.astype(object).where(df.notna(), None).to_dict('records')
+
+
+def _write_json_atomic(path: str, data: Any) -> None:
+    """Write compact JSON to a temporary file and rename it over `path`."""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as file:
+            json.dump(data, file, separators=(',', ':'))
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def write_snapshot(result: ProcessedActivities, processed_file: str, summary_file: str) -> None:
+    """
+    Atomically save a processed result as compact JSON snapshot files.
+
+    Parameters:
+    - result (ProcessedActivities): Result to persist.
+    - processed_file (str): File name for processed data JSON.
+    - summary_file (str): File name for summary statistics JSON.
+    """
+    _write_json_atomic(processed_file, result.activities)
+    _write_json_atomic(summary_file, result.summary_statistics)
 
 
 class DataPreprocessor:
@@ -17,95 +173,427 @@ class DataPreprocessor:
     Class for preprocessing Strava activity data and generating summary statistics.
     """
 
-    def __init__(self):
+    def __init__(self, store: Optional[ActivityStore] = None, athlete_id: Optional[int] = None):
         """
-        Initialize the DataPreprocessor with Strava API client and empty data attributes.
+        Initialize the DataPreprocessor with Strava API client, local activity store
+        and empty data attributes for one athlete.
+
+        Parameters:
+        - store (Optional[ActivityStore]): Activity store to use instead of the athlete's own.
+        - athlete_id (Optional[int]): Strava athlete id, or None for the default athlete.
         """
-        self.client = get_strava_client()
-        self.activities = []
+        self.athlete_id = athlete_id
+        self.client = get_strava_client(athlete_id)
+        self.store = store or ActivityStore(activity_store_path(athlete_id))
+        self.training_load = TrainingLoadTracker(self.store.db_path, athlete_id or 0)
+        self.aggregates = ActivityAggregates(self.store.db_path, athlete_id or 0)
+        self._aggregates_ready = False
+        self.similarity = similarity_index(self.store.db_path, athlete_id or 0)
+        self.streams = StreamStore(streams_dir(athlete_id))
+        # A webhook's ingest and the history sync may fetch streams concurrently.
+        self._streams_lock = threading.Lock()
+        # ... and both update the training load, aggregates and similarity index.
+        self._derived_lock = threading.RLock()
         self.run_df = pd.DataFrame()
         self.summary_stats = pd.DataFrame()
+        self.rollups = Rollups()
 
     def fetch_activities(self) -> None:
         """
-        Fetch activities from the Strava API.
+        Sync new activities from the Strava API into the local store.
 
-        Parameters:
-        - limit (int): Maximum number of activities to fetch (default: 100).
+        Only activities started after the store's high-water mark, less a short
+        overlap, are requested. A sync therefore costs one API call per
+        `config.SYNC_CHUNK_SIZE` (stravalib's page size, 200) new activities,
+        instead of one per page of the athlete's whole history. When the Strava
+        rate-limit budget is low the reconcile pass is postponed, and callers other
+        than webhook jobs fall back to the stored history if the budget is exhausted.
         """
-        self.activities = self.client.get_activities()
-        print(f"Fetched activities.")
+        self._ensure_derived_state()
+        try:
+            new_count = self.sync_activities()
+        except StravaBudgetExhausted as e:
+            # Webhook jobs are retried later; other callers fall back to the stored history.
+            if strava_scheduler.current_priority() == Priority.WEBHOOK or not self.store.count():
+                raise
+            print(f"{e}; using stored activities.")
+            return
+        if self._reconcile_due():
+            if strava_scheduler.is_low():
+                print("Strava rate-limit budget is low; postponing reconcile.")
+            else:
+                try:
+                    self.reconcile_activities()
+                except StravaBudgetExhausted as e:
+                    print(f"{e}; postponing reconcile.")
+        if config.STREAMS_ENABLED:
+            self.sync_streams()
+        print(f"Synced {new_count} activities, {self.store.count()} stored.")
 
-    def process_run_data(self) -> pd.DataFrame:
+    def sync_streams(self, recent_runs: int = config.STREAMS_FETCH_RECENT_RUNS) -> int:
         """
-        Process activity data for 'Run' activities.
+        Fetch the per-second streams of the most recent runs that don't have them yet.
+
+        Streams only enrich the advice, so they are skipped when the Strava budget is
+        low, and a failed fetch or write is reported but does not fail the sync. Concurrent
+        calls run one at a time, so no activity's streams are fetched twice.
+
+        Parameters:
+        - recent_runs (int): Number of most recent runs to cover.
 
         Returns:
-        - pd.DataFrame: Processed DataFrame containing unit-converted 'Run' activities.
-        """
-        activity_data = []
-        for activity in self.activities:
-            activity_data.append({
-                'id': activity.id,
-                'name': activity.name,
-                'type': activity.type,
-                'distance': activity.distance,  # In meters
-                'moving_time': activity.moving_time,  # In seconds
-                'elapsed_time': activity.elapsed_time,  # In seconds
-                'total_elevation_gain': activity.total_elevation_gain,  # In meters
-                'start_date': activity.start_date,
-                'average_speed': activity.average_speed,  # Speed in m/s
-                'max_speed': activity.max_speed if activity.max_speed else None,
-                'average_cadence': activity.average_cadence,
-                'average_heartrate': activity.average_heartrate,
-                'weighted_average_watts': activity.weighted_average_watts,
-                'kudos_count': activity.kudos_count,
-                'max_heartrate': activity.max_heartrate,
-                'suffer_score': activity.suffer_score,
-                'calories': activity.kilojoules if activity.kilojoules else None,
-            })
-
-        df = pd.DataFrame(activity_data)
-
-        df['start_date'] = pd.to_datetime(df['start_date'])
-        run_df = df[df['type'] == 'Run'].copy()
-
-        run_df['distance_km'] = run_df['distance'] / 1000
-        run_df['moving_time_min'] = run_df['moving_time'] / 60
-        run_df['elapsed_time_min'] = run_df['elapsed_time'] / 60
-        run_df['average_speed_kmh'] = run_df['average_speed'] * 3.6
-        run_df['max_speed_kmh'] = run_df['max_speed'] * 3.6
-
-        run_df['pace_min_per_km'] = run_df['moving_time_min'] / run_df['distance_km']
-        run_df['speed_diff_kmh'] = run_df['max_speed_kmh'] - run_df['average_speed_kmh']
-        run_df['rest_time_min'] = run_df['elapsed_time_min'] - run_df['moving_time_min']
-        run_df['type'] = run_df['type'].astype(str)
-
-        columns_to_keep = [
-            'id', 'name', 'type', 'start_date', 'distance_km', 'moving_time_min',
-            'elapsed_time_min', 'total_elevation_gain', 'average_speed_kmh', 'kudos_count',
-            'max_speed_kmh', 'pace_min_per_km', 'speed_diff_kmh', 'rest_time_min'
+        - int: Number of activities whose streams were fetched.
+        """
+        with self._streams_lock:
+            return self._sync_streams(recent_runs)
+
+    def _sync_streams(self, recent_runs: int) -> int:
+        missing = [
+            activity_id for activity_id in self.store.recent_ids('Run', recent_runs)
+            if not self.streams.has(activity_id)
         ]
-        self.run_df = run_df[columns_to_keep]
+        if not missing:
+            return 0
+        if strava_scheduler.is_low():
+            print("Strava rate-limit budget is low; skipping activity streams.")
+            return 0
+        fetched = 0
+        for activity_id in missing:
+            try:
+                streams = self.client.get_activity_streams(activity_id, types=list(STREAM_DTYPES))
+                self.streams.save(activity_id, streams_to_arrays(streams))
+            except StravaBudgetExhausted as e:
+                print(f"{e}; skipping activity streams.")
+                break
+            except Exception as e:
+                print(f"Could not fetch or store streams of activity {activity_id}: {str(e)}")
+                continue
+            fetched += 1
+        return fetched
+
+    def ingest_activities(self, activity_ids: Iterable[int]) -> List[Dict[str, Any]]:
+        """
+        Fetch activities by id and write them to the store ahead of the history sync.
+
+        A webhook names the activity it is about, so advice for it does not have to
+        wait for the sync. Before the first write the store's high-water mark is saved
+        as the sync floor, and the next sync starts from there: activities between
+        the stored history and the ingested ones are still picked up, and the
+        ingested ones are fetched again. They are added to the training load, the
+        aggregates and the similarity index right away, so advice started before
+        the sync covers them; applying them again during the sync changes nothing.
+        The streams of ingested runs are fetched right away.
+
+        Parameters:
+        - activity_ids (Iterable[int]): Strava ids of the activities to fetch.
+
+        Returns:
+        - List[Dict[str, Any]]: Store records of the activities that were fetched.
+        """
+        records = []
+        for activity_id in activity_ids:
+            try:
+                records.append(activity_to_record(self.client.get_activity(activity_id)))
+            except StravaBudgetExhausted:
+                raise
+            except Exception as e:
+                print(f"Could not fetch activity {activity_id}: {str(e)}")
+        if records:
+            if self.store.get_state('sync_floor') is None:
+                high_water_mark = self.store.get_high_water_mark()
+                if high_water_mark is not None:
+                    self.store.set_state('sync_floor', high_water_mark.isoformat())
+            self.store.upsert_activities(records)
+            self._apply_derived(records)
+            if config.STREAMS_ENABLED:
+                self.sync_streams()
+        return records
+
+    def _sync_chunks(self, after: datetime) -> Iterator[List[Dict[str, Any]]]:
+        """
+        Stream activities started after `after` from Strava, oldest first, and write
+        each chunk to the store and the training load as it arrives.
+
+        Yields:
+        - List[Dict[str, Any]]: The records of each chunk, after they were stored.
+        """
+        activities = self.client.get_activities(after=after)
+        for records in _chunked(map(activity_to_record, activities), config.SYNC_CHUNK_SIZE):
+            self.store.upsert_activities(records)
+            self._apply_derived(records)
+            yield records
+
+    def sync_activities(self) -> int:
+        """
+        Pull activities newer than the store's high-water mark and merge them in.
+
+        Strava returns activities oldest first when asked for those after a date, so
+        a first sync asks for everything after the epoch. Each page is stored as soon
+        as it arrives: an interrupted sync resumes from the last stored activity, and
+        the store is usable before the last page has been fetched. Activities ingested
+        by id move the high-water mark ahead of the sync, so it starts from the sync
+        floor saved before them instead, until a sync has completed.
+
+        Strava filters on the start date, not the upload date, so an activity uploaded
+        after a sync but started before its high-water mark (e.g. from a watch that
+        synced late) would never match. The sync therefore starts
+        `config.SYNC_OVERLAP_HOURS` before the high-water mark. Activities in the
+        overlap are fetched again, usually with the same single request, and storing
+        them again changes nothing. Uploads back-dated further than the overlap are
+        picked up by the reconcile pass within `config.RECONCILE_WINDOW_DAYS`.
+
+        Returns:
+        - int: Number of activities written to the store.
+        """
+        # The high-water mark is read before the floor: an ingest saves the floor
+        # before writing, so one of the two predates the ingested activities.
+        after = self.store.get_high_water_mark()
+        floor = self.store.get_state('sync_floor')
+        if floor is not None and after is not None:
+            after = min(after, datetime.fromisoformat(floor))
+        if after is not None:
+            after -= timedelta(hours=config.SYNC_OVERLAP_HOURS)
+        written = 0
+        for records in self._sync_chunks(after or datetime.fromtimestamp(0, tz=timezone.utc)):
+            written += len(records)
+        if floor is not None:
+            self.store.clear_state('sync_floor', expected=floor)
+        if after is None:
+            # A full-history fetch is as fresh as a reconcile pass.
+            self.store.set_state('last_reconciled_at', datetime.now(timezone.utc).isoformat())
+        return written
+
+    def reconcile_activities(self) -> None:
+        """
+        Re-read the recent reconcile window from Strava to pick up edits and deletions.
+
+        Activities in the window are overwritten with their current remote version,
+        and stored activities in the window that no longer exist remotely are deleted.
+        """
+        now = datetime.now(timezone.utc)
+        window_start = now - timedelta(days=config.RECONCILE_WINDOW_DAYS)
+        remote_ids = set()
+        for records in self._sync_chunks(window_start):
+            remote_ids.update(record['id'] for record in records)
+        deleted = self.store.activity_ids_since(window_start) - remote_ids
+        self.store.delete_activities(deleted)
+        with self._derived_lock:
+            self.training_load.remove(deleted)
+            self.aggregates.remove(deleted)
+            self.similarity.remove(deleted)
+        self.streams.delete(deleted)
+        self.store.set_state('last_reconciled_at', now.isoformat())
+        print(f"Reconciled {len(remote_ids)} recent activities, removed {len(deleted)}.")
+
+    def _reconcile_due(self) -> bool:
+        """Check whether the last reconcile pass is older than the reconcile interval."""
+        last = self.store.get_state('last_reconciled_at')
+        if last is None:
+            return True
+        elapsed = datetime.now(timezone.utc) - datetime.fromisoformat(last)
+        return elapsed >= timedelta(hours=config.RECONCILE_INTERVAL_HOURS)
+
+    def process_run_data(self, recent_limit: int = config.PROCESS_RECENT_RUNS) -> pd.DataFrame:
+        """
+        Process stored activity data for 'Run' activities.
+
+        Only the most recent `recent_limit` runs are read from the store, loaded
+        column-wise into compact typed arrays (float32/int32, categorical type) and
+        unit-converted in single vectorized passes. The weekly and monthly rollups of
+        the earlier runs are read from the aggregates (see `build_rollups`).
+
+        Parameters:
+        - recent_limit (int): Number of most recent runs to keep as rows.
+
+        Returns:
+        - pd.DataFrame: Processed DataFrame containing the most recent unit-converted
+          'Run' activities.
+        """
+        columns = next(self.store.iter_columns('Run', RUN_COLUMN_DTYPES, max(recent_limit, 1)), None)
+        if columns is None:
+            columns = {column: np.array([], dtype=dtype) for column, dtype in RUN_COLUMN_DTYPES.items()}
+        self.run_df = _run_frame(columns).iloc[:recent_limit].reset_index(drop=True)
+        self.rollups = self.build_rollups()
         return self.run_df
 
-    def calculate_summary_statistics(self) -> pd.DataFrame:
+    def build_rollups(
+        self,
+        weekly_limit: int = config.PROMPT_WEEKLY_ROLLUP_WEEKS,
+        monthly_limit: int = config.PROMPT_MONTHLY_ROLLUP_MONTHS
+    ) -> Rollups:
         """
-        Calculate summary statistics for 'Run' activities.
+        Read weekly and monthly run totals for the prompt from the aggregates.
+
+        The most recent `weekly_limit` weeks are reported weekly, and up to
+        `monthly_limit` months before the oldest of them monthly. The latest
+        processed run goes into the prompt in full, so it is subtracted from its
+        week and month.
+
+        Parameters:
+        - weekly_limit (int): Number of most recent weeks to report.
+        - monthly_limit (int): Number of earlier months to report.
+
+        Returns:
+        - Rollups: Weekly and monthly rows, newest first.
+        """
+        self._ensure_aggregates()
+        latest_buckets: Dict[str, str] = {}
+        latest_values = [0.0] * len(ROLLUP_METRICS)
+        if not self.run_df.empty:
+            latest = self.run_df.iloc[0]
+            latest_buckets = dict(calendar_buckets(latest['start_date'].timestamp()))
+            latest_values = [1.0] + [
+                float(latest[column]) if pd.notna(latest[column]) else 0.0
+                for column in ('distance_km', 'moving_time_min', 'total_elevation_gain')
+            ]
+
+        def rows(period: str, buckets: List[Dict[str, Any]]) -> List[str]:
+            result = []
+            for bucket in buckets:
+                totals = [bucket[metric]['total'] if metric in bucket else 0.0 for metric in ROLLUP_METRICS]
+                if latest_buckets.get(period) == bucket['bucket']:
+                    totals = [max(total - value, 0.0) for total, value in zip(totals, latest_values)]
+                if totals[0] >= 1:
+                    result.append(rollup_row(bucket['bucket'], *totals))
+            return result
+
+        weeks = self.aggregates.series('Run', 'week', weekly_limit)
+        # Weeks are keyed by their Monday; the months they cover are not repeated.
+        first_month = weeks[-1]['bucket'][:7] if weeks else None
+        months = [
+            bucket for bucket in self.aggregates.series('Run', 'month', monthly_limit + weekly_limit // 4 + 2)
+            if first_month is None or bucket['bucket'] < first_month
+        ][:monthly_limit]
+        return Rollups(weekly=rows('week', weeks), monthly=rows('month', months))
+
+    def calculate_summary_statistics(self, activity_types: Iterable[str] = ('Run',)) -> pd.DataFrame:
+        """
+        Calculate summary statistics for 'Run' activities, or other types.
+
+        The statistics cover every stored activity of each type, not just the rows
+        kept by `process_run_data`, and are read from the lifetime aggregates
+        instead of being recomputed.
+
+        Parameters:
+        - activity_types (Iterable[str]): Activity types to summarize.
 
         Returns:
-        - pd.DataFrame: Summary statistics DataFrame.
-        """
-        self.summary_stats = self.run_df.groupby('type').agg(
-            total_activities=('id', 'count'),
-            avg_distance_km=('distance_km', 'mean'),
-            avg_moving_time_min=('moving_time_min', 'mean'),
-            avg_pace_min_per_km=('pace_min_per_km', 'mean'),
-            total_distance_km=('distance_km', 'sum'),
-            total_moving_time_min=('moving_time_min', 'sum'),
-        ).reset_index()
+        - pd.DataFrame: Summary statistics DataFrame, one row per type with activities.
+        """
+        self._ensure_aggregates()
+        lifetime = self.aggregates.get(period='lifetime')
+        rows = []
+        for activity_type in activity_types:
+            metrics = lifetime.get(activity_type)
+            if not metrics:
+                continue
+            row = {'type': activity_type, 'total_activities': metrics['activities']['n']}
+            for name, (metric, field) in SUMMARY_STATISTICS.items():
+                row[name] = metrics[metric][field] if metric in metrics else np.nan
+            rows.append(row)
+        self.summary_stats = pd.DataFrame(
+            rows, columns=['type', 'total_activities', *SUMMARY_STATISTICS]
+        ).astype({name: np.float32 for name in SUMMARY_STATISTICS})
         return self.summary_stats
 
+    def _ensure_derived_state(self) -> None:
+        """Build the training load and aggregates of a store synced before they were maintained."""
+        with self._derived_lock:
+            if not self.training_load.has_state() and self.store.count():
+                # Stores synced before training load tracking get a one-time backfill.
+                for records in self.store.iter_activities(config.PROCESS_CHUNK_SIZE):
+                    self.training_load.apply(records)
+            self._ensure_aggregates()
+
+    def _apply_derived(self, records: List[Dict[str, Any]]) -> None:
+        """
+        Add stored records to the training load, the aggregates and the similarity index.
+
+        A webhook's ingest and the history sync may apply the same records from two
+        threads. Applying runs one call at a time, so each record's previous
+        contribution is read and replaced without a concurrent update in between.
+        """
+        with self._derived_lock:
+            self._ensure_derived_state()
+            self.training_load.apply(records)
+            self.aggregates.apply(records)
+            self.similarity.apply(records)
+
+    def _ensure_aggregates(self) -> None:
+        """Build the aggregates of a store synced before they were maintained."""
+        with self._derived_lock:
+            if self._aggregates_ready:
+                return
+            if not self.aggregates.has_state():
+                count = self.aggregates.rebuild(self.store.iter_activities(config.PROCESS_CHUNK_SIZE))
+                if count:
+                    print(f"Built activity aggregates for {count} stored activities.")
+            self._aggregates_ready = True
+
+    def to_result(self) -> ProcessedActivities:
+        """
+        Package the processed run data, summary statistics, rollups, stream metrics and
+        similar past efforts of the latest run and current training load for in-memory
+        handoff.
+
+        Training load is evaluated at `advice_time`, so the prompt stays the same
+        while the data does.
+
+        Returns:
+        - ProcessedActivities: Records for the most recent processed runs, summary
+          statistics, rollups of the whole history, the latest run's stream metrics and
+          similar efforts, and training-load metrics.
+        """
+        latest = self.store.get_high_water_mark()
+        return ProcessedActivities(
+            activities=_to_records(self.run_df),
+            summary_statistics=_to_records(self.summary_stats),
+            training_load=self.training_load.metrics(
+                now=advice_time(latest.timestamp() if latest is not None else None)
+            ),
+            rollups=self.rollups,
+            stream_metrics=self.latest_stream_metrics(),
+            similar_efforts=self.latest_similar_efforts(),
+        )
+
+    def latest_stream_metrics(self) -> Dict[str, Any]:
+        """
+        Derive metrics from the streams of the latest processed run.
+
+        Returns:
+        - Dict[str, Any]: Metrics from `stream_metrics`, or {} if the run has no stored streams.
+        """
+        if self.run_df.empty:
+            return {}
+        activity_id = int(self.run_df['id'].iloc[0])
+        if not self.streams.has(activity_id):
+            return {}
+        try:
+            return stream_metrics(self.streams.load(activity_id))
+        except Exception as e:
+            print(f"Could not derive stream metrics of activity {activity_id}: {str(e)}")
+            return {}
+
+    def latest_similar_efforts(self, k: int = config.SIMILAR_ACTIVITIES_K) -> Dict[str, Any]:
+        """
+        Find the past runs most similar to the latest processed run.
+
+        Parameters:
+        - k (int): Number of similar runs.
+
+        Returns:
+        - Dict[str, Any]: Similar runs and their trend from `SimilarityIndex.similar_efforts`,
+          or {} if there are none.
+        """
+        if self.run_df.empty:
+            return {}
+        activity_id = int(self.run_df['id'].iloc[0])
+        try:
+            return self.similarity.similar_efforts(activity_id, 'Run', k)
+        except Exception as e:
+            print(f"Could not find activities similar to {activity_id}: {str(e)}")
+            return {}
+
     def save_to_json(self, processed_file: str, summary_file: str) -> None:
         """
         Save processed data and summary statistics to JSON files.
@@ -114,12 +602,5 @@ class DataPreprocessor:
         - processed_file (str): File name for processed data JSON.
         - summary_file (str): File name for summary statistics JSON.
         """
-        processed_json = self.run_df.to_json(orient='records', date_format='iso', indent=4)
-        with open(processed_file, 'w') as file:
-            file.write(processed_json)
-        print(f"Processed data saved to '{processed_file}'.")
-
-        summary_json = self.summary_stats.to_json(orient='records', date_format='iso', indent=4)
-        with open(summary_file, 'w') as file:
-            file.write(summary_json)
-        print(f"Summary statistics saved to '{summary_file}'.")
+        write_snapshot(self.to_result(), processed_file, summary_file)
+        print(f"Processed data saved to '{processed_file}' and '{summary_file}'.")
@@ -2,70 +2,480 @@
 This module provides email functionality for sending workout advice using Gmail's SMTP server.
 It handles email composition and sending through a secure connection.
 
+Authenticated SMTP connections are pooled and reused across messages, and the
+blocking `smtplib` calls run in worker threads so the event loop never waits on
+the network. Messages can also be queued: the outbox retries failed sends with
+exponential backoff and, in digest mode, combines advice for the same recipient
+into a single email. The outbox is an SQLite file, so queued email survives a
+restart and is sent by whichever process sharing the file gets to it first.
+
 Example:
    email_handler = EmailHandler()
    await email_handler.send_email("Workout Advice", "Here's your personalized advice...")
+   await email_handler.enqueue("Workout Advice", "Here's your personalized advice...")
 
 Note:
    Requires environment variables:
    - EMAIL_SENDER: Gmail address sending the emails
    - EMAIL_PASSWORD: Google App Password for authentication
-   - EMAIL_RECEIVER: Recipient email address
+   - EMAIL_RECEIVER: Default recipient email address
+   SMTP_HOST, SMTP_PORT and SMTP_STARTTLS point delivery at another server,
+   e.g. a local aiosmtpd instance for testing.
 """
 
+import asyncio
 import smtplib
+import sqlite3
+import threading
+import time
+from contextlib import closing, contextmanager
+from dataclasses import dataclass
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 import os
-from typing import Optional
+from typing import Dict, Iterator, List, Optional, Tuple
 from dotenv import load_dotenv
 
+import config
+from app import metrics
+
 load_dotenv()
 
+
+@dataclass
+class OutgoingEmail:
+   """An email waiting in the outbox."""
+
+   subject: str
+   message: str
+   receiver: Optional[str]
+   attempts: int = 0
+
+
+class SMTPConnectionPool:
+   """
+   Thread-safe pool of authenticated SMTP connections.
+   """
+
+   def __init__(
+       self,
+       host: str,
+       port: int,
+       username: Optional[str],
+       password: Optional[str],
+       starttls: bool = True,
+       size: int = 2,
+       idle_timeout: float = 120.0,
+       timeout: float = 30.0
+   ) -> None:
+       """
+       Initialize an empty pool; connections are opened on first use.
+
+       Args:
+           host (str): SMTP server host
+           port (int): SMTP server port
+           username (Optional[str]): Login user; no login is attempted if empty
+           password (Optional[str]): Login password
+           starttls (bool): Upgrade connections with STARTTLS
+           size (int): Maximum number of open connections
+           idle_timeout (float): Seconds after which an idle connection is replaced
+           timeout (float): Socket timeout in seconds
+       """
+       self.host = host
+       self.port = port
+       self.username = username
+       self.password = password
+       self.starttls = starttls
+       self.idle_timeout = idle_timeout
+       self.timeout = timeout
+       self._slots = threading.BoundedSemaphore(size)
+       self._idle: List[Tuple[smtplib.SMTP, float]] = []
+       self._lock = threading.Lock()
+
+   def _connect(self) -> smtplib.SMTP:
+       server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+       try:
+           if self.starttls:
+               server.starttls()
+           if self.username and self.password:
+               server.login(self.username, self.password)
+       except Exception:
+           server.close()
+           raise
+       return server
+
+   @staticmethod
+   def _is_alive(server: smtplib.SMTP) -> bool:
+       try:
+           return server.noop()[0] == 250
+       except (smtplib.SMTPException, OSError):
+           return False
+
+   @staticmethod
+   def _quit(server: smtplib.SMTP) -> None:
+       try:
+           server.quit()
+       except (smtplib.SMTPException, OSError):
+           server.close()
+
+   @contextmanager
+   def connection(self) -> Iterator[smtplib.SMTP]:
+       """
+       Borrow a live connection, opening a new one if none is idle.
+
+       Connections idle past `idle_timeout` or failing a NOOP are replaced. A
+       connection whose use raised is discarded rather than returned.
+       """
+       with self._slots:
+           server = None
+           with self._lock:
+               if self._idle:
+                   server, idle_since = self._idle.pop()
+           if server is not None and (
+               time.monotonic() - idle_since > self.idle_timeout or not self._is_alive(server)
+           ):
+               self._quit(server)
+               server = None
+           if server is None:
+               server = self._connect()
+
+           try:
+               yield server
+           except Exception:
+               self._quit(server)
+               raise
+           with self._lock:
+               self._idle.append((server, time.monotonic()))
+
+   def warm_up(self) -> None:
+       """
+       Open a connection ahead of the next send unless one is idle or every slot is
+       in use; blocking.
+       """
+       if not self._slots.acquire(blocking=False):
+           return
+       try:
+           with self._lock:
+               if self._idle:
+                   return
+           server = self._connect()
+           with self._lock:
+               self._idle.append((server, time.monotonic()))
+       finally:
+           self._slots.release()
+
+   def send(self, msg: MIMEMultipart) -> None:
+       """Send a message over a pooled connection; blocking."""
+       with self.connection() as server:
+           server.send_message(msg)
+
+   def close(self) -> None:
+       """Close all idle connections."""
+       with self._lock:
+           idle, self._idle = self._idle, []
+       for server, _ in idle:
+           self._quit(server)
+
+
+class EmailOutbox:
+   """
+   SQLite-backed outbox of emails waiting to be sent.
+
+   Emails due at the same time for the same recipient are claimed together and
+   sent as one. A claim hides the emails from other processes until it is
+   released or `claim_seconds` pass, e.g. because the sending process crashed.
+   """
+
+   def __init__(self, db_path: str, claim_seconds: float = 300.0) -> None:
+       """
+       Initialize the outbox and create its table if needed.
+
+       Args:
+           db_path (str): Path of the SQLite outbox file
+           claim_seconds (float): How long claimed emails stay hidden from other senders
+       """
+       self.db_path = db_path
+       self.claim_seconds = claim_seconds
+       self.initialize()
+
+   def _connect(self) -> sqlite3.Connection:
+       return sqlite3.connect(self.db_path, timeout=30)
+
+   def initialize(self) -> None:
+       """Create the outbox table if it doesn't exist."""
+       with closing(self._connect()) as conn, conn:
+           conn.execute("""
+               CREATE TABLE IF NOT EXISTS outbox (
+                   id INTEGER PRIMARY KEY AUTOINCREMENT,
+                   receiver TEXT NOT NULL DEFAULT '',
+                   subject TEXT NOT NULL,
+                   message TEXT NOT NULL,
+                   attempts INTEGER NOT NULL DEFAULT 0,
+                   send_at REAL NOT NULL,
+                   claimed_until REAL,
+                   created_at REAL NOT NULL
+               )
+           """)
+           conn.execute("CREATE INDEX IF NOT EXISTS idx_outbox_send_at ON outbox (send_at)")
+
+   def add(self, email: OutgoingEmail, hold_seconds: float = 0.0) -> None:
+       """
+       Store an email to be sent after `hold_seconds`.
+
+       With a hold, the email joins a digest already waiting for the same
+       recipient and is sent with it.
+       """
+       now = time.time()
+       with closing(self._connect()) as conn, conn:
+           conn.execute("BEGIN IMMEDIATE")
+           send_at = now
+           if hold_seconds > 0:
+               pending = conn.execute(
+                   """
+                   SELECT MIN(send_at) FROM outbox
+                   WHERE receiver = ? AND attempts = 0 AND claimed_until IS NULL AND send_at > ?
+                   """,
+                   (email.receiver or '', now)
+               ).fetchone()[0]
+               send_at = pending if pending is not None else now + hold_seconds
+           conn.execute(
+               """
+               INSERT INTO outbox (receiver, subject, message, attempts, send_at, created_at)
+               VALUES (?, ?, ?, ?, ?, ?)
+               """,
+               (email.receiver or '', email.subject, email.message, email.attempts, send_at, now)
+           )
+
+   def claim_due(self) -> List[Tuple[List[int], List[OutgoingEmail]]]:
+       """
+       Claim every email that is due, grouped by recipient and send time.
+
+       Returns:
+           List[Tuple[List[int], List[OutgoingEmail]]]: Row ids and emails of each group
+       """
+       now = time.time()
+       with closing(self._connect()) as conn, conn:
+           conn.execute("BEGIN IMMEDIATE")
+           rows = conn.execute(
+               """
+               SELECT id, receiver, subject, message, attempts, send_at FROM outbox
+               WHERE send_at <= ? AND (claimed_until IS NULL OR claimed_until <= ?)
+               ORDER BY id
+               """,
+               (now, now)
+           ).fetchall()
+           conn.executemany(
+               "UPDATE outbox SET claimed_until = ? WHERE id = ?",
+               [(now + self.claim_seconds, row[0]) for row in rows]
+           )
+       groups: Dict[Tuple[str, float], Tuple[List[int], List[OutgoingEmail]]] = {}
+       for row_id, receiver, subject, message, attempts, send_at in rows:
+           ids, emails = groups.setdefault((receiver, send_at), ([], []))
+           ids.append(row_id)
+           emails.append(OutgoingEmail(subject, message, receiver or None, attempts))
+       return list(groups.values())
+
+   def delete(self, ids: List[int]) -> None:
+       """Remove sent or dropped emails."""
+       with closing(self._connect()) as conn, conn:
+           conn.executemany("DELETE FROM outbox WHERE id = ?", [(row_id,) for row_id in ids])
+
+   def reschedule(self, ids: List[int], attempts: int, send_at: float) -> None:
+       """Release claimed emails to be sent together again at `send_at`."""
+       with closing(self._connect()) as conn, conn:
+           conn.executemany(
+               "UPDATE outbox SET attempts = ?, send_at = ?, claimed_until = NULL WHERE id = ?",
+               [(attempts, send_at, row_id) for row_id in ids]
+           )
+
+   def release_digests(self) -> None:
+       """Make the digests still collecting emails due now."""
+       now = time.time()
+       with closing(self._connect()) as conn, conn:
+           conn.execute(
+               "UPDATE outbox SET send_at = ? WHERE attempts = 0 AND claimed_until IS NULL AND send_at > ?",
+               (now, now)
+           )
+
+   def count(self) -> int:
+       """Return the number of emails in the outbox."""
+       with closing(self._connect()) as conn:
+           return conn.execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+
+
 class EmailHandler:
    """
    Handles email operations for sending workout advice.
    """
-   
-   def __init__(self) -> None:
+
+   def __init__(
+       self,
+       pool: Optional[SMTPConnectionPool] = None,
+       outbox: Optional[EmailOutbox] = None,
+       digest_seconds: float = config.EMAIL_DIGEST_SECONDS,
+       max_attempts: int = config.EMAIL_MAX_ATTEMPTS,
+       retry_base_seconds: float = config.EMAIL_RETRY_BASE_SECONDS,
+       poll_interval_seconds: float = config.EMAIL_POLL_INTERVAL_SECONDS
+   ) -> None:
        """
        Initialize EmailHandler with credentials from environment variables.
-       
+
        The constructor loads email configuration from environment variables
        set in the .env file.
+
+       Args:
+           pool (Optional[SMTPConnectionPool]): Connection pool; built from `config` if omitted
+           outbox (Optional[EmailOutbox]): Queued email store; `config.EMAIL_OUTBOX_PATH` if omitted
+           digest_seconds (float): Window for combining queued emails per recipient; 0 disables digests
+           max_attempts (int): Delivery attempts for queued emails before they are dropped
+           retry_base_seconds (float): Base delay of the exponential retry backoff
+           poll_interval_seconds (float): How often the outbox is checked for due emails
        """
        self.sender_email: Optional[str] = os.getenv('EMAIL_SENDER')
        self.sender_password: Optional[str] = os.getenv('EMAIL_PASSWORD')
        self.receiver_email: Optional[str] = os.getenv('EMAIL_RECEIVER')
+       self.pool = pool or SMTPConnectionPool(
+           config.SMTP_HOST,
+           config.SMTP_PORT,
+           self.sender_email,
+           self.sender_password,
+           starttls=config.SMTP_STARTTLS,
+           size=config.SMTP_POOL_SIZE,
+           idle_timeout=config.SMTP_IDLE_TIMEOUT_SECONDS
+       )
+       self.outbox = outbox or EmailOutbox(config.EMAIL_OUTBOX_PATH)
+       self.digest_seconds = digest_seconds
+       self.max_attempts = max_attempts
+       self.retry_base_seconds = retry_base_seconds
+       self.poll_interval_seconds = poll_interval_seconds
+       self._worker: Optional[asyncio.Task] = None
+       self._wake = asyncio.Event()
+       self._stopping = False
+
+   def _build_message(self, subject: str, message: str, receiver: Optional[str]) -> MIMEMultipart:
+       msg = MIMEMultipart()
+       msg['From'] = self.sender_email
+       msg['To'] = receiver or self.receiver_email
+       msg['Subject'] = subject
 
-   async def send_email(self, subject: str, message: str) -> bool:
+       msg.attach(MIMEText(message, 'plain'))
+       return msg
+
+   async def prepare(self) -> None:
+       """
+       Open a pooled connection in the background so the next send skips the SMTP
+       handshake, e.g. while the advice is being generated. Failures are left for
+       the send to report.
+       """
+       try:
+           await asyncio.to_thread(self.pool.warm_up)
+       except Exception as e:
+           print(f"Could not open SMTP connection ahead of sending: {str(e)}")
+
+   async def send_email(self, subject: str, message: str, receiver: Optional[str] = None) -> bool:
        """
        Send an email with the provided subject and message.
-       
+
        Args:
            subject (str): The subject line of the email
            message (str): The body content of the email
-           
+           receiver (Optional[str]): Recipient address; defaults to EMAIL_RECEIVER
+
        Returns:
            bool: True if email was sent successfully, False otherwise
-           
-       Raises:
-           smtplib.SMTPException: If there are SMTP-related errors
-           Exception: For other unexpected errors
        """
        try:
-           msg = MIMEMultipart()
-           msg['From'] = self.sender_email
-           msg['To'] = self.receiver_email
-           msg['Subject'] = subject
-
-           msg.attach(MIMEText(message, 'plain'))
-
-           with smtplib.SMTP('smtp.gmail.com', 587) as server:
-               server.starttls()
-               server.login(self.sender_email, self.sender_password)
-               server.send_message(msg)
+           msg = self._build_message(subject, message, receiver)
+           with metrics.timed('email_send'):
+               await asyncio.to_thread(self.pool.send, msg)
            return True
        except Exception as e:
            print(f"Error sending email: {str(e)}")
-           return False
\ No newline at end of file
+           return False
+
+   async def enqueue(self, subject: str, message: str, receiver: Optional[str] = None) -> None:
+       """
+       Queue an email for background delivery with retries.
+
+       The email is stored in the outbox before this returns, so it is sent even if
+       the process stops first. In digest mode the email is held for
+       `digest_seconds`, and everything queued for the same recipient in that
+       window is sent as one message.
+
+       Args:
+           subject (str): The subject line of the email
+           message (str): The body content of the email
+           receiver (Optional[str]): Recipient address; defaults to EMAIL_RECEIVER
+       """
+       email = OutgoingEmail(subject, message, receiver or self.receiver_email)
+       await asyncio.to_thread(self.outbox.add, email, self.digest_seconds)
+       self.start()
+       self._wake.set()
+
+   @staticmethod
+   def _combine(emails: List[OutgoingEmail]) -> OutgoingEmail:
+       """Merge several emails to one recipient into a digest."""
+       if len(emails) == 1:
+           return emails[0]
+       sections = [f"{email.subject}\n{'=' * len(email.subject)}\n\n{email.message}" for email in emails]
+       return OutgoingEmail(
+           subject=f'Workout Advice Digest ({len(emails)} updates)',
+           message='\n\n\n'.join(sections),
+           receiver=emails[0].receiver,
+           attempts=max(email.attempts for email in emails)
+       )
+
+   def start(self) -> None:
+       """Start delivering the outbox, including email queued before a restart."""
+       if self._worker is None or self._worker.done():
+           self._stopping = False
+           self._worker = asyncio.create_task(self._deliver())
+
+   async def _deliver(self) -> None:
+       """Send due emails until stopped; when stopping, return once none is due."""
+       while True:
+           self._wake.clear()
+           groups = await asyncio.to_thread(self.outbox.claim_due)
+           for ids, emails in groups:
+               await self._send_group(ids, self._combine(emails))
+           if groups:
+               continue
+           if self._stopping:
+               return
+           try:
+               await asyncio.wait_for(self._wake.wait(), self.poll_interval_seconds)
+           except asyncio.TimeoutError:
+               pass
+
+   async def _send_group(self, ids: List[int], email: OutgoingEmail) -> None:
+       if await self.send_email(email.subject, email.message, email.receiver):
+           await asyncio.to_thread(self.outbox.delete, ids)
+           return
+       attempts = email.attempts + 1
+       if attempts >= self.max_attempts:
+           print(f"Dropping email to {email.receiver} after {attempts} attempts")
+           await asyncio.to_thread(self.outbox.delete, ids)
+           return
+       delay = self.retry_base_seconds * 2 ** (attempts - 1)
+       await asyncio.to_thread(self.outbox.reschedule, ids, attempts, time.time() + delay)
+
+   async def stop(self, timeout: float = 30.0) -> None:
+       """
+       Send pending digests, wait up to `timeout` seconds for the due emails to go
+       out, then stop the delivery worker and close pooled connections. Emails
+       still waiting for a retry stay in the outbox for the next start.
+       """
+       await asyncio.to_thread(self.outbox.release_digests)
+       self.start()
+       self._stopping = True
+       self._wake.set()
+       try:
+           await asyncio.wait_for(asyncio.shield(self._worker), timeout)
+       except asyncio.TimeoutError:
+           self._worker.cancel()
+           await asyncio.gather(self._worker, return_exceptions=True)
+       self._worker = None
+       left = await asyncio.to_thread(self.outbox.count)
+       if left:
+           print(f"{left} emails left in the outbox for the next start")
+       await asyncio.to_thread(self.pool.close)
@@ -0,0 +1,518 @@
+"""
+Durable SQLite-backed job queue and async worker pool for webhook processing.
+
+Webhook events are written to the queue and acknowledged immediately; a pool of
+asyncio workers claims them in order, retries failures with exponential backoff
+and moves jobs that keep failing to a dead-letter table. Handlers can raise
+`RetryLater` to postpone a job, e.g. until a rate limit resets, without using
+up one of its attempts. Events can also be coalesced into the partition's
+pending job over a debounce window instead of each becoming a job of its own. Each job belongs to a
+partition (one per athlete): jobs in different partitions run in parallel,
+while a partition never has more than one job running at a time.
+
+Several processes can share one queue file. A claimed job records the process
+that owns it and a lease, which the owner's pool renews while the job runs. A
+job is only taken back from its owner when the lease has expired, e.g. because
+the process crashed, so a starting process never steals jobs that other
+processes are still running.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import socket
+import sqlite3
+import time
+import uuid
+from contextlib import closing
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import config
+from app import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class RetryLater(Exception):
+    """Raised by a job handler to run the job again later without using up an attempt."""
+
+    def __init__(self, delay: float, reason: str = '') -> None:
+        super().__init__(reason or f'retry in {delay:.0f}s')
+        self.delay = delay
+
+
+@dataclass
+class Job:
+    """A claimed job and its decoded payload."""
+
+    id: int
+    event_key: str
+    payload: Dict[str, Any]
+    attempts: int
+    partition_key: str = ''
+
+
+class JobQueue:
+    """
+    Persistent FIFO queue of webhook jobs with retry scheduling and dead-lettering.
+    """
+
+    def __init__(
+        self,
+        db_path: str,
+        owner: Optional[str] = None,
+        lease_seconds: float = config.JOB_LEASE_SECONDS
+    ) -> None:
+        """
+        Initialize the queue and create its tables if needed.
+
+        Args:
+            db_path: Path of the SQLite queue file
+            owner: Identifies this process in the jobs it claims; defaults to host,
+                pid and a random suffix, unique per process start
+            lease_seconds: How long a claimed job stays with its owner without a renewal
+        """
+        self.db_path = db_path
+        self.owner = owner or f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+        self.lease_seconds = lease_seconds
+        self.initialize()
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    def initialize(self) -> None:
+        """Create the jobs and dead_letter_jobs tables if they don't exist."""
+        with closing(self._connect()) as conn, conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    event_key TEXT NOT NULL UNIQUE,
+                    partition_key TEXT NOT NULL DEFAULT '',
+                    payload TEXT NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    next_run_at REAL NOT NULL,
+                    last_error TEXT,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            """)
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(jobs)")}
+            if 'partition_key' not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN partition_key TEXT NOT NULL DEFAULT ''")
+            if 'owner' not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN owner TEXT")
+                conn.execute("ALTER TABLE jobs ADD COLUMN lease_expires_at REAL")
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_jobs_status_next_run ON jobs (status, next_run_at)"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_jobs_partition_status ON jobs (partition_key, status)"
+            )
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS dead_letter_jobs (
+                    id INTEGER PRIMARY KEY,
+                    event_key TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    attempts INTEGER NOT NULL,
+                    last_error TEXT,
+                    failed_at REAL NOT NULL
+                )
+            """)
+
+    def enqueue(self, event_key: str, payload: Dict[str, Any], partition_key: str = '') -> bool:
+        """
+        Add a job unless one with the same event key is already queued.
+
+        Args:
+            event_key: Unique key identifying the event
+            payload: JSON-serializable job payload
+            partition_key: Partition whose jobs must run one at a time
+
+        Returns:
+            bool: True if the job was enqueued, False if it was a duplicate
+        """
+        now = time.time()
+        with closing(self._connect()) as conn, conn:
+            cursor = conn.execute(
+                """
+                INSERT OR IGNORE INTO jobs (event_key, partition_key, payload, next_run_at, created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                (event_key, partition_key, json.dumps(payload), now, now, now)
+            )
+            return cursor.rowcount == 1
+
+    def coalesce(
+        self,
+        partition_key: str,
+        event_key: str,
+        merge: Callable[[Optional[Dict[str, Any]]], Optional[Dict[str, Any]]],
+        debounce_seconds: float,
+        max_delay_seconds: float
+    ) -> str:
+        """
+        Merge an event into the partition's pending job, or start a new one.
+
+        The pending job runs once no event has been merged for `debounce_seconds`,
+        but no later than `max_delay_seconds` after it was created (unless it is
+        already deferred further). A job that a worker has claimed is never
+        changed; events arriving while it runs start a new job.
+
+        Args:
+            partition_key: Partition to coalesce events in
+            event_key: Unique key of the job if a new one is created
+            merge: Called with the pending payload (None if there is no pending
+                job); returns the new payload, the same object to leave the job
+                unchanged, or None to drop the job
+            debounce_seconds: Quiet period before the job runs
+            max_delay_seconds: Upper bound on the debounce from the job's creation
+
+        Returns:
+            str: 'created', 'merged', 'unchanged', 'dropped' or 'ignored'
+        """
+        now = time.time()
+        with closing(self._connect()) as conn:
+            conn.isolation_level = None
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    """
+                    SELECT id, payload, next_run_at, created_at FROM jobs
+                    WHERE partition_key = ? AND status = 'pending'
+                    ORDER BY id DESC LIMIT 1
+                    """,
+                    (partition_key,)
+                ).fetchone()
+                current = json.loads(row[1]) if row else None
+                payload = merge(current)
+
+                if row is None:
+                    outcome = 'ignored'
+                    if payload is not None:
+                        conn.execute(
+                            """
+                            INSERT INTO jobs (event_key, partition_key, payload, next_run_at, created_at, updated_at)
+                            VALUES (?, ?, ?, ?, ?, ?)
+                            """,
+                            (event_key, partition_key, json.dumps(payload), now + debounce_seconds, now, now)
+                        )
+                        outcome = 'created'
+                elif payload is None:
+                    conn.execute("DELETE FROM jobs WHERE id = ?", (row[0],))
+                    outcome = 'dropped'
+                elif payload is current:
+                    outcome = 'unchanged'
+                else:
+                    next_run_at = max(row[2], min(now + debounce_seconds, row[3] + max_delay_seconds))
+                    conn.execute(
+                        "UPDATE jobs SET payload = ?, next_run_at = ?, updated_at = ? WHERE id = ?",
+                        (json.dumps(payload), next_run_at, now, row[0])
+                    )
+                    outcome = 'merged'
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return outcome
+
+    def claim(self) -> Optional[Job]:
+        """
+        Atomically claim the oldest due job whose partition has no job running.
+
+        Jobs whose owner's lease has expired are returned to the queue first, so a
+        crashed process's jobs are picked up again.
+
+        Returns:
+            Optional[Job]: The claimed job, or None if nothing is due
+        """
+        now = time.time()
+        with closing(self._connect()) as conn:
+            conn.isolation_level = None
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._requeue_expired(conn, now)
+                row = conn.execute(
+                    """
+                    SELECT id, event_key, payload, attempts, partition_key FROM jobs
+                    WHERE status = 'pending' AND next_run_at <= ?
+                        AND partition_key NOT IN (
+                            SELECT partition_key FROM jobs WHERE status = 'running'
+                        )
+                    ORDER BY next_run_at, id LIMIT 1
+                    """,
+                    (now,)
+                ).fetchone()
+                if row is None:
+                    conn.execute("COMMIT")
+                    return None
+                conn.execute(
+                    """
+                    UPDATE jobs SET status = 'running', owner = ?, lease_expires_at = ?, updated_at = ?
+                    WHERE id = ?
+                    """,
+                    (self.owner, now + self.lease_seconds, now, row[0])
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return Job(
+            id=row[0],
+            event_key=row[1],
+            payload=json.loads(row[2]),
+            attempts=row[3],
+            partition_key=row[4]
+        )
+
+    def _check_owned(self, job: Job, rowcount: int) -> bool:
+        if rowcount == 0:
+            logger.warning(f'Job {job.event_key} was taken over after its lease expired')
+        return rowcount > 0
+
+    def complete(self, job: Job) -> bool:
+        """
+        Remove a successfully processed job from the queue.
+
+        This and the other job updates only apply while this process still owns the
+        job; they return False if its lease expired and the job was taken over.
+        """
+        with closing(self._connect()) as conn, conn:
+            cursor = conn.execute("DELETE FROM jobs WHERE id = ? AND owner = ?", (job.id, self.owner))
+        return self._check_owned(job, cursor.rowcount)
+
+    def retry(self, job: Job, error: str, delay: float) -> bool:
+        """Return a failed job to the queue to run again after `delay` seconds."""
+        now = time.time()
+        with closing(self._connect()) as conn, conn:
+            cursor = conn.execute(
+                """
+                UPDATE jobs SET status = 'pending', attempts = attempts + 1, owner = NULL,
+                    lease_expires_at = NULL, next_run_at = ?, last_error = ?, updated_at = ?
+                WHERE id = ? AND owner = ?
+                """,
+                (now + delay, error, now, job.id, self.owner)
+            )
+        return self._check_owned(job, cursor.rowcount)
+
+    def defer(self, job: Job, reason: str, delay: float) -> bool:
+        """Return a job to the queue to run after `delay` seconds without counting an attempt."""
+        now = time.time()
+        with closing(self._connect()) as conn, conn:
+            cursor = conn.execute(
+                """
+                UPDATE jobs SET status = 'pending', owner = NULL, lease_expires_at = NULL,
+                    next_run_at = ?, last_error = ?, updated_at = ?
+                WHERE id = ? AND owner = ?
+                """,
+                (now + delay, reason, now, job.id, self.owner)
+            )
+        return self._check_owned(job, cursor.rowcount)
+
+    def dead_letter(self, job: Job, error: str) -> bool:
+        """Move a job that exhausted its retries to the dead-letter table."""
+        with closing(self._connect()) as conn, conn:
+            cursor = conn.execute("DELETE FROM jobs WHERE id = ? AND owner = ?", (job.id, self.owner))
+            if not self._check_owned(job, cursor.rowcount):
+                return False
+            conn.execute(
+                """
+                INSERT OR REPLACE INTO dead_letter_jobs (id, event_key, payload, attempts, last_error, failed_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                (job.id, job.event_key, json.dumps(job.payload), job.attempts + 1, error, time.time())
+            )
+        return True
+
+    def renew(self, job_ids: List[int]) -> int:
+        """
+        Extend the leases of jobs this process is running.
+
+        Returns:
+            int: Number of leases renewed
+        """
+        if not job_ids:
+            return 0
+        now = time.time()
+        with closing(self._connect()) as conn, conn:
+            cursor = conn.executemany(
+                """
+                UPDATE jobs SET lease_expires_at = ?
+                WHERE id = ? AND owner = ? AND status = 'running'
+                """,
+                [(now + self.lease_seconds, job_id, self.owner) for job_id in job_ids]
+            )
+            return cursor.rowcount
+
+    def _requeue_expired(self, conn: sqlite3.Connection, now: float) -> int:
+        # Jobs claimed before leases were recorded have none and count as expired.
+        cursor = conn.execute(
+            """
+            UPDATE jobs SET status = 'pending', owner = NULL, lease_expires_at = NULL, updated_at = ?
+            WHERE status = 'running' AND (lease_expires_at IS NULL OR lease_expires_at < ?)
+            """,
+            (now, now)
+        )
+        return cursor.rowcount
+
+    def requeue_expired(self) -> int:
+        """
+        Return running jobs whose lease has expired, i.e. whose owner stopped renewing
+        them, to the queue. Jobs that other live processes are running are left alone.
+
+        Returns:
+            int: Number of jobs requeued
+        """
+        with closing(self._connect()) as conn, conn:
+            return self._requeue_expired(conn, time.time())
+
+    def release_owned(self) -> int:
+        """
+        Return the jobs this process is running to the queue, e.g. on shutdown, so
+        they don't wait for their leases to expire.
+
+        Returns:
+            int: Number of jobs released
+        """
+        with closing(self._connect()) as conn, conn:
+            cursor = conn.execute(
+                """
+                UPDATE jobs SET status = 'pending', owner = NULL, lease_expires_at = NULL, updated_at = ?
+                WHERE status = 'running' AND owner = ?
+                """,
+                (time.time(), self.owner)
+            )
+            return cursor.rowcount
+
+    def stats(self) -> Dict[str, int]:
+        """Return the number of pending, running and dead-lettered jobs."""
+        with closing(self._connect()) as conn:
+            counts = dict(conn.execute(
+                "SELECT status, COUNT(*) FROM jobs GROUP BY status"
+            ).fetchall())
+            (dead,) = conn.execute("SELECT COUNT(*) FROM dead_letter_jobs").fetchone()
+        return {
+            'pending': counts.get('pending', 0),
+            'running': counts.get('running', 0),
+            'dead_letter': dead,
+        }
+
+
+class WorkerPool:
+    """
+    Pool of asyncio workers that drain a `JobQueue` with retries and backoff.
+    """
+
+    def __init__(
+        self,
+        queue: JobQueue,
+        handler: Callable[[Dict[str, Any]], Awaitable[None]],
+        workers: int = 2,
+        max_attempts: int = 5,
+        retry_base_seconds: float = 30.0,
+        poll_interval_seconds: float = 1.0,
+    ) -> None:
+        """Initialize the pool; workers start on `start()`."""
+        self.queue = queue
+        self.handler = handler
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retry_base_seconds = retry_base_seconds
+        self.poll_interval_seconds = poll_interval_seconds
+        self.in_flight: Dict[int, Job] = {}
+        self._tasks: List[asyncio.Task] = []
+        self._wakeup = asyncio.Event()
+
+    async def start(self) -> None:
+        """Requeue jobs whose owner stopped renewing their lease and start the workers."""
+        requeued = await asyncio.to_thread(self.queue.requeue_expired)
+        if requeued:
+            logger.info(f'Requeued {requeued} interrupted jobs')
+        self._tasks = [
+            asyncio.create_task(self._worker(n)) for n in range(self.workers)
+        ]
+        self._tasks.append(asyncio.create_task(self._heartbeat()))
+        logger.info(f'Started {self.workers} queue workers')
+
+    async def stop(self) -> None:
+        """Cancel the workers and return the jobs they were running to the queue."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        released = await asyncio.to_thread(self.queue.release_owned)
+        if released:
+            logger.info(f'Returned {released} interrupted jobs to the queue')
+
+    async def _heartbeat(self) -> None:
+        """Renew the leases of the running jobs well before they expire."""
+        while True:
+            await asyncio.sleep(self.queue.lease_seconds / 3)
+            try:
+                await asyncio.to_thread(self.queue.renew, list(self.in_flight))
+            except Exception as e:
+                logger.error(f'Could not renew job leases: {str(e)}')
+
+    def notify(self) -> None:
+        """Wake idle workers after a job has been enqueued."""
+        self._wakeup.set()
+
+    def status(self) -> Dict[str, Any]:
+        """Report queue depth and the jobs currently being processed."""
+        return {
+            **self.queue.stats(),
+            'workers': self.workers,
+            'in_flight': [
+                {
+                    'id': job.id,
+                    'event_key': job.event_key,
+                    'partition_key': job.partition_key,
+                    'attempts': job.attempts,
+                }
+                for job in self.in_flight.values()
+            ],
+        }
+
+    async def _worker(self, worker_id: int) -> None:
+        while True:
+            job = await asyncio.to_thread(self.queue.claim)
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval_seconds)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            self.in_flight[job.id] = job
+            started = time.perf_counter()
+            # Jobs continue the trace of the request that queued them.
+            with metrics.trace(job.payload.get('trace_id')):
+                try:
+                    await self.handler(job.payload)
+                    await asyncio.to_thread(self.queue.complete, job)
+                    metrics.JOBS.labels(outcome='completed').inc()
+                    logger.info(f'Worker {worker_id} completed job {job.event_key}')
+                except asyncio.CancelledError:
+                    raise
+                except RetryLater as e:
+                    metrics.JOBS.labels(outcome='deferred').inc()
+                    logger.info(f'Job {job.event_key} deferred for {e.delay:.0f}s: {e}')
+                    await asyncio.to_thread(self.queue.defer, job, str(e), e.delay)
+                except Exception as e:
+                    metrics.JOBS.labels(outcome='failed').inc()
+                    await self._handle_failure(job, str(e))
+                finally:
+                    metrics.JOB_SECONDS.observe(time.perf_counter() - started)
+                    self.in_flight.pop(job.id, None)
+
+    async def _handle_failure(self, job: Job, error: str) -> None:
+        if job.attempts + 1 >= self.max_attempts:
+            logger.error(f'Job {job.event_key} failed permanently: {error}')
+            await asyncio.to_thread(self.queue.dead_letter, job, error)
+            return
+        delay = self.retry_base_seconds * 2 ** job.attempts
+        logger.warning(f'Job {job.event_key} failed, retrying in {delay:.0f}s: {error}')
+        await asyncio.to_thread(self.queue.retry, job, error, delay)
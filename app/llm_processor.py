@@ -1,76 +1,276 @@
 """
 Handles LLM interactions using Hugging Face's API for text generation.
+
+Requests go to the OpenAI-compatible chat completions route of the Inference API
+through one process-wide, connection-pooled `httpx.AsyncClient`, so neither
+completions nor streams block the event loop. Each generation records its time
+to first token, generation time, token counts and tokens per second in
+`app.metrics`.
+
+`complete` and `stream` raise on failure, for callers that fall back to
+something else (see `app.llm_scheduler`). A stream that ends before the model
+finished, e.g. because the connection dropped, is a failure too.
+`max_tokens` is reduced to what fits in the model's context window after the
+prompt, when the window is known. `generate_summary` and
+`generate_summary_stream` return the error as text instead.
 """
 
-from huggingface_hub import InferenceClient
+import asyncio
+import json
 import os
-from typing import AsyncGenerator
+import time
+from typing import Any, AsyncGenerator, Dict, Optional
+
+import httpx
 from dotenv import load_dotenv
-import asyncio
+
+import config
+from app import metrics
+from app.prompt_handler import estimate_tokens
 
 load_dotenv()
 
+_http_client: Optional[httpx.AsyncClient] = None
+_generation_slots: Optional[asyncio.Semaphore] = None
+
+
+def get_http_client() -> httpx.AsyncClient:
+   """Return the shared inference HTTP client, creating it on first use."""
+   global _http_client
+   if _http_client is None or _http_client.is_closed:
+       _http_client = httpx.AsyncClient(
+           base_url=config.LLM_API_BASE,
+           headers={'Authorization': f"Bearer {os.getenv('HUGGINGFACE_TOKEN')}"},
+           timeout=httpx.Timeout(config.LLM_READ_TIMEOUT_SECONDS, connect=10.0),
+           limits=httpx.Limits(
+               max_connections=config.LLM_MAX_CONCURRENCY,
+               max_keepalive_connections=config.LLM_MAX_CONCURRENCY
+           )
+       )
+   return _http_client
+
+
+def get_generation_slots() -> asyncio.Semaphore:
+   """Return the semaphore capping concurrent generations in this process."""
+   global _generation_slots
+   if _generation_slots is None:
+       _generation_slots = asyncio.Semaphore(config.LLM_MAX_CONCURRENCY)
+   return _generation_slots
+
+
+async def close_http_client() -> None:
+   """Close the shared inference HTTP client, e.g. on application shutdown."""
+   global _http_client
+   if _http_client is not None:
+       await _http_client.aclose()
+       _http_client = None
+
+
+def _record_generation(
+   prompt_tokens: int,
+   completion_tokens: int,
+   started: float,
+   first_token_at: float,
+   finished: float
+) -> None:
+   """Record the timings and token counts of one completed generation."""
+   metrics.PIPELINE_STAGE_SECONDS.labels(stage='llm_first_token').observe(first_token_at - started)
+   metrics.PIPELINE_STAGE_SECONDS.labels(stage='llm_generation').observe(finished - first_token_at)
+   metrics.LLM_PROMPT_TOKENS.observe(prompt_tokens)
+   metrics.LLM_COMPLETION_TOKENS.observe(completion_tokens)
+   if completion_tokens > 1 and finished > first_token_at:
+       metrics.LLM_TOKENS_PER_SECOND.observe((completion_tokens - 1) / (finished - first_token_at))
+
+
 class LLMAdapter:
    """Handles LLM interactions for text generation."""
-   
-   def __init__(self, model_name: str = "mistralai/Mistral-7B-Instruct-v0.3", temperature: float = 0.7) -> None:
-       """Initialize with model configuration."""
-       self.client = InferenceClient(api_key=os.getenv('HUGGINGFACE_TOKEN'))
+
+   def __init__(
+       self,
+       model_name: str = "mistralai/Mistral-7B-Instruct-v0.3",
+       temperature: float = 0.7,
+       timeout: float = config.LLM_REQUEST_TIMEOUT_SECONDS,
+       client: Optional[httpx.AsyncClient] = None,
+       max_tokens: int = config.LLM_MAX_TOKENS,
+       context_tokens: Optional[int] = None
+   ) -> None:
+       """
+       Initialize with model configuration; `client` defaults to the shared client.
+       `context_tokens` is the model's context window, if it may be too small for
+       the prompt plus `max_tokens`.
+       """
+       self._client = client
        self.model_name = model_name
        self.temperature = temperature
+       self.timeout = timeout
+       self.max_tokens = max_tokens
+       self.context_tokens = context_tokens
+
+   @property
+   def client(self) -> httpx.AsyncClient:
+       """HTTP client used for requests, resolved on each use so it survives restarts."""
+       return self._client or get_http_client()
 
-   def generate_summary(self, prompt: str) -> str:
+   def _completions_url(self) -> str:
+       """Chat completions URL for the model; full endpoint URLs are used as-is."""
+       if self.model_name.startswith(('http://', 'https://')):
+           return self.model_name.rstrip('/') + '/v1/chat/completions'
+       return f"/models/{self.model_name}/v1/chat/completions"
+
+   def _max_tokens(self, prompt: str) -> int:
+       """Completion tokens that fit in the context window after the prompt."""
+       if self.context_tokens is None:
+           return self.max_tokens
+       # The prompt is only estimated, so a tenth of the window is kept in reserve.
+       prompt_tokens = estimate_tokens(prompt)
+       room = self.context_tokens * 9 // 10 - prompt_tokens
+       if room < min(self.max_tokens, 256):
+           raise ValueError(
+               f"Prompt of ~{prompt_tokens} tokens leaves no room to answer in the "
+               f"{self.context_tokens}-token context of {self.model_name}"
+           )
+       return min(self.max_tokens, room)
+
+   def _request_body(self, prompt: str, stream: bool) -> Dict[str, Any]:
+       return {
+           "model": self.model_name,
+           "messages": [{"role": "user", "content": prompt}],
+           "temperature": self.temperature,
+           "max_tokens": self._max_tokens(prompt),
+           "stream": stream
+       }
+
+   async def complete(self, prompt: str) -> str:
        """
-       Generate complete response from LLM.
-       
+       Generate a complete response from the LLM.
+
        Args:
            prompt: Input text for LLM
-           
+
        Returns:
            Complete generated text
+
+       Raises:
+           Exception: If the request fails, times out or returns no content
        """
        try:
-           messages = [{"role": "user", "content": prompt}]
-           
-           completion = self.client.chat.completions.create(
-               model=self.model_name,
-               messages=messages,
-               temperature=self.temperature,
-               max_tokens=10000
-           )
-           
-           return completion.choices[0].message.content
-           
+           async with get_generation_slots():
+               started = time.perf_counter()
+               response = await asyncio.wait_for(
+                   self.client.post(
+                       self._completions_url(),
+                       json=self._request_body(prompt, stream=False)
+                   ),
+                   self.timeout
+               )
+           response.raise_for_status()
+           body = response.json()
+           content = body["choices"][0]["message"]["content"]
+           if not content:
+               raise ValueError("Empty completion")
+       except Exception:
+           metrics.PIPELINE_ERRORS.labels(stage='llm').inc()
+           raise
+       # Without streaming the first token arrives with the last.
+       finished = time.perf_counter()
+       usage = body.get("usage") or {}
+       _record_generation(
+           usage.get("prompt_tokens") or estimate_tokens(prompt),
+           usage.get("completion_tokens") or estimate_tokens(content),
+           started, finished, finished
+       )
+       return content
+
+   async def stream(self, prompt: str) -> AsyncGenerator[str, None]:
+       """
+       Generate a streaming response from the LLM.
+
+       Chunks are yielded as soon as they arrive. The read timeout bounds the gap
+       between chunks and `timeout` bounds the whole generation.
+
+       Args:
+           prompt: Input text for LLM
+
+       Returns:
+           AsyncGenerator yielding text chunks
+
+       Raises:
+           Exception: If the request fails, exceeds its deadline or ends before the
+               model finished
+       """
+       try:
+           body = self._request_body(prompt, stream=True)
+           async with get_generation_slots():
+               deadline = asyncio.get_running_loop().time() + self.timeout
+               started = time.perf_counter()
+               first_token_at = None
+               chunks = 0
+               finished = False
+               async with self.client.stream(
+                   "POST",
+                   self._completions_url(),
+                   json=body
+               ) as response:
+                   response.raise_for_status()
+                   async for line in response.aiter_lines():
+                       if asyncio.get_running_loop().time() > deadline:
+                           raise asyncio.TimeoutError("Generation exceeded its deadline")
+                       if not line.startswith("data:"):
+                           continue
+                       data = line[len("data:"):].strip()
+                       if data == "[DONE]":
+                           finished = True
+                           break
+                       choice = json.loads(data)["choices"][0]
+                       content = choice["delta"].get("content")
+                       if choice.get("finish_reason"):
+                           finished = True
+                       if content:
+                           if first_token_at is None:
+                               first_token_at = time.perf_counter()
+                           # Streamed deltas carry one token each.
+                           chunks += 1
+                           yield content
+               if not finished:
+                   raise ValueError("Stream ended before the generation finished")
+               if first_token_at is not None:
+                   _record_generation(
+                       estimate_tokens(prompt), chunks, started, first_token_at, time.perf_counter()
+                   )
+       except Exception:
+           metrics.PIPELINE_ERRORS.labels(stage='llm').inc()
+           raise
+
+   async def generate_summary(self, prompt: str) -> str:
+       """
+       Generate complete response from LLM.
+
+       Args:
+           prompt: Input text for LLM
+
+       Returns:
+           Complete generated text, or an "Error: ..." message if generation failed
+       """
+       try:
+           return await self.complete(prompt)
        except Exception as e:
-           print(f"Exception occurred: {str(e)}")
-           return f"Error: {str(e)}"
+           print(f"Exception occurred: {str(e) or type(e).__name__}")
+           return f"Error: {str(e) or type(e).__name__}"
 
    async def generate_summary_stream(self, prompt: str) -> AsyncGenerator[str, None]:
        """
        Generate streaming response from LLM.
-       
+
        Args:
            prompt: Input text for LLM
-           
+
        Returns:
-           AsyncGenerator yielding text chunks
+           AsyncGenerator yielding text chunks, ending with an "Error: ..." chunk
+           if generation failed
        """
        try:
-           messages = [{"role": "user", "content": prompt}]
-           
-           stream = self.client.chat.completions.create(
-               model=self.model_name,
-               messages=messages,
-               temperature=self.temperature,
-               max_tokens=10000,
-               stream=True
-           )
-           
-           for chunk in stream:
-               if chunk.choices[0].delta.content is not None:
-                   yield chunk.choices[0].delta.content
-                   await asyncio.sleep(0.01)  # Small delay to control stream rate
-               
+           async for chunk in self.stream(prompt):
+               yield chunk
        except Exception as e:
-           print(f"Exception occurred in stream: {str(e)}")
-           yield f"Error: {str(e)}"
\ No newline at end of file
+           print(f"Exception occurred in stream: {str(e) or type(e).__name__}")
+           yield f"Error: {str(e) or type(e).__name__}"
@@ -0,0 +1,263 @@
+"""
+Deadline-bound scheduling of advice generation across LLM backends.
+
+`LLMScheduler` sits in front of the inference backends and always produces
+advice within `deadline_seconds`:
+
+1. The primary adapter runs first. If a hedge adapter (a second model or
+   endpoint) is configured and the primary has not answered after
+   `hedge_after_seconds`, or has failed, the hedge is started. The first answer
+   wins and the other request is cancelled. When streaming, "answered" means the
+   first chunk arrived.
+2. If both fail or time out, the fallback adapters (smaller models) are tried in
+   order with the time that is left.
+3. If every model fails, the caller's template summary is returned. Without one,
+   `LLMUnavailable` is raised. Failures are never returned as advice text.
+
+A stream that fails after its first chunk cannot switch to another backend
+without mixing two answers, so it raises `LLMStreamInterrupted` after the
+partial text; callers must not treat that text as advice.
+
+Concurrent generations are capped by the adapters' shared generation slots
+(`config.LLM_MAX_CONCURRENCY`); time spent waiting for a slot counts against the
+deadline. Attempts and the source of each response are counted in `app.metrics`.
+
+Example:
+    scheduler = LLMScheduler(primary, fallbacks=[LLMAdapter('small/model')])
+    advice = await scheduler.generate_summary(prompt, fallback=lambda: template_advice(...))
+"""
+
+import asyncio
+from typing import Any, AsyncGenerator, Awaitable, Callable, Dict, Optional, Sequence, Tuple
+
+import config
+from app import metrics
+
+
+class LLMUnavailable(Exception):
+    """Raised when no backend produced advice within the deadline and no template fallback was given."""
+
+
+class LLMStreamInterrupted(Exception):
+    """Raised when a stream fails after it started answering; the chunks already yielded are incomplete."""
+
+
+class LLMScheduler:
+    """
+    Runs generations against a primary, hedge and fallback adapters within a deadline.
+
+    Adapters provide `complete(prompt)` and `stream(prompt)`, which raise on
+    failure, and a per-request `timeout` (see `LLMAdapter` and `CachingLLMAdapter`).
+    """
+
+    def __init__(
+        self,
+        primary: Any,
+        hedge: Optional[Any] = None,
+        fallbacks: Sequence[Any] = (),
+        deadline_seconds: float = config.LLM_DEADLINE_SECONDS,
+        hedge_after_seconds: float = config.LLM_HEDGE_AFTER_SECONDS
+    ) -> None:
+        """
+        Initialize the scheduler.
+
+        Args:
+            primary: Adapter tried first
+            hedge: Adapter raced against the primary once it is slow or has failed
+            fallbacks: Adapters tried in order once the primary and hedge failed
+            deadline_seconds: Time budget for one piece of advice across all attempts
+            hedge_after_seconds: Delay before the hedge request is sent
+        """
+        self.primary = primary
+        self.hedge = hedge
+        self.fallbacks = list(fallbacks)
+        self.deadline_seconds = deadline_seconds
+        self.hedge_after_seconds = hedge_after_seconds
+
+    @staticmethod
+    def _remaining(deadline: float) -> float:
+        return deadline - asyncio.get_running_loop().time()
+
+    async def _attempt(
+        self,
+        adapter: Any,
+        role: str,
+        deadline: float,
+        call: Callable[[Any], Awaitable[Any]]
+    ) -> Any:
+        """Run one call against an adapter, bounded by its timeout and the deadline."""
+        timeout = min(adapter.timeout, self._remaining(deadline))
+        try:
+            if timeout <= 0:
+                raise asyncio.TimeoutError('LLM deadline exceeded')
+            result = await asyncio.wait_for(call(adapter), timeout)
+        except asyncio.TimeoutError:
+            metrics.LLM_ATTEMPTS.labels(role=role, outcome='timeout').inc()
+            print(f"LLM {role} ({adapter.model_name}) timed out")
+            raise
+        except Exception as e:
+            metrics.LLM_ATTEMPTS.labels(role=role, outcome='error').inc()
+            print(f"LLM {role} ({adapter.model_name}) failed: {str(e) or type(e).__name__}")
+            raise
+        metrics.LLM_ATTEMPTS.labels(role=role, outcome='ok').inc()
+        return result
+
+    async def _hedged(
+        self,
+        deadline: float,
+        call: Callable[[Any], Awaitable[Any]],
+        discard: Optional[Callable[[Any], Awaitable[None]]] = None
+    ) -> Tuple[Any, str]:
+        """
+        Race the primary and, once it is slow or has failed, the hedge.
+
+        Returns:
+            Tuple[Any, str]: The first successful result and the role that produced it
+
+        Raises:
+            Exception: The last failure, if neither produced a result
+        """
+        tasks: Dict[asyncio.Task, str] = {
+            asyncio.create_task(self._attempt(self.primary, 'primary', deadline, call)): 'primary'
+        }
+        hedge = self.hedge
+        error: BaseException = LLMUnavailable('No LLM attempt finished')
+        winner: Optional[Tuple[Any, str]] = None
+        try:
+            while tasks and winner is None:
+                done, _ = await asyncio.wait(
+                    tasks,
+                    timeout=self.hedge_after_seconds if hedge is not None else None,
+                    return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    role = tasks.pop(task)
+                    if task.exception() is not None:
+                        error = task.exception()
+                    elif winner is None:
+                        winner = (task.result(), role)
+                    elif discard is not None:
+                        await discard(task.result())
+                if winner is None and hedge is not None and (not done or not tasks):
+                    print(f"Hedging LLM request to {hedge.model_name}")
+                    tasks[asyncio.create_task(self._attempt(hedge, 'hedge', deadline, call))] = 'hedge'
+                    hedge = None
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+                elif discard is not None and not task.cancelled() and task.exception() is None:
+                    # Finished while another result was being discarded; cancel() would not close it.
+                    await discard(task.result())
+        if winner is None:
+            raise error
+        return winner
+
+    async def _generate(
+        self,
+        deadline: float,
+        call: Callable[[Any], Awaitable[Any]],
+        discard: Optional[Callable[[Any], Awaitable[None]]] = None
+    ) -> Optional[Tuple[Any, str]]:
+        """Run the hedged primary, then the fallbacks; None if every model failed."""
+        try:
+            return await self._hedged(deadline, call, discard)
+        except Exception:
+            pass
+        for adapter in self.fallbacks:
+            if self._remaining(deadline) <= 0:
+                break
+            try:
+                return await self._attempt(adapter, 'fallback', deadline, call), 'fallback'
+            except Exception:
+                continue
+        return None
+
+    async def generate_summary(self, prompt: str, fallback: Optional[Callable[[], str]] = None) -> str:
+        """
+        Generate complete advice for a prompt.
+
+        Args:
+            prompt: Input text for LLM
+            fallback: Builds a template summary if no model answers in time
+
+        Returns:
+            str: Generated text, or the template summary
+
+        Raises:
+            LLMUnavailable: If no model answered in time and no fallback was given
+        """
+        deadline = asyncio.get_running_loop().time() + self.deadline_seconds
+        result = await self._generate(deadline, lambda adapter: adapter.complete(prompt))
+        if result is not None:
+            text, source = result
+            metrics.LLM_RESPONSES.labels(source=source).inc()
+            return text
+        if fallback is None:
+            raise LLMUnavailable(f'No LLM answered within {self.deadline_seconds}s')
+        print("No LLM answered in time; using the template summary")
+        metrics.LLM_RESPONSES.labels(source='template').inc()
+        return fallback()
+
+    async def generate_summary_stream(
+        self,
+        prompt: str,
+        fallback: Optional[Callable[[], str]] = None
+    ) -> AsyncGenerator[str, None]:
+        """
+        Stream advice for a prompt.
+
+        Backends are raced and fall back on their time to the first chunk. Once a
+        backend has started answering its stream is used to the end; if it fails
+        part-way, `LLMStreamInterrupted` is raised rather than mixing in another
+        answer.
+
+        Args:
+            prompt: Input text for LLM
+            fallback: Builds a template summary if no model starts answering in time
+
+        Returns:
+            AsyncGenerator yielding text chunks
+
+        Raises:
+            LLMUnavailable: If no model answered in time and no fallback was given
+            LLMStreamInterrupted: If the answering model failed part-way
+        """
+        async def first_chunk(adapter: Any) -> Tuple[AsyncGenerator[str, None], str]:
+            stream = adapter.stream(prompt)
+            try:
+                return stream, await stream.__anext__()
+            except BaseException:
+                await stream.aclose()
+                raise
+
+        async def discard(opened: Tuple[AsyncGenerator[str, None], str]) -> None:
+            await opened[0].aclose()
+
+        deadline = asyncio.get_running_loop().time() + self.deadline_seconds
+        result = await self._generate(deadline, first_chunk, discard)
+        if result is None:
+            if fallback is None:
+                raise LLMUnavailable(f'No LLM answered within {self.deadline_seconds}s')
+            print("No LLM answered in time; using the template summary")
+            metrics.LLM_RESPONSES.labels(source='template').inc()
+            yield fallback()
+            return
+
+        (stream, chunk), source = result
+        metrics.LLM_RESPONSES.labels(source=source).inc()
+        try:
+            yield chunk
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(stream.__anext__(), max(self._remaining(deadline), 0))
+                except StopAsyncIteration:
+                    break
+                except Exception as e:
+                    reason = str(e) or type(e).__name__
+                    print(f"LLM {source} stream ended early: {reason}")
+                    metrics.LLM_ATTEMPTS.labels(role=source, outcome='interrupted').inc()
+                    raise LLMStreamInterrupted(f'LLM {source} stream ended early: {reason}') from e
+                yield chunk
+        finally:
+            await stream.aclose()
@@ -0,0 +1,277 @@
+"""
+Prometheus metrics (`prometheus_client`) and per-request trace ids.
+
+The pipeline behind a webhook (Strava sync, run processing, prompt building,
+LLM generation, email) records how long each stage took in one histogram,
+labelled by stage. Failures are counted per stage too. LLM token counts and
+throughput, Strava requests and job outcomes have metrics of their own.
+`render()` produces the text served on `/metrics`.
+
+When the app runs as several processes (e.g. `uvicorn --workers`), point
+`PROMETHEUS_MULTIPROC_DIR` at an empty directory before they start: every
+process then writes its metrics there and `render()` reports their sum, so
+`/metrics` is complete whichever process serves it.
+
+Each HTTP request, and each queued job it creates, runs under a trace: a
+short random id in a context variable. `TraceIdFilter` stamps it on log
+records, so one webhook's work can be followed through the logs.
+
+Example:
+    with timed('prompt_build'):
+        prompt = build_advice_prompt(result)
+"""
+
+import contextvars
+import logging
+import os
+import time
+import uuid
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, generate_latest
+from prometheus_client import multiprocess
+from prometheus_client.core import GaugeMetricFamily
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+TOKEN_BUCKETS = (50, 100, 250, 500, 1000, 2000, 4000, 8000, 16000)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100, 250, 500)
+
+_callback_gauges: List['CallbackGauge'] = []
+
+
+class CallbackGauge:
+    """
+    Gauge read from a callback whenever metrics are collected, for state kept
+    elsewhere such as queue sizes. Unlike `prometheus_client.Gauge.set_function`
+    it supports labels.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str],
+        function: Callable[[], Dict[Tuple[Any, ...], float]]
+    ) -> None:
+        """
+        Register the gauge.
+
+        Args:
+            name: Metric name
+            documentation: Help text
+            labelnames: Label names
+            function: Returns the current value per tuple of label values
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = list(labelnames)
+        self.function = function
+        REGISTRY.register(self)
+        _callback_gauges.append(self)
+
+    def describe(self) -> List[GaugeMetricFamily]:
+        return [GaugeMetricFamily(self.name, self.documentation, labels=self.labelnames)]
+
+    def collect(self) -> List[GaugeMetricFamily]:
+        family = GaugeMetricFamily(self.name, self.documentation, labels=self.labelnames)
+        for key, value in self.function().items():
+            family.add_metric([str(part) for part in key], value)
+        return [family]
+
+
+def render() -> bytes:
+    """
+    Render every metric in the Prometheus text format; in multiprocess mode, the
+    counters and histograms of all processes are summed.
+    """
+    if not os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        return generate_latest(REGISTRY)
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    for gauge in _callback_gauges:
+        registry.register(gauge)
+    return generate_latest(registry)
+
+
+def sample_value(name: str, **labels: object) -> float:
+    """Current value of one sample in this process, e.g. `sample_value('workoutplan_jobs_total', outcome='failed')`."""
+    value = REGISTRY.get_sample_value(name, {key: str(value) for key, value in labels.items()})
+    return value or 0.0
+
+
+# Pipeline metrics
+PIPELINE_STAGE_SECONDS = Histogram(
+    'workoutplan_pipeline_stage_seconds',
+    'Time spent in each stage of the advice pipeline',
+    ['stage'],
+    buckets=DEFAULT_BUCKETS
+)
+PIPELINE_ERRORS = Counter(
+    'workoutplan_pipeline_errors_total',
+    'Failures per stage of the advice pipeline',
+    ['stage']
+)
+LLM_PROMPT_TOKENS = Histogram(
+    'workoutplan_llm_prompt_tokens',
+    'Prompt tokens per LLM request',
+    buckets=TOKEN_BUCKETS
+)
+LLM_COMPLETION_TOKENS = Histogram(
+    'workoutplan_llm_completion_tokens',
+    'Completion tokens per LLM request',
+    buckets=TOKEN_BUCKETS
+)
+LLM_TOKENS_PER_SECOND = Histogram(
+    'workoutplan_llm_tokens_per_second',
+    'Completion tokens per second of generation, after the first token',
+    buckets=(1, 5, 10, 20, 30, 50, 75, 100, 200)
+)
+LLM_ATTEMPTS = Counter(
+    'workoutplan_llm_attempts_total',
+    'LLM generation attempts, by role (primary, hedge, fallback) and outcome',
+    ['role', 'outcome']
+)
+LLM_RESPONSES = Counter(
+    'workoutplan_llm_responses_total',
+    'Advice responses, by what produced them (primary, hedge, fallback or template)',
+    ['source']
+)
+STREAM_SUBSCRIBERS = Counter(
+    'workoutplan_stream_subscribers_total',
+    'Advice stream requests, by whether they started a generation or joined a running one',
+    ['role']
+)
+STRAVA_REQUESTS = Counter(
+    'workoutplan_strava_requests_total',
+    'Strava API requests sent, by priority',
+    ['priority']
+)
+STRAVA_REQUESTS_PER_JOB = Histogram(
+    'workoutplan_strava_requests_per_job',
+    'Strava API requests made by one advice job',
+    buckets=COUNT_BUCKETS
+)
+JOBS = Counter(
+    'workoutplan_jobs_total',
+    'Queued jobs run, by outcome',
+    ['outcome']
+)
+JOB_SECONDS = Histogram(
+    'workoutplan_job_seconds',
+    'Time to run one queued job, including failed attempts',
+    buckets=DEFAULT_BUCKETS
+)
+HTTP_REQUEST_SECONDS = Histogram(
+    'workoutplan_http_request_seconds',
+    'Time until the response starts, by route and status',
+    ['method', 'route', 'status'],
+    buckets=DEFAULT_BUCKETS
+)
+
+
+@contextmanager
+def timed(stage: str) -> Iterator[None]:
+    """Record the duration of a pipeline stage, and count it as failed if it raises."""
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        PIPELINE_ERRORS.labels(stage=stage).inc()
+        raise
+    finally:
+        PIPELINE_STAGE_SECONDS.labels(stage=stage).observe(time.perf_counter() - start)
+
+
+@dataclass
+class Trace:
+    """Work done on behalf of one request or job."""
+
+    trace_id: str
+    strava_requests: int = 0
+
+
+_current_trace: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar('trace', default=None)
+
+
+def new_trace_id() -> str:
+    """Generate a short random trace id."""
+    return uuid.uuid4().hex[:16]
+
+
+def current_trace() -> Optional[Trace]:
+    """Return the trace of the current context, if any."""
+    return _current_trace.get()
+
+
+@contextmanager
+def trace(trace_id: Optional[str] = None) -> Iterator[Trace]:
+    """
+    Run the enclosed code under a trace.
+
+    Worker threads started with `asyncio.to_thread` inherit the trace.
+
+    Args:
+        trace_id: Id to continue, e.g. one stored with a queued job; a new one if None
+    """
+    token = _current_trace.set(Trace(trace_id or new_trace_id()))
+    try:
+        yield _current_trace.get()
+    finally:
+        _current_trace.reset(token)
+
+
+def count_strava_request(priority: str) -> None:
+    """Count a Strava API request, globally and against the current trace."""
+    STRAVA_REQUESTS.labels(priority=priority).inc()
+    current = _current_trace.get()
+    if current is not None:
+        current.strava_requests += 1
+
+
+class TraceIdFilter(logging.Filter):
+    """Set `record.trace_id` to the current trace id, or '-' outside a trace."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        current = _current_trace.get()
+        record.trace_id = current.trace_id if current else '-'
+        return True
+
+
+class TraceMiddleware:
+    """
+    ASGI middleware running each HTTP request under a trace.
+
+    A trace id sent in the `X-Trace-Id` request header is continued; the id is
+    returned in the same response header. The time until the response starts is
+    recorded in `HTTP_REQUEST_SECONDS`, labelled with the route template.
+    """
+
+    def __init__(self, app: Callable[..., Awaitable[None]]) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Dict[str, Any], receive: Callable, send: Callable) -> None:
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get('headers') or [])
+        trace_id = headers.get(b'x-trace-id', b'').decode('latin-1')[:64] or None
+        start = time.perf_counter()
+        with trace(trace_id) as current:
+            async def send_traced(message: Dict[str, Any]) -> None:
+                if message['type'] == 'http.response.start':
+                    route = scope.get('route')
+                    HTTP_REQUEST_SECONDS.labels(
+                        method=scope['method'],
+                        route=getattr(route, 'path', 'unmatched'),
+                        status=message['status']
+                    ).observe(time.perf_counter() - start)
+                    message = {
+                        **message,
+                        'headers': [*message.get('headers', []), (b'x-trace-id', current.trace_id.encode())],
+                    }
+                await send(message)
+
+            await self.app(scope, receive, send_traced)
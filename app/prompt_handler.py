@@ -1,37 +1,326 @@
 """
 Handles prompt template loading and formatting for LLM input.
+
+Prompts are built against a token budget: the latest activity is sent in full,
+older activities as weekly and monthly rollups in a dense pipe-separated table.
+Metrics derived from the latest activity's per-second streams follow it, with
+km splits in the same table format, and then its most similar past efforts with
+the trend across them. When the budget is tight the oldest rollups are dropped
+first, then the least similar efforts, the km splits and the other stream
+metrics. A prompt that is still over budget is flagged as such.
 """
 
-from typing import Dict, Any
+import json
+import re
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import config
+
+_TOKEN_PATTERN = re.compile(r"\d|[^\W\d_]+|[^\w\s]")
+ROLLUP_HEADER = 'period|runs|km|min|pace_min_per_km|elev_m'
+SPLIT_FIELDS = ('km', 'seconds', 'pace_min_per_km', 'avg_heartrate', 'elevation_change_m')
+SIMILAR_FIELDS = ('date', 'distance_km', 'pace_min_per_km', 'elevation_gain_m', 'average_heartrate', 'speed_diff_kmh')
+
+
+def estimate_tokens(text: str) -> int:
+   """
+   Estimate the LLM token count of a text without loading a tokenizer.
+
+   Mirrors SentencePiece-style tokenizers such as Mistral's: every digit and
+   punctuation mark is its own token and long words split into several.
+
+   Args:
+       text: Text to measure
+
+   Returns:
+       Estimated number of tokens
+   """
+   return sum(
+       1 + (len(piece) - 1) // 6 if piece.isalpha() else 1
+       for piece in _TOKEN_PATTERN.findall(text)
+   )
+
+
+def _parse_date(value: Any) -> datetime:
+   if isinstance(value, datetime):
+       return value
+   return datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+
+
+def _compact(record: Dict[str, Any]) -> Dict[str, Any]:
+   """Round floats and drop empty fields so a record serializes densely."""
+   return {
+       key: round(value, 2) if isinstance(value, float) else value
+       for key, value in record.items()
+       if value is not None
+   }
+
+
+def _format_pace(minutes_per_km: Any) -> Optional[str]:
+   """Format a pace in minutes per km as m:ss, or None if it is missing."""
+   if minutes_per_km is None or not isinstance(minutes_per_km, (int, float)):
+       return None
+   if minutes_per_km != minutes_per_km or minutes_per_km in (float('inf'), float('-inf')):
+       return None
+   minutes, seconds = divmod(round(minutes_per_km * 60), 60)
+   return f'{minutes}:{seconds:02d}'
+
+
+def template_advice(
+   activity_data: List[Dict[str, Any]],
+   summary_statistics: List[Dict[str, Any]],
+   training_load: Optional[Dict[str, Any]] = None
+) -> str:
+   """
+   Write a plain summary of the latest activity and training load without an LLM.
+
+   Used as the last resort when no model answers in time, so the athlete still
+   gets their numbers and a rule-of-thumb recommendation.
+
+   Args:
+       activity_data: Processed activity records
+       summary_statistics: Aggregated statistics
+       training_load: Training-load metrics, if available
+
+   Returns:
+       Summary text
+   """
+   lines = ["Your AI coach is unavailable right now, so here is a summary of your training."]
+   records = sorted(activity_data, key=lambda r: _parse_date(r['start_date']), reverse=True)
+   if records:
+       latest = records[0]
+       details = [f"{latest.get('distance_km') or 0:.2f} km", f"{latest.get('moving_time_min') or 0:.0f} min"]
+       pace = _format_pace(latest.get('pace_min_per_km'))
+       if pace:
+           details.append(f'{pace} min/km')
+       if latest.get('total_elevation_gain'):
+           details.append(f"{latest['total_elevation_gain']:.0f} m of climbing")
+       lines.append(
+           f"\nLatest {latest.get('type') or 'activity'}: {latest.get('name') or 'Untitled'} "
+           f"on {_parse_date(latest['start_date']):%Y-%m-%d}, " + ', '.join(details) + '.'
+       )
+       averages = next((row for row in summary_statistics if row.get('type') == latest.get('type')), None)
+       if averages and averages.get('avg_distance_km'):
+           comparison = (
+               f"Your average over {averages.get('total_activities', 0):.0f} activities is "
+               f"{averages['avg_distance_km']:.2f} km"
+           )
+           average_pace = _format_pace(averages.get('avg_pace_min_per_km'))
+           if average_pace:
+               comparison += f' at {average_pace} min/km'
+           lines.append(comparison + '.')
+   else:
+       lines.append('\nNo activities recorded yet.')
+
+   if training_load:
+       lines.append(
+           f"\nTraining load: fitness (CTL) {training_load.get('chronic_training_load')}, "
+           f"fatigue (ATL) {training_load.get('acute_training_load')}, "
+           f"form (TSB) {training_load.get('training_stress_balance')}. "
+           f"{training_load.get('weekly_distance_km')} km in the last 7 days against "
+           f"{training_load.get('avg_weekly_distance_km_28d')} km per week over the last 4 weeks."
+       )
+       ratio = training_load.get('acute_chronic_workload_ratio')
+       if ratio is not None and ratio > 1.5:
+           lines.append(
+               f'Your acute:chronic workload ratio is {ratio}, above 1.5: '
+               'keep the next few days easy to let your body absorb the recent load.'
+           )
+       elif ratio is not None and ratio < 0.8:
+           lines.append(
+               f'Your acute:chronic workload ratio is {ratio}, below 0.8: '
+               'there is room to build volume gradually, by about 10% a week.'
+           )
+       elif ratio is not None:
+           lines.append(
+               f'Your acute:chronic workload ratio is {ratio}, in the 0.8-1.5 range: '
+               'your load is balanced, so keep your current progression.'
+           )
+   return '\n'.join(lines)
+
+
+def _stream_section(metrics: Dict[str, Any]) -> str:
+   """Render stream-derived metrics: km splits as a table, the rest as compact JSON."""
+   lines = []
+   splits = metrics.get('splits')
+   if splits:
+       fields = [field for field in SPLIT_FIELDS if any(field in split for split in splits)]
+       lines.append('|'.join(fields))
+       lines.extend('|'.join(str(split.get(field, '')) for field in fields) for split in splits)
+   others = {key: value for key, value in metrics.items() if key != 'splits'}
+   if others:
+       lines.append(json.dumps(others, separators=(',', ':')))
+   return '\n'.join(lines)
+
+
+def _similar_section(efforts: Dict[str, Any]) -> str:
+   """Render similar past efforts as a table, then their trend as compact JSON."""
+   lines = ['|'.join(SIMILAR_FIELDS)]
+   lines.extend(
+       '|'.join('' if effort.get(field) is None else str(effort[field]) for field in SIMILAR_FIELDS)
+       for effort in efforts['similar']
+   )
+   if efforts.get('trend'):
+       lines.append('trend:' + json.dumps(efforts['trend'], separators=(',', ':')))
+   return '\n'.join(lines)
+
+
+def rollup_row(period: str, runs: float, km: float, minutes: float, elevation: float) -> str:
+   """Render one period's run totals as a row under `ROLLUP_HEADER`."""
+   pace = minutes / km if km else 0.0
+   return f'{period}|{int(runs)}|{km:.1f}|{minutes:.0f}|{pace:.2f}|{elevation:.0f}'
+
+
+@dataclass
+class Rollups:
+   """
+   Weekly and monthly totals of the runs before the latest, as `rollup_row` rows, newest first.
+   """
+
+   weekly: List[str] = field(default_factory=list)
+   monthly: List[str] = field(default_factory=list)
+
+
+@dataclass
+class PromptBuild:
+   """A formatted prompt and how much of the history fit in the budget."""
+
+   text: str
+   token_count: int
+   weekly_rows: int
+   monthly_rows: int
+   similar_rows: int = 0
+   # Over the budget even with every optional section dropped
+   over_budget: bool = False
+
 
 class PromptHandler:
    """
    Class to handle loading and formatting of prompt templates.
    """
-   
-   def __init__(self, template_path: str) -> None:
-       """Initialize with path to prompt template file."""
+
+   def __init__(self, template_path: str, token_budget: int = config.PROMPT_TOKEN_BUDGET) -> None:
+       """Initialize with path to prompt template file and the prompt token budget."""
        self.template_path = template_path
+       self.token_budget = token_budget
 
    def load_prompt(self) -> str:
        """Load prompt template from file."""
        with open(self.template_path, 'r') as file:
            return file.read()
 
-   def format_prompt(self, activity_data: Dict[str, Any], summary_statistics: Dict[str, Any]) -> str:
+   def build_prompt(
+       self,
+       activity_data: List[Dict[str, Any]],
+       summary_statistics: List[Dict[str, Any]],
+       training_load: Optional[Dict[str, Any]] = None,
+       rollups: Optional[Rollups] = None,
+       stream_metrics: Optional[Dict[str, Any]] = None,
+       similar_efforts: Optional[Dict[str, Any]] = None
+   ) -> PromptBuild:
+       """
+       Build a prompt that fits the token budget.
+
+       Rollups, similar efforts and stream metrics are dropped until it fits, oldest
+       and least similar first. The latest activity, summary statistics and training
+       load are always sent; if they alone exceed the budget, the prompt is returned
+       with `over_budget` set.
+
+       Args:
+           activity_data: Processed activity records
+           summary_statistics: Aggregated statistics
+           training_load: Training-load metrics, if available
+           rollups: Weekly and monthly totals of earlier runs, if available
+           stream_metrics: Metrics derived from the latest activity's streams, if available
+           similar_efforts: The past activities most similar to the latest one and their
+               trend, if available
+
+       Returns:
+           PromptBuild with the prompt text, its estimated token count and what was kept
+       """
+       template = self.load_prompt()
+       records = sorted(activity_data, key=lambda r: _parse_date(r['start_date']), reverse=True)
+       weekly, monthly = (list(rollups.weekly), list(rollups.monthly)) if rollups else ([], [])
+
+       latest = json.dumps(_compact(records[0]), separators=(',', ':')) if records else 'No activities recorded.'
+       stats = '\n'.join(
+           json.dumps(_compact(row), separators=(',', ':')) for row in summary_statistics
+       )
+       # The evaluation time changes on every call and would make every prompt, and so
+       # every advice cache key, unique.
+       load = json.dumps(
+           _compact({key: value for key, value in training_load.items() if key != 'as_of'}),
+           separators=(',', ':')
+       ) if training_load else 'Not available.'
+       stream_metrics = dict(stream_metrics or {})
+       similar = list((similar_efforts or {}).get('similar') or [])
+
+       def render(weeks: List[str], months: List[str]) -> str:
+           sections = [f'Latest activity:\n{latest}']
+           if stream_metrics:
+               sections.append(
+                   'Latest activity detail (from per-second streams):\n' + _stream_section(stream_metrics)
+               )
+           if similar:
+               sections.append(
+                   'Most similar past efforts (most similar first):\n'
+                   + _similar_section({**similar_efforts, 'similar': similar})
+               )
+           if weeks:
+               sections.append('Earlier weeks (newest first):\n' + '\n'.join([ROLLUP_HEADER] + weeks))
+           if months:
+               sections.append('Earlier months (newest first):\n' + '\n'.join([ROLLUP_HEADER] + months))
+           return template.format(
+               activity_data='\n\n'.join(sections),
+               summary_statistics=stats,
+               training_load=load
+           )
+
+       # Drop the oldest months first, then the oldest weeks, until the prompt fits.
+       text = render(weekly, monthly)
+       tokens = estimate_tokens(text)
+       if tokens > self.token_budget:
+           while tokens > self.token_budget and (weekly or monthly):
+               tokens -= estimate_tokens((monthly or weekly).pop()) + 1
+           text = render(weekly, monthly)
+           tokens = estimate_tokens(text)
+       # Then the least similar efforts, the km splits and the other stream metrics.
+       while tokens > self.token_budget and (similar or stream_metrics):
+           if similar:
+               similar.pop()
+           elif 'splits' in stream_metrics:
+               del stream_metrics['splits']
+           else:
+               stream_metrics = {}
+           text = render(weekly, monthly)
+           tokens = estimate_tokens(text)
+
+       return PromptBuild(
+           text=text,
+           token_count=tokens,
+           weekly_rows=len(weekly),
+           monthly_rows=len(monthly),
+           similar_rows=len(similar),
+           over_budget=tokens > self.token_budget
+       )
+
+   def format_prompt(
+       self,
+       activity_data: List[Dict[str, Any]],
+       summary_statistics: List[Dict[str, Any]],
+       training_load: Optional[Dict[str, Any]] = None
+   ) -> str:
        """
        Format prompt with activity data and statistics.
-       
+
        Args:
            activity_data: Activity details
            summary_statistics: Aggregated statistics
-           
+           training_load: Training-load metrics, if available
+
        Returns:
            Formatted prompt for LLM
        """
-       template = self.load_prompt()
-       return template.format(
-           activity_data=activity_data,
-           summary_statistics=summary_statistics
-       )
-   
+       return self.build_prompt(activity_data, summary_statistics, training_load).text
@@ -0,0 +1,557 @@
+"""
+Nearest-neighbour index of past activities, to compare the latest one with similar efforts.
+
+Every activity is described by a feature vector built from the same quantities
+the run processing computes: distance, pace, elevation gain, average heart
+rate, the gap between maximum and average speed, and the time of day. Time of
+day is encoded as a point on a circle (sine and cosine of the UTC hour), so
+23:00 is close to 01:00 and the missing local time zone, a constant rotation,
+does not change any distance. Features are standardized per activity type and
+weighted by `FEATURE_WEIGHTS`. A feature missing from the queried activity is
+left out of the comparison; one missing from a candidate counts as average.
+
+Each activity type is held in memory as a float32 matrix. A query computes the
+distances to every row at once with the expansion |x - q|² = |x|² - 2x·q + |q|²,
+a single matrix-vector product over precomputed row norms, and selects the k
+nearest with `argpartition`. Once a type has `config.SIMILARITY_ANN_MIN_ROWS`
+rows, a query only scans the `config.SIMILARITY_ANN_PROBES` closest clusters of
+a k-means inverted-file index instead.
+
+The activity store is the source of truth: an activity type is loaded from it
+on first use, and syncs update the loaded rows in place. Standardization and
+clusters are refitted when a type has doubled since they were fitted. Every
+update increments a version in the store, in the same transaction that logs
+the ids of the activities it touched. Another process that sees a newer
+version re-reads just those activities. It reloads everything only when the
+log no longer reaches back to its version, or after a bulk write.
+
+Example:
+    index = similarity_index(store.db_path, athlete_id)
+    index.apply(records)
+    efforts = index.similar_efforts(activity_id, 'Run')
+"""
+
+import sqlite3
+import threading
+import warnings
+from contextlib import closing
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+import config
+from app.activity_store import ActivityStore
+from app.training_load import DAY_SECONDS, start_timestamp
+
+# Stored columns the features are computed from and the dtypes they are loaded as.
+FEATURE_COLUMNS = {
+    'id': np.int64,
+    'start_ts': np.int64,
+    'distance': np.float32,  # In meters
+    'moving_time': np.float32,  # In seconds
+    'total_elevation_gain': np.float32,  # In meters
+    'average_heartrate': np.float32,  # Beats per minute
+    'average_speed': np.float32,  # Speed in m/s
+    'max_speed': np.float32,  # Speed in m/s
+}
+FEATURES = (
+    'distance_km',
+    'pace_min_per_km',
+    'elevation_gain_m',
+    'average_heartrate',
+    'speed_diff_kmh',
+    'hour_sin',
+    'hour_cos',
+)
+# Time of day takes two coordinates, so each counts half.
+FEATURE_WEIGHTS = np.array([1.0, 1.0, 1.0, 1.0, 1.0, 0.5, 0.5], dtype=np.float32)
+# Features reported for each similar effort
+EFFORT_FIELDS = FEATURES[:5]
+# Versions kept in the change log; a process further behind reloads every type.
+CHANGE_LOG_VERSIONS = 1000
+
+
+def feature_matrix(columns: Dict[str, np.ndarray]) -> np.ndarray:
+    """
+    Compute activity feature vectors from stored column arrays.
+
+    Args:
+        columns: Arrays of the `FEATURE_COLUMNS` fields, one element per activity
+
+    Returns:
+        np.ndarray: (n, len(FEATURES)) float32 matrix; missing features are NaN
+    """
+    distance_km = columns['distance'].astype(np.float32) / np.float32(1000)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        pace = np.where(
+            distance_km > 0, columns['moving_time'] / np.float32(60) / distance_km, np.float32(np.nan)
+        )
+    angle = (columns['start_ts'] % DAY_SECONDS) * (2 * np.pi / DAY_SECONDS)
+    return np.column_stack([
+        distance_km,
+        pace,
+        columns['total_elevation_gain'],
+        columns['average_heartrate'],
+        (columns['max_speed'] - columns['average_speed']) * np.float32(3.6),
+        np.sin(angle),
+        np.cos(angle),
+    ]).astype(np.float32)
+
+
+def _record_columns(records: List[Dict[str, Any]]) -> Dict[str, np.ndarray]:
+    """Transpose activity store records into `FEATURE_COLUMNS` arrays; None becomes NaN."""
+    columns = {
+        field: np.array([record.get(field) for record in records], dtype=dtype)
+        for field, dtype in FEATURE_COLUMNS.items() if field not in ('id', 'start_ts')
+    }
+    columns['id'] = np.array([int(record['id']) for record in records], dtype=np.int64)
+    columns['start_ts'] = np.array([start_timestamp(record) for record in records], dtype=np.int64)
+    return columns
+
+
+def _nearest_centroids(vectors: np.ndarray, centroids: np.ndarray, chunk_size: int = 8192) -> np.ndarray:
+    """Assign each vector to its nearest centroid, in chunks to bound memory."""
+    centroid_norms = (centroids * centroids).sum(axis=1)
+    assignment = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), chunk_size):
+        chunk = vectors[start:start + chunk_size]
+        assignment[start:start + chunk_size] = np.argmin(centroid_norms - 2 * chunk @ centroids.T, axis=1)
+    return assignment
+
+
+def _kmeans(vectors: np.ndarray, clusters: int, iterations: int = 10, seed: int = 0) -> np.ndarray:
+    """Fit k-means centroids with Lloyd's algorithm on a sample of the vectors."""
+    rng = np.random.default_rng(seed)
+    sample = vectors[rng.choice(len(vectors), min(len(vectors), 64 * clusters), replace=False)]
+    centroids = sample[rng.choice(len(sample), clusters, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = _nearest_centroids(sample, centroids)
+        counts = np.bincount(assignment, minlength=clusters)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, sample)
+        empty = counts == 0
+        centroids[~empty] = sums[~empty] / counts[~empty, None]
+        # Empty clusters restart from random sample points.
+        centroids[empty] = sample[rng.choice(len(sample), int(empty.sum()))]
+    return centroids
+
+
+class _TypeIndex:
+    """
+    Feature rows of one activity type, held in memory.
+
+    Deleted rows stay in the arrays, marked dead, until the next refit.
+    """
+
+    def __init__(self, ids: np.ndarray, start_ts: np.ndarray, raw: np.ndarray) -> None:
+        self.ids = ids
+        self.start_ts = start_ts
+        self.raw = raw
+        self.alive = np.ones(len(ids), dtype=bool)
+        self.rows = {int(activity_id): row for row, activity_id in enumerate(ids)}
+        self._fit()
+
+    def _fit(self) -> None:
+        """Compact out dead rows, refit the standardization and rebuild the clusters."""
+        if not self.alive.all():
+            self.ids, self.start_ts, self.raw = self.ids[self.alive], self.start_ts[self.alive], self.raw[self.alive]
+            self.alive = np.ones(len(self.ids), dtype=bool)
+            self.rows = {int(activity_id): row for row, activity_id in enumerate(self.ids)}
+        with warnings.catch_warnings():
+            # A feature missing from every row gives NaN statistics and zero weight.
+            warnings.simplefilter('ignore', category=RuntimeWarning)
+            self.mean = np.nanmean(self.raw, axis=0)
+            std = np.nanstd(self.raw, axis=0)
+        usable = np.isfinite(std) & (std > 0)
+        self.mean = np.where(np.isfinite(self.mean), self.mean, 0).astype(np.float32)
+        self.scale = np.where(usable, np.sqrt(FEATURE_WEIGHTS) / np.where(usable, std, 1), 0).astype(np.float32)
+        self.vectors = self._transform(self.raw)
+        self.norms = (self.vectors * self.vectors).sum(axis=1)
+        self.fitted_rows = max(len(self.ids), 1)
+        self.centroids: Optional[np.ndarray] = None
+        if 0 < config.SIMILARITY_ANN_MIN_ROWS <= len(self.ids):
+            self.centroids = _kmeans(self.vectors, int(np.sqrt(len(self.ids))))
+            self.assignment = _nearest_centroids(self.vectors, self.centroids)
+            order = np.argsort(self.assignment, kind='stable')
+            bounds = np.searchsorted(self.assignment[order], np.arange(len(self.centroids) + 1))
+            self.lists = [order[start:end] for start, end in zip(bounds[:-1], bounds[1:])]
+
+    def _transform(self, raw: np.ndarray) -> np.ndarray:
+        """Standardize and weight raw feature rows; missing features become 0, the mean."""
+        return np.nan_to_num((raw - self.mean) * self.scale, nan=0.0).astype(np.float32)
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def upsert(self, ids: np.ndarray, start_ts: np.ndarray, raw: np.ndarray) -> None:
+        """Add new activities and overwrite the rows of existing ones."""
+        existing = np.array([int(activity_id) in self.rows for activity_id in ids], dtype=bool)
+        vectors = self._transform(raw)
+        for i in np.flatnonzero(existing):
+            row = self.rows[int(ids[i])]
+            self.start_ts[row], self.raw[row], self.vectors[row] = start_ts[i], raw[i], vectors[i]
+            self.norms[row] = vectors[i] @ vectors[i]
+            if self.centroids is not None:
+                cluster = int(_nearest_centroids(vectors[i:i + 1], self.centroids)[0])
+                if cluster != self.assignment[row]:
+                    old = self.assignment[row]
+                    self.lists[old] = self.lists[old][self.lists[old] != row]
+                    self.lists[cluster] = np.append(self.lists[cluster], row)
+                    self.assignment[row] = cluster
+        new = ~existing
+        if new.any():
+            first = len(self.ids)
+            self.ids = np.concatenate([self.ids, ids[new]])
+            self.start_ts = np.concatenate([self.start_ts, start_ts[new]])
+            self.raw = np.concatenate([self.raw, raw[new]])
+            self.vectors = np.concatenate([self.vectors, vectors[new]])
+            self.norms = np.concatenate([self.norms, (vectors[new] * vectors[new]).sum(axis=1)])
+            self.alive = np.concatenate([self.alive, np.ones(int(new.sum()), dtype=bool)])
+            for row, activity_id in enumerate(ids[new], start=first):
+                self.rows[int(activity_id)] = row
+            if self.centroids is not None:
+                clusters = _nearest_centroids(vectors[new], self.centroids)
+                self.assignment = np.concatenate([self.assignment, clusters])
+                for cluster in np.unique(clusters):
+                    rows = first + np.flatnonzero(clusters == cluster)
+                    self.lists[cluster] = np.concatenate([self.lists[cluster], rows])
+        if len(self) >= 2 * self.fitted_rows:
+            self._fit()
+
+    def remove(self, activity_ids: Iterable[int]) -> None:
+        """Mark activities as deleted."""
+        for activity_id in activity_ids:
+            row = self.rows.pop(int(activity_id), None)
+            if row is not None:
+                self.alive[row] = False
+        if len(self) * 2 < len(self.ids):
+            self._fit()
+
+    def search(self, row: int, k: int, exact: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Find the k rows nearest to a row, excluding the row itself.
+
+        Args:
+            row: Row of the activity to compare against
+            k: Number of neighbours
+            exact: Scan every row even if the type has an inverted-file index
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: Rows of the neighbours, nearest first, and
+            their distances
+        """
+        present = ~np.isnan(self.raw[row])
+        query = self.vectors[row] * present
+        if self.centroids is not None and not exact:
+            centroid_distances = ((self.centroids - query) ** 2 * present).sum(axis=1)
+            probes = np.argpartition(
+                centroid_distances, min(config.SIMILARITY_ANN_PROBES, len(self.centroids)) - 1
+            )[:config.SIMILARITY_ANN_PROBES]
+            candidates = np.concatenate([self.lists[probe] for probe in probes])
+            candidates = candidates[self.alive[candidates] & (candidates != row)]
+            vectors = self.vectors[candidates]
+            norms = self.norms[candidates] if present.all() else (vectors * vectors * present).sum(axis=1)
+            distances = norms - 2 * (vectors @ query)
+        else:
+            candidates = None
+            distances = self.vectors @ query
+            distances *= -2
+            distances += self.norms if present.all() else (self.vectors * self.vectors * present).sum(axis=1)
+            if len(self) < len(self.ids):
+                distances[~self.alive] = np.inf
+            distances[row] = np.inf
+        k = min(k, int(np.isfinite(distances).sum()))
+        if k <= 0:
+            return np.array([], dtype=np.int64), np.array([], dtype=np.float32)
+        nearest = np.argpartition(distances, k - 1)[:k]
+        nearest = nearest[np.argsort(distances[nearest], kind='stable')]
+        # Adding |q|² back and clamping rounding below zero gives the true distance.
+        found = np.sqrt(np.maximum(distances[nearest] + query @ query, 0))
+        return (nearest if candidates is None else candidates[nearest]), found
+
+
+def _effort(index: _TypeIndex, row: int, distance: Optional[float] = None) -> Dict[str, Any]:
+    """Describe an indexed activity for the prompt; missing features are None."""
+    effort: Dict[str, Any] = {
+        'id': int(index.ids[row]),
+        'date': datetime.fromtimestamp(int(index.start_ts[row]), tz=timezone.utc).date().isoformat(),
+    }
+    for column, field in enumerate(EFFORT_FIELDS):
+        value = float(index.raw[row, column])
+        effort[field] = None if np.isnan(value) else round(value, 2)
+    if distance is not None:
+        effort['similarity_distance'] = round(float(distance), 3)
+    return effort
+
+
+def effort_trend(latest: Dict[str, Any], similar: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Summarize how an activity's comparable efforts have been changing.
+
+    Args:
+        latest: The activity compared against, as described by `similar_efforts`
+        similar: Its similar past efforts
+
+    Returns:
+        Dict[str, Any]: Number of efforts and the days they span; per 30 days, the
+        linear trend of pace and average heart rate across the efforts and the
+        latest activity (with at least three values); and the latest activity's
+        pace and heart rate relative to the mean of the similar efforts
+    """
+    efforts = similar + [latest]
+    days = np.array([
+        datetime.fromisoformat(effort['date']).toordinal() for effort in efforts
+    ], dtype=np.float64)
+    trend: Dict[str, Any] = {'efforts': len(similar), 'span_days': int(days.max() - days.min())}
+    for field, name in (('pace_min_per_km', 'pace'), ('average_heartrate', 'heartrate')):
+        values = np.array([np.nan if e[field] is None else e[field] for e in efforts], dtype=np.float64)
+        valid = ~np.isnan(values)
+        if valid.sum() >= 3 and np.ptp(days[valid]) > 0:
+            slope = np.polyfit(days[valid], values[valid], 1)[0]
+            trend[f'{name}_change_per_30d'] = round(float(slope * 30), 3)
+        if latest[field] is not None and valid[:-1].any():
+            trend[f'{name}_vs_similar'] = round(float(latest[field] - values[:-1][valid[:-1]].mean()), 3)
+    return trend
+
+
+class SimilarityIndex:
+    """
+    In-memory nearest-neighbour index over an athlete's stored activities.
+    """
+
+    def __init__(self, db_path: str, athlete_id: int = 0) -> None:
+        """Initialize an empty index over the activity store at `db_path`."""
+        self.store = ActivityStore(db_path)
+        self.athlete_id = athlete_id
+        self._types: Dict[str, _TypeIndex] = {}
+        self._version: Optional[int] = None
+        self._lock = threading.RLock()
+        self.initialize()
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.store.db_path, timeout=30)
+
+    def initialize(self) -> None:
+        """Create the similarity_version and similarity_changes tables if they don't exist."""
+        with closing(self._connect()) as conn, conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS similarity_version (
+                    athlete_id INTEGER PRIMARY KEY,
+                    version INTEGER NOT NULL
+                )
+            """)
+            # A NULL activity_id means every activity may have changed.
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS similarity_changes (
+                    athlete_id INTEGER NOT NULL,
+                    version INTEGER NOT NULL,
+                    activity_id INTEGER
+                )
+            """)
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_similarity_changes_version "
+                "ON similarity_changes (athlete_id, version)"
+            )
+
+    def _read_version(self, conn: sqlite3.Connection) -> int:
+        row = conn.execute(
+            "SELECT version FROM similarity_version WHERE athlete_id = ?", (self.athlete_id,)
+        ).fetchone()
+        return row[0] if row else 0
+
+    def _check_version(self) -> None:
+        """Catch up with the changes other processes made to the store since the loaded rows were read."""
+        with closing(self._connect()) as conn:
+            version = self._read_version(conn)
+            if version == self._version:
+                return
+            if self._version is None or not self._types:
+                self._version = version
+                return
+            oldest, changes = conn.execute(
+                """
+                SELECT MIN(version), COUNT(*) FROM similarity_changes
+                WHERE athlete_id = ? AND version > ?
+                """,
+                (self.athlete_id, self._version)
+            ).fetchone()
+            changed = [row[0] for row in conn.execute(
+                """
+                SELECT DISTINCT activity_id FROM similarity_changes
+                WHERE athlete_id = ? AND version > ? AND version <= ?
+                """,
+                (self.athlete_id, self._version, version)
+            )]
+        if not changes or oldest > self._version + 1 or None in changed:
+            self._types.clear()
+        else:
+            columns = self.store.load_columns_for(changed, {**FEATURE_COLUMNS, 'type': object})
+            self._update(changed, columns)
+        self._version = version
+
+    def _bump_version(self, activity_ids: Optional[List[int]]) -> None:
+        """
+        Increment the store's version and log the activities it changed, or None for
+        all of them, in one transaction.
+        """
+        with closing(self._connect()) as conn, conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(
+                "INSERT OR IGNORE INTO similarity_version (athlete_id, version) VALUES (?, 0)",
+                (self.athlete_id,)
+            )
+            conn.execute(
+                "UPDATE similarity_version SET version = version + 1 WHERE athlete_id = ?",
+                (self.athlete_id,)
+            )
+            version = self._read_version(conn)
+            conn.executemany(
+                "INSERT INTO similarity_changes (athlete_id, version, activity_id) VALUES (?, ?, ?)",
+                [(self.athlete_id, version, activity_id) for activity_id in (activity_ids or [None])]
+            )
+            conn.execute(
+                "DELETE FROM similarity_changes WHERE athlete_id = ? AND version <= ?",
+                (self.athlete_id, version - CHANGE_LOG_VERSIONS)
+            )
+        # Otherwise another process changed the store in between; the next check
+        # catches up with both changes.
+        if self._version == version - 1:
+            self._version = version
+
+    def _update(self, activity_ids: List[int], columns: Dict[str, np.ndarray]) -> None:
+        """
+        Move changed activities to the loaded type they now belong to.
+
+        Args:
+            activity_ids: Strava ids of the changed activities
+            columns: `FEATURE_COLUMNS` and `type` of those still stored
+        """
+        for activity_type, index in self._types.items():
+            mine = columns['type'] == activity_type
+            # Deleted activities and those whose type was edited leave the type.
+            index.remove(set(activity_ids) - set(columns['id'][mine].tolist()))
+            if mine.any():
+                selected = {field: values[mine] for field, values in columns.items()}
+                index.upsert(selected['id'], selected['start_ts'], feature_matrix(selected))
+
+    def _type(self, activity_type: str) -> _TypeIndex:
+        """Return the loaded rows of an activity type, loading them from the store if needed."""
+        index = self._types.get(activity_type)
+        if index is None:
+            columns = self.store.load_columns(activity_type, FEATURE_COLUMNS)
+            index = _TypeIndex(columns['id'], columns['start_ts'], feature_matrix(columns))
+            self._types[activity_type] = index
+        return index
+
+    def apply(self, records: Iterable[Dict[str, Any]]) -> None:
+        """
+        Add or update stored activities in the loaded types.
+
+        Args:
+            records: Activity store records that were just written to the store
+        """
+        records = list(records)
+        if not records:
+            return
+        columns = _record_columns(records)
+        columns['type'] = np.array([record.get('type') or '' for record in records], dtype=object)
+        activity_ids = columns['id'].tolist()
+        with self._lock:
+            self._check_version()
+            self._update(activity_ids, columns)
+            self._bump_version(activity_ids)
+
+    def remove(self, activity_ids: Iterable[int]) -> None:
+        """Remove deleted activities from the loaded types."""
+        activity_ids = list(activity_ids)
+        if not activity_ids:
+            return
+        with self._lock:
+            self._check_version()
+            for index in self._types.values():
+                index.remove(activity_ids)
+            self._bump_version([int(activity_id) for activity_id in activity_ids])
+
+    def invalidate(self) -> None:
+        """Reload every type on next use, e.g. after activities were written in bulk."""
+        with self._lock:
+            self._types.clear()
+            self._bump_version(None)
+
+    def nearest(
+        self,
+        activity_id: int,
+        activity_type: str,
+        k: int = config.SIMILAR_ACTIVITIES_K,
+        exact: bool = False
+    ) -> List[Tuple[int, float]]:
+        """
+        Find the stored activities of a type most similar to one of them.
+
+        Args:
+            activity_id: Strava id of the activity to compare against
+            activity_type: Its activity type, e.g. 'Run'
+            k: Number of neighbours
+            exact: Scan every activity even if the type has an approximate index
+
+        Returns:
+            List[Tuple[int, float]]: Activity ids and feature-space distances, nearest
+            first; empty if the activity is not stored under `activity_type`
+        """
+        with self._lock:
+            self._check_version()
+            index = self._type(activity_type)
+            row = index.rows.get(int(activity_id))
+            if row is None:
+                return []
+            rows, distances = index.search(row, k, exact)
+            return [(int(index.ids[r]), float(d)) for r, d in zip(rows, distances)]
+
+    def similar_efforts(
+        self,
+        activity_id: int,
+        activity_type: str,
+        k: int = config.SIMILAR_ACTIVITIES_K
+    ) -> Dict[str, Any]:
+        """
+        Describe an activity's most similar past efforts and the trend across them.
+
+        Args:
+            activity_id: Strava id of the activity to compare against
+            activity_type: Its activity type, e.g. 'Run'
+            k: Number of similar efforts
+
+        Returns:
+            Dict[str, Any]: `similar` (features of each effort, most similar first) and
+            `trend` (see `effort_trend`); empty if the activity is not indexed or has
+            no comparable efforts
+        """
+        with self._lock:
+            self._check_version()
+            index = self._type(activity_type)
+            row = index.rows.get(int(activity_id))
+            if row is None:
+                return {}
+            rows, distances = index.search(row, k)
+            if not len(rows):
+                return {}
+            similar = [_effort(index, r, d) for r, d in zip(rows, distances)]
+            latest = _effort(index, row)
+        return {'similar': similar, 'trend': effort_trend(latest, similar)}
+
+
+_indexes: Dict[Tuple[str, int], SimilarityIndex] = {}
+_indexes_lock = threading.Lock()
+
+
+def similarity_index(db_path: str, athlete_id: int = 0) -> SimilarityIndex:
+    """
+    Return the process-wide index of an activity store, so loaded rows are shared
+    between jobs and kept up to date by their syncs.
+    """
+    with _indexes_lock:
+        index = _indexes.get((db_path, athlete_id))
+        if index is None:
+            index = _indexes[(db_path, athlete_id)] = SimilarityIndex(db_path, athlete_id)
+        return index
@@ -0,0 +1,247 @@
+"""
+Rate-limit-aware scheduling of Strava API requests.
+
+Strava enforces a 15-minute and a daily request quota per application and
+reports current usage in the `X-RateLimit-*` / `X-ReadRateLimit-*` response
+headers. Every Strava client built by `app.auth.create_client` sends its
+requests through one process-wide `StravaScheduler`. The scheduler keeps a token bucket
+per quota window: each request takes a token before it is sent, the bucket is
+corrected from the usage headers of every response, and it refills when the
+window resets.
+
+Requests carry a priority, set for the current context with
+`strava_scheduler.priority(...)`. Lower priorities keep a reserve of the budget
+free for higher ones, so webhook-triggered fetches still go through when manual
+or backfill work has used up its share. A request that would have to wait past
+its deadline raises `StravaBudgetExhausted`. Callers can then defer the work or
+degrade it, for example by using stored data.
+
+The module imports no HTTP or Strava client libraries, so the webhook endpoint
+can report and check the budget without loading them.
+"""
+
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from enum import IntEnum
+from typing import Any, Dict, Iterator, Mapping, Optional
+
+import config
+
+
+class Priority(IntEnum):
+    """Priority of a Strava request; lower values are served first."""
+
+    WEBHOOK = 0
+    MANUAL = 1
+    BACKFILL = 2
+
+
+class StravaBudgetExhausted(RuntimeError):
+    """Raised when a request cannot be sent within its wait deadline."""
+
+    def __init__(self, priority: Priority, retry_after: float) -> None:
+        super().__init__(
+            f'Strava rate-limit budget exhausted for {priority.name.lower()} requests; '
+            f'retry in {retry_after:.0f}s'
+        )
+        self.priority = priority
+        self.retry_after = retry_after
+
+
+_current_priority: contextvars.ContextVar[Priority] = contextvars.ContextVar(
+    'strava_priority', default=Priority.MANUAL
+)
+
+
+class _Bucket:
+    """Token bucket for one fixed quota window, refilled when the window resets."""
+
+    def __init__(self, name: str, limit: int) -> None:
+        self.name = name
+        self.limit = limit
+        self.used = 0
+        self.window: Optional[int] = None
+
+    def window_id(self, now: float) -> int:
+        if self.name == 'short':
+            return int(now // 900)
+        return int(now // 86400)
+
+    def seconds_until_reset(self, now: float) -> float:
+        if self.name == 'short':
+            return 900 - now % 900
+        midnight = datetime.fromtimestamp(now, tz=timezone.utc).replace(
+            hour=0, minute=0, second=0, microsecond=0
+        ) + timedelta(days=1)
+        return midnight.timestamp() - now
+
+    def refresh(self, now: float) -> None:
+        window = self.window_id(now)
+        if window != self.window:
+            self.window = window
+            self.used = 0
+
+    @property
+    def remaining(self) -> int:
+        return max(self.limit - self.used, 0)
+
+
+class StravaScheduler:
+    """
+    Shared Strava quota budget with prioritized, deadline-bounded admission.
+    """
+
+    def __init__(
+        self,
+        short_limit: int = config.STRAVA_SHORT_LIMIT,
+        long_limit: int = config.STRAVA_LONG_LIMIT,
+        reserves: Optional[Mapping[Priority, float]] = None,
+        max_wait_seconds: Optional[Mapping[Priority, float]] = None,
+        low_budget_fraction: float = config.STRAVA_LOW_BUDGET_FRACTION,
+        clock=time.time
+    ) -> None:
+        """
+        Initialize the scheduler with the default Strava quotas.
+
+        Args:
+            short_limit: Requests per 15-minute window until headers report otherwise
+            long_limit: Requests per day until headers report otherwise
+            reserves: Fraction of each window kept free from lower priorities
+            max_wait_seconds: How long a request of each priority may wait for budget
+            low_budget_fraction: Remaining fraction under which optional work is skipped
+            clock: Time source, for testing
+        """
+        self.buckets = {'short': _Bucket('short', short_limit), 'long': _Bucket('long', long_limit)}
+        self.reserves = dict(reserves or {
+            Priority(int(p)): fraction for p, fraction in config.STRAVA_PRIORITY_RESERVES.items()
+        })
+        self.max_wait_seconds = dict(max_wait_seconds or {
+            Priority(int(p)): seconds for p, seconds in config.STRAVA_MAX_WAIT_SECONDS.items()
+        })
+        self.low_budget_fraction = low_budget_fraction
+        self.clock = clock
+        self._condition = threading.Condition()
+        self._waiting: Dict[Priority, int] = {priority: 0 for priority in Priority}
+        self._sent: Dict[Priority, int] = {priority: 0 for priority in Priority}
+        self._rejected: Dict[Priority, int] = {priority: 0 for priority in Priority}
+
+    @contextmanager
+    def priority(self, priority: Priority) -> Iterator[None]:
+        """Send the Strava requests made in this context with the given priority."""
+        token = _current_priority.set(priority)
+        try:
+            yield
+        finally:
+            _current_priority.reset(token)
+
+    @staticmethod
+    def current_priority() -> Priority:
+        """Return the priority requests in the current context are sent with."""
+        return _current_priority.get()
+
+    def _wait_time(self, priority: Priority, now: float) -> float:
+        """Seconds until a request of `priority` may be sent; 0 if it may go now."""
+        wait = 0.0
+        for bucket in self.buckets.values():
+            bucket.refresh(now)
+            reserve = int(bucket.limit * self.reserves.get(priority, 0.0))
+            if bucket.remaining <= reserve:
+                wait = max(wait, bucket.seconds_until_reset(now))
+        if wait == 0.0 and any(self._waiting[p] for p in Priority if p < priority):
+            # Let queued higher-priority requests take the next tokens first.
+            wait = 0.05
+        return wait
+
+    def acquire(self, priority: Optional[Priority] = None) -> None:
+        """
+        Take one request from the budget, waiting if the budget is exhausted.
+
+        Args:
+            priority: Request priority (default: the context's priority)
+
+        Raises:
+            StravaBudgetExhausted: If the budget does not free up within the
+                priority's maximum wait
+        """
+        priority = self.current_priority() if priority is None else priority
+        deadline = self.clock() + self.max_wait_seconds.get(priority, 0.0)
+        with self._condition:
+            self._waiting[priority] += 1
+            try:
+                while True:
+                    now = self.clock()
+                    wait = self._wait_time(priority, now)
+                    if wait == 0.0:
+                        break
+                    if now + wait > deadline:
+                        self._rejected[priority] += 1
+                        raise StravaBudgetExhausted(priority, wait)
+                    self._condition.wait(min(wait, deadline - now))
+            finally:
+                self._waiting[priority] -= 1
+            for bucket in self.buckets.values():
+                bucket.used += 1
+            self._sent[priority] += 1
+
+    def record(self, response_headers: Mapping[str, str], method: str = 'GET') -> None:
+        """
+        Correct the budget from the rate-limit headers of a Strava response.
+
+        Matches stravalib's rate limiter interface, so it can be passed to
+        `Client(rate_limiter=...)`.
+        """
+        from stravalib.util.limiter import get_rates_from_response_headers
+
+        rates = get_rates_from_response_headers(response_headers, method)
+        if rates is None:
+            return
+        with self._condition:
+            now = self.clock()
+            for name, usage, limit in (
+                ('short', rates.short_usage, rates.short_limit),
+                ('long', rates.long_usage, rates.long_limit),
+            ):
+                bucket = self.buckets[name]
+                bucket.refresh(now)
+                bucket.limit = limit
+                bucket.used = usage
+            self._condition.notify_all()
+
+    def is_low(self) -> bool:
+        """Check whether either window is below the low-budget fraction."""
+        with self._condition:
+            now = self.clock()
+            for bucket in self.buckets.values():
+                bucket.refresh(now)
+                if bucket.remaining < bucket.limit * self.low_budget_fraction:
+                    return True
+        return False
+
+    def status(self) -> Dict[str, Any]:
+        """Report usage, remaining budget and admission counters."""
+        with self._condition:
+            now = self.clock()
+            windows = {}
+            for name, bucket in self.buckets.items():
+                bucket.refresh(now)
+                windows[name] = {
+                    'limit': bucket.limit,
+                    'used': bucket.used,
+                    'remaining': bucket.remaining,
+                    'resets_in_seconds': round(bucket.seconds_until_reset(now)),
+                }
+            return {
+                'windows': windows,
+                'low': any(
+                    w['remaining'] < w['limit'] * self.low_budget_fraction for w in windows.values()
+                ),
+                'waiting': {p.name.lower(): n for p, n in self._waiting.items()},
+                'sent': {p.name.lower(): n for p, n in self._sent.items()},
+                'rejected': {p.name.lower(): n for p, n in self._rejected.items()},
+            }
+
+
+strava_scheduler = StravaScheduler()
@@ -0,0 +1,303 @@
+"""
+Incremental training-load analytics for run activities.
+
+Each run is converted to a training load (Strava's suffer score, a heart-rate
+TRIMP, or a pace-based estimate) and folded into exponentially weighted acute
+and chronic loads. Exponential averages are linear in their inputs, so an
+activity can be added, edited or removed in O(1) by adjusting the persisted
+accumulators, whatever its position in the history:
+
+    load(t) = sum_i  L_i * (1 - exp(-1 / tau)) * exp(-(t - t_i) / tau)
+
+From these the tracker reports acute training load (ATL, 7-day), chronic
+training load (CTL, 42-day), training stress balance (TSB = CTL - ATL) and the
+acute:chronic workload ratio (7-day over 28-day EWMA), plus recent mileage.
+"""
+
+import math
+import sqlite3
+import time
+from contextlib import closing
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, Optional
+
+import config
+
+DAY_SECONDS = 86400
+# Time constants, in days, of the exponentially weighted loads.
+TIME_CONSTANTS = {'atl': 7.0, 'ctl': 42.0, 'chronic_load': 28.0}
+
+
+def activity_load(record: Dict[str, Any]) -> Optional[float]:
+    """
+    Estimate the training load of one stored activity record.
+
+    Uses the first available of: Strava suffer score; Banister TRIMP from average
+    heart rate; or a pace-based load relative to the configured threshold pace.
+
+    Args:
+        record: Activity store record (distance in m, moving time in s)
+
+    Returns:
+        Optional[float]: Training load, or None if the record has no usable inputs
+    """
+    if record.get('suffer_score'):
+        return float(record['suffer_score'])
+
+    moving_time = record.get('moving_time') or 0
+    duration_min = moving_time / 60
+    if not duration_min:
+        return None
+
+    heartrate = record.get('average_heartrate')
+    if heartrate:
+        reserve = (heartrate - config.ATHLETE_REST_HEARTRATE) / (
+            config.ATHLETE_MAX_HEARTRATE - config.ATHLETE_REST_HEARTRATE
+        )
+        reserve = min(max(reserve, 0.0), 1.0)
+        return duration_min * reserve * 0.64 * math.exp(1.92 * reserve)
+
+    distance_km = (record.get('distance') or 0) / 1000
+    if not distance_km:
+        return None
+    intensity = config.THRESHOLD_PACE_MIN_PER_KM / (duration_min / distance_km)
+    return duration_min / 60 * intensity ** 2 * 100
+
+
+def start_timestamp(record: Dict[str, Any]) -> float:
+    """Return an activity record's start as an epoch timestamp."""
+    value = record.get('start_ts')
+    if value is not None:
+        return float(value)
+    start_date = record['start_date']
+    if isinstance(start_date, str):
+        start_date = datetime.fromisoformat(start_date.replace('Z', '+00:00'))
+    if start_date.tzinfo is None:
+        start_date = start_date.replace(tzinfo=timezone.utc)
+    return start_date.timestamp()
+
+
+def advice_time(latest_start: Optional[float], now: Optional[float] = None) -> float:
+    """
+    Time to evaluate the loads at for advice: the start of the current UTC day, or
+    the latest activity's start if that is later.
+
+    The loads decay continuously, so evaluated at the current time they would change
+    the prompt, and miss the advice cache, within minutes while the data is
+    unchanged. Evaluated here they only change with the data or the date.
+
+    Args:
+        latest_start: Epoch start time of the latest stored activity, if any
+        now: Current epoch time (default: current time)
+
+    Returns:
+        float: Epoch time to pass to `TrainingLoadTracker.metrics`
+    """
+    now = time.time() if now is None else now
+    day_start = now - now % DAY_SECONDS
+    return day_start if latest_start is None else max(day_start, latest_start)
+
+
+class TrainingLoadTracker:
+    """
+    Persisted exponentially weighted training-load accumulators per athlete.
+    """
+
+    def __init__(self, db_path: str, athlete_id: int = 0) -> None:
+        """Initialize the tracker for one athlete and create its tables if needed."""
+        self.db_path = db_path
+        self.athlete_id = athlete_id
+        self.initialize()
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    def initialize(self) -> None:
+        """Create the training_load_state and training_load_contributions tables."""
+        with closing(self._connect()) as conn, conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS training_load_state (
+                    athlete_id INTEGER PRIMARY KEY,
+                    ref_ts REAL NOT NULL,
+                    atl REAL NOT NULL,
+                    ctl REAL NOT NULL,
+                    chronic_load REAL NOT NULL
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS training_load_contributions (
+                    athlete_id INTEGER NOT NULL,
+                    activity_id INTEGER NOT NULL,
+                    start_ts REAL NOT NULL,
+                    load REAL NOT NULL,
+                    distance_km REAL NOT NULL,
+                    PRIMARY KEY (athlete_id, activity_id)
+                )
+            """)
+            conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_training_load_contributions_start
+                ON training_load_contributions (athlete_id, start_ts)
+            """)
+
+    def has_state(self) -> bool:
+        """Check whether any activity has been applied for this athlete."""
+        with closing(self._connect()) as conn:
+            row = conn.execute(
+                "SELECT 1 FROM training_load_state WHERE athlete_id = ?", (self.athlete_id,)
+            ).fetchone()
+        return row is not None
+
+    def _load_state(self, conn: sqlite3.Connection) -> Dict[str, float]:
+        row = conn.execute(
+            "SELECT ref_ts, atl, ctl, chronic_load FROM training_load_state WHERE athlete_id = ?",
+            (self.athlete_id,)
+        ).fetchone()
+        if row is None:
+            return {'ref_ts': 0.0, 'atl': 0.0, 'ctl': 0.0, 'chronic_load': 0.0}
+        return dict(zip(('ref_ts', 'atl', 'ctl', 'chronic_load'), row))
+
+    @staticmethod
+    def _add_impulse(state: Dict[str, float], start_ts: float, load: float) -> None:
+        """Add (or, with a negative load, remove) one activity's load in O(1)."""
+        if start_ts > state['ref_ts']:
+            elapsed_days = (start_ts - state['ref_ts']) / DAY_SECONDS
+            for name, tau in TIME_CONSTANTS.items():
+                state[name] *= math.exp(-elapsed_days / tau)
+            state['ref_ts'] = start_ts
+        age_days = (state['ref_ts'] - start_ts) / DAY_SECONDS
+        for name, tau in TIME_CONSTANTS.items():
+            state[name] += load * (1 - math.exp(-1 / tau)) * math.exp(-age_days / tau)
+
+    def apply(self, records: Iterable[Dict[str, Any]]) -> int:
+        """
+        Add new or edited run activities to the training load.
+
+        Records already applied with the same load and start time are skipped; edited
+        ones replace their previous contribution and non-run records are removed.
+
+        Args:
+            records: Activity store records
+
+        Returns:
+            int: Number of contributions added, changed or removed
+        """
+        changed = 0
+        with closing(self._connect()) as conn, conn:
+            state = self._load_state(conn)
+            for record in records:
+                activity_id = int(record['id'])
+                previous = conn.execute(
+                    """
+                    SELECT start_ts, load FROM training_load_contributions
+                    WHERE athlete_id = ? AND activity_id = ?
+                    """,
+                    (self.athlete_id, activity_id)
+                ).fetchone()
+                load = activity_load(record) if record.get('type') == 'Run' else None
+                start_ts = start_timestamp(record)
+                if previous is not None and load is not None and previous == (start_ts, load):
+                    continue
+                if previous is not None:
+                    self._add_impulse(state, previous[0], -previous[1])
+                if load is None:
+                    if previous is not None:
+                        conn.execute(
+                            "DELETE FROM training_load_contributions WHERE athlete_id = ? AND activity_id = ?",
+                            (self.athlete_id, activity_id)
+                        )
+                        changed += 1
+                    continue
+                self._add_impulse(state, start_ts, load)
+                conn.execute(
+                    """
+                    INSERT OR REPLACE INTO training_load_contributions
+                        (athlete_id, activity_id, start_ts, load, distance_km)
+                    VALUES (?, ?, ?, ?, ?)
+                    """,
+                    (self.athlete_id, activity_id, start_ts, load, (record.get('distance') or 0) / 1000)
+                )
+                changed += 1
+            self._save_state(conn, state)
+        return changed
+
+    def remove(self, activity_ids: Iterable[int]) -> int:
+        """
+        Remove deleted activities from the training load.
+
+        Args:
+            activity_ids: Ids of deleted activities
+
+        Returns:
+            int: Number of contributions removed
+        """
+        removed = 0
+        with closing(self._connect()) as conn, conn:
+            state = self._load_state(conn)
+            for activity_id in activity_ids:
+                previous = conn.execute(
+                    """
+                    SELECT start_ts, load FROM training_load_contributions
+                    WHERE athlete_id = ? AND activity_id = ?
+                    """,
+                    (self.athlete_id, int(activity_id))
+                ).fetchone()
+                if previous is None:
+                    continue
+                self._add_impulse(state, previous[0], -previous[1])
+                conn.execute(
+                    "DELETE FROM training_load_contributions WHERE athlete_id = ? AND activity_id = ?",
+                    (self.athlete_id, int(activity_id))
+                )
+                removed += 1
+            self._save_state(conn, state)
+        return removed
+
+    def _save_state(self, conn: sqlite3.Connection, state: Dict[str, float]) -> None:
+        conn.execute(
+            """
+            INSERT OR REPLACE INTO training_load_state (athlete_id, ref_ts, atl, ctl, chronic_load)
+            VALUES (?, ?, ?, ?, ?)
+            """,
+            (self.athlete_id, state['ref_ts'], state['atl'], state['ctl'], state['chronic_load'])
+        )
+
+    def metrics(self, now: Optional[float] = None) -> Dict[str, Any]:
+        """
+        Report the current training-load metrics.
+
+        Args:
+            now: Epoch time to evaluate the loads at (default: current time)
+
+        Returns:
+            Dict[str, Any]: ATL, CTL, TSB, acute:chronic workload ratio and mileage
+        """
+        now = time.time() if now is None else now
+        with closing(self._connect()) as conn:
+            state = self._load_state(conn)
+            last_7, last_28 = conn.execute(
+                """
+                SELECT
+                    COALESCE(SUM(CASE WHEN start_ts > ? THEN distance_km END), 0.0),
+                    COALESCE(SUM(distance_km), 0.0)
+                FROM training_load_contributions
+                WHERE athlete_id = ? AND start_ts > ? AND start_ts <= ?
+                """,
+                (now - 7 * DAY_SECONDS, self.athlete_id, now - 28 * DAY_SECONDS, now)
+            ).fetchone()
+
+        elapsed_days = max(now - state['ref_ts'], 0) / DAY_SECONDS
+        loads = {
+            name: state[name] * math.exp(-elapsed_days / tau)
+            for name, tau in TIME_CONSTANTS.items()
+        }
+        return {
+            'as_of': datetime.fromtimestamp(now, tz=timezone.utc).isoformat(),
+            'acute_training_load': round(loads['atl'], 1),
+            'chronic_training_load': round(loads['ctl'], 1),
+            'training_stress_balance': round(loads['ctl'] - loads['atl'], 1),
+            'acute_chronic_workload_ratio': (
+                round(loads['atl'] / loads['chronic_load'], 2) if loads['chronic_load'] else None
+            ),
+            'weekly_distance_km': round(last_7, 1),
+            'avg_weekly_distance_km_28d': round(last_28 / 4, 1),
+        }
@@ -0,0 +1,85 @@
+"""
+Coalescing of Strava webhook events into per-athlete bursts.
+
+Strava typically sends a `create` event followed by a few `update` events
+(rename, type change, privacy) within seconds, and a device sync uploads
+several activities at once. Instead of one job per event, each athlete has at
+most one pending burst job in the queue. New activities join it, updates and
+deletions are merged into it, and it runs once the athlete has been quiet for
+the debounce window. The burst then runs one pipeline and sends one email.
+
+A burst payload looks like:
+
+    {'athlete_id': 123, 'events': 4, 'trace_id': '3f2a...', 'activities': [
+        {'object_id': 1, 'event_time': 1700000000, 'title': 'Tempo', 'type': 'Run'},
+    ]}
+"""
+
+from typing import Any, Dict, List, Optional
+
+# Fields of an `update` event's `updates` that are carried into the burst.
+MERGED_UPDATE_FIELDS = ('title', 'type', 'private')
+
+
+def burst_activities(payload: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Return the activities of a burst payload; single-event payloads count as one."""
+    if 'activities' in payload:
+        return payload['activities']
+    return [{'object_id': payload.get('object_id'), 'event_time': payload.get('event_time')}]
+
+
+def merge_event(
+    burst: Optional[Dict[str, Any]],
+    event: Dict[str, Any],
+    athlete_id: Optional[int],
+    trace_id: Optional[str] = None
+) -> Optional[Dict[str, Any]]:
+    """
+    Merge a webhook event into an athlete's pending burst.
+
+    Args:
+        burst: Pending burst payload, or None if the athlete has none
+        event: Strava webhook payload (`object_type` 'activity')
+        athlete_id: Resolved athlete id the burst belongs to
+        trace_id: Trace id of the webhook request, recorded on a new burst
+
+    Returns:
+        Optional[Dict[str, Any]]: The updated burst; `burst` itself if the event does
+        not concern it; None if there is nothing to run (an update or delete with no
+        pending burst, or a burst left empty)
+    """
+    activity_id = int(event.get('object_id', 0))
+    aspect = event.get('aspect_type')
+    if burst is None:
+        if aspect != 'create':
+            return None
+        merged = {'athlete_id': athlete_id, 'events': 0, 'activities': []}
+        if trace_id is not None:
+            merged['trace_id'] = trace_id
+    else:
+        merged = {**burst, 'activities': [dict(a) for a in burst_activities(burst)]}
+
+    activities = merged['activities']
+    existing = next((a for a in activities if a.get('object_id') == activity_id), None)
+    if aspect == 'create' and existing is None:
+        activities.append({'object_id': activity_id, 'event_time': event.get('event_time')})
+    elif aspect == 'update' and existing is not None:
+        for field in MERGED_UPDATE_FIELDS:
+            if field in (event.get('updates') or {}):
+                existing[field] = event['updates'][field]
+    elif aspect == 'delete' and existing is not None:
+        activities.remove(existing)
+    else:
+        # Repeated creates, and edits of activities outside the burst (picked up by the sync).
+        return burst
+
+    merged['events'] = merged.get('events', 0) + 1
+    return merged if activities else None
+
+
+def burst_subject(activities: List[Dict[str, Any]]) -> str:
+    """Build the email subject for the advice on a burst of activities."""
+    if len(activities) == 1:
+        title = activities[0].get('title')
+        return f'New Workout Advice: {title}' if title else 'New Workout Advice Available!'
+    return f'New Workout Advice for {len(activities)} Activities'
@@ -0,0 +1,63 @@
+"""
+Minimal ASGI client for driving the app in-process without an HTTP server.
+
+It only uses the standard library, so the cold-start benchmark can use it
+without loading anything the app itself does not.
+"""
+
+import asyncio
+import json
+import time
+from typing import Any, Dict, Optional
+from urllib.parse import urlencode
+
+
+async def asgi_request(
+    app: Any,
+    method: str,
+    path: str,
+    query: Optional[Dict[str, Any]] = None,
+    body: Optional[Dict[str, Any]] = None
+) -> Dict[str, Any]:
+    """
+    Send one HTTP request straight into an ASGI app.
+
+    Returns:
+        Dict with `status`, `body`, `first_byte_s` (time to the first non-empty
+        body chunk) and `total_s`
+    """
+    payload = json.dumps(body).encode() if body is not None else b''
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1',
+        'method': method, 'scheme': 'http', 'path': path, 'raw_path': path.encode(),
+        'query_string': urlencode(query or {}).encode(), 'root_path': '',
+        'headers': [(b'content-type', b'application/json'), (b'host', b'bench')],
+        'server': ('bench', 80), 'client': ('127.0.0.1', 50000),
+    }
+    done = asyncio.Event()
+    sent_request = False
+
+    async def receive() -> Dict[str, Any]:
+        nonlocal sent_request
+        if not sent_request:
+            sent_request = True
+            return {'type': 'http.request', 'body': payload, 'more_body': False}
+        await done.wait()
+        return {'type': 'http.disconnect'}
+
+    result: Dict[str, Any] = {'status': None, 'body': b'', 'first_byte_s': None}
+    start = time.perf_counter()
+
+    async def send(message: Dict[str, Any]) -> None:
+        if message['type'] == 'http.response.start':
+            result['status'] = message['status']
+        elif message['type'] == 'http.response.body':
+            if message.get('body') and result['first_byte_s'] is None:
+                result['first_byte_s'] = time.perf_counter() - start
+            result['body'] += message.get('body', b'')
+            if not message.get('more_body'):
+                done.set()
+
+    await app(scope, receive, send)
+    result['total_s'] = time.perf_counter() - start
+    return result
@@ -0,0 +1,67 @@
+"""
+Compare two benchmark result files written by `benchmarks.run`.
+
+Every numeric metric present in both runs is printed with its relative change.
+Latency, duration and memory metrics are worse when they grow; changes beyond
+the threshold are flagged.
+
+Usage:
+    python -m benchmarks.compare benchmarks/results/old.json benchmarks/results/new.json
+"""
+
+import argparse
+import json
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+
+def flatten(data: Dict[str, Any], prefix: str = '') -> Iterator[Tuple[str, float]]:
+    """Yield (dotted.path, value) for every numeric leaf of a result tree."""
+    for key, value in data.items():
+        path = f'{prefix}.{key}' if prefix else key
+        if isinstance(value, dict):
+            yield from flatten(value, path)
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            yield path, float(value)
+
+
+def compare(old: Dict[str, Any], new: Dict[str, Any], threshold: float) -> List[str]:
+    """
+    Build report lines for the metrics two result files have in common.
+
+    Args:
+        old: Baseline report
+        new: Candidate report
+        threshold: Relative change (e.g. 0.1 for 10%) above which a metric is flagged
+
+    Returns:
+        List[str]: One formatted line per metric
+    """
+    baseline = dict(flatten(old['results']))
+    lines = [f"{'metric':<60} {'old':>12} {'new':>12} {'change':>9}"]
+    for path, value in flatten(new['results']):
+        if path not in baseline:
+            continue
+        before = baseline[path]
+        change = (value - before) / before if before else 0.0
+        flag = ''
+        if abs(change) > threshold and path.rsplit('.', 1)[-1].endswith(('_ms', '_s', '_mb')):
+            flag = '  worse' if change > 0 else '  better'
+        lines.append(f'{path:<60} {before:>12.3f} {value:>12.3f} {change:>+8.1%}{flag}')
+    return lines
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('old', type=Path, help='Baseline result file')
+    parser.add_argument('new', type=Path, help='Candidate result file')
+    parser.add_argument('--threshold', type=float, default=0.1, help='Relative change to flag (default 0.1)')
+    args = parser.parse_args(argv)
+
+    old, new = (json.loads(path.read_text()) for path in (args.old, args.new))
+    print(f"{old.get('commit')} -> {new.get('commit')}")
+    print('\n'.join(compare(old, new, args.threshold)))
+
+
+if __name__ == '__main__':
+    main()
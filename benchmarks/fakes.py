@@ -0,0 +1,355 @@
+"""
+Local stand-ins for the external services the app talks to.
+
+- `SyntheticHistory` / `FakeStravaAdapter`: a Strava API served from memory
+  through a `requests` transport adapter, with deterministic synthetic
+  activity histories per athlete and rate-limit headers on every response.
+- `fake_llm_app`: an OpenAI-compatible chat completions endpoint with a
+  configurable time-to-first-token and tokens per second.
+- `SMTPSink`: a minimal asyncio SMTP server that records delivered messages.
+"""
+
+import asyncio
+import bisect
+import json
+import math
+import random
+import socket
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Set, Tuple
+from urllib.parse import parse_qs, urlparse
+
+import requests
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from requests.adapters import BaseAdapter
+
+SPORTS = [('Run', 0.6), ('Ride', 0.25), ('Walk', 0.1), ('Hike', 0.05)]
+
+
+class SyntheticHistory:
+    """
+    Deterministic activity history of one athlete, newest activity `now`.
+    """
+
+    def __init__(self, athlete_id: int, size: int, seed: int = 0) -> None:
+        """Generate `size` activities spread over ~one activity per day."""
+        self.athlete_id = athlete_id
+        rng = random.Random(seed + athlete_id)
+        now = datetime.now(timezone.utc).replace(microsecond=0)
+        self.activities: List[Dict[str, Any]] = []
+        start = now
+        for n in range(size):
+            self.activities.append(self._activity(rng, athlete_id * 10_000_000 + n, start))
+            start -= timedelta(hours=rng.uniform(6, 42))
+        self.activities.reverse()  # oldest first
+        self._epochs: List[int] = []
+        self._rng = rng
+
+    @staticmethod
+    def _activity(rng: random.Random, activity_id: int, start: datetime) -> Dict[str, Any]:
+        sport = rng.choices([s for s, _ in SPORTS], [w for _, w in SPORTS])[0]
+        speed = {'Run': 3.0, 'Ride': 7.5, 'Walk': 1.4, 'Hike': 1.1}[sport] * rng.uniform(0.8, 1.2)
+        moving_time = int(rng.uniform(1200, 5400))
+        heartrate = rng.uniform(120, 170) if rng.random() < 0.8 else None
+        return {
+            'resource_state': 2,
+            'athlete': {'id': 0, 'resource_state': 1},
+            'id': activity_id,
+            'name': f'{sport} {activity_id}',
+            'type': sport,
+            'sport_type': sport,
+            'distance': round(speed * moving_time, 1),
+            'moving_time': moving_time,
+            'elapsed_time': moving_time + int(rng.uniform(0, 600)),
+            'total_elevation_gain': round(rng.uniform(0, 300), 1),
+            'start_date': start.strftime('%Y-%m-%dT%H:%M:%SZ'),
+            'start_date_local': start.strftime('%Y-%m-%dT%H:%M:%SZ'),
+            'timezone': '(GMT+00:00) UTC',
+            'average_speed': round(speed, 3),
+            'max_speed': round(speed * 1.4, 3),
+            'average_cadence': round(rng.uniform(75, 90), 1) if sport == 'Run' else None,
+            'has_heartrate': heartrate is not None,
+            'average_heartrate': round(heartrate, 1) if heartrate else None,
+            'max_heartrate': int(heartrate + 20) if heartrate else None,
+            'suffer_score': None,
+            'kudos_count': rng.randint(0, 20),
+            'kilojoules': round(moving_time * 0.2, 1) if sport == 'Ride' else None,
+        }
+
+    def add_activity(self) -> int:
+        """Append a new activity starting now and return its id."""
+        activity_id = self.activities[-1]['id'] + 1 if self.activities else self.athlete_id * 10_000_000
+        self.activities.append(self._activity(self._rng, activity_id, datetime.now(timezone.utc)))
+        return activity_id
+
+    def store_records(self) -> List[Dict[str, Any]]:
+        """Return the history as activity store records (see `app.activity_store`)."""
+        return [
+            {
+                'id': a['id'], 'name': a['name'], 'type': a['type'], 'distance': a['distance'],
+                'moving_time': a['moving_time'], 'elapsed_time': a['elapsed_time'],
+                'total_elevation_gain': a['total_elevation_gain'], 'start_date': a['start_date'],
+                'average_speed': a['average_speed'], 'max_speed': a['max_speed'],
+                'average_cadence': a['average_cadence'], 'average_heartrate': a['average_heartrate'],
+                'weighted_average_watts': None, 'kudos_count': a['kudos_count'],
+                'max_heartrate': a['max_heartrate'], 'suffer_score': a['suffer_score'],
+                'calories': a['kilojoules'],
+            }
+            for a in self.activities
+        ]
+
+    def page(self, after: Optional[int], before: Optional[int], page: int, per_page: int) -> List[Dict[str, Any]]:
+        """Serve `/athlete/activities`: ascending when `after` is given, newest first otherwise."""
+        if len(self._epochs) != len(self.activities):
+            self._epochs = [
+                int(datetime.strptime(a['start_date'], '%Y-%m-%dT%H:%M:%SZ')
+                    .replace(tzinfo=timezone.utc).timestamp())
+                for a in self.activities
+            ]
+        lo = bisect.bisect_right(self._epochs, after) if after is not None else 0
+        hi = bisect.bisect_left(self._epochs, before) if before is not None else len(self._epochs)
+        offset = (page - 1) * per_page
+        if after is not None:
+            return self.activities[lo + offset:min(lo + offset + per_page, hi)]
+        end = hi - offset
+        return self.activities[max(end - per_page, lo):max(end, lo)][::-1]
+
+
+def synthetic_streams(activity: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+    """Build deterministic one-sample-per-second streams for an activity, keyed by type."""
+    rng = random.Random(activity['id'])
+    seconds = activity['moving_time']
+    speed = activity['distance'] / seconds
+    heartrate = activity['average_heartrate'] or 0
+    series: Dict[str, List[Any]] = {
+        'time': [], 'distance': [], 'velocity_smooth': [], 'altitude': [],
+        'grade_smooth': [], 'cadence': [], 'moving': [],
+    }
+    if heartrate:
+        series['heartrate'] = []
+    distance, altitude = 0.0, 100.0
+    for second in range(seconds):
+        grade = 4 * math.sin(second / 300)
+        velocity = max(speed * (1 - grade / 40) + rng.uniform(-0.2, 0.2), 0.5)
+        distance += velocity
+        altitude += velocity * grade / 100
+        series['time'].append(second)
+        series['distance'].append(round(distance, 1))
+        series['velocity_smooth'].append(round(velocity, 2))
+        series['altitude'].append(round(altitude, 1))
+        series['grade_smooth'].append(round(grade, 1))
+        series['cadence'].append(activity['average_cadence'] or 0)
+        series['moving'].append(True)
+        if heartrate:
+            series['heartrate'].append(round(heartrate - 8 + 16 * second / seconds))
+    return {
+        stream_type: {'type': stream_type, 'data': data, 'series_type': 'time',
+                      'original_size': seconds, 'resolution': 'high'}
+        for stream_type, data in series.items()
+    }
+
+
+@dataclass
+class FakeStravaAdapter(BaseAdapter):
+    """
+    `requests` transport adapter serving the Strava API from synthetic histories.
+
+    Athletes are identified by their access token, `bench-<athlete_id>`.
+    """
+
+    histories: Dict[int, SyntheticHistory] = field(default_factory=dict)
+    latency_seconds: float = 0.0
+    short_limit: int = 100_000
+    long_limit: int = 1_000_000
+    requests_served: int = 0
+
+    def __post_init__(self) -> None:
+        super().__init__()
+        self._lock = threading.Lock()
+
+    def _respond(self, request: requests.PreparedRequest, status: int, body: Any) -> requests.Response:
+        with self._lock:
+            self.requests_served += 1
+            usage = self.requests_served
+        response = requests.Response()
+        response.status_code = status
+        response._content = json.dumps(body).encode()
+        response.headers.update({
+            'Content-Type': 'application/json',
+            'X-RateLimit-Limit': f'{self.short_limit},{self.long_limit}',
+            'X-RateLimit-Usage': f'{usage % self.short_limit},{usage}',
+        })
+        response.url = request.url
+        response.request = request
+        response.encoding = 'utf-8'
+        return response
+
+    def send(self, request: requests.PreparedRequest, **kwargs: Any) -> requests.Response:
+        if self.latency_seconds:
+            time.sleep(self.latency_seconds)
+        url = urlparse(request.url)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        athlete_id = int(query.get('access_token', 'bench-0').rsplit('-', 1)[-1])
+        history = self.histories.get(athlete_id)
+        if history is None:
+            return self._respond(request, 401, {'message': 'Authorization Error'})
+
+        path = url.path.removeprefix('/api/v3')
+        if path == '/athlete/activities':
+            return self._respond(request, 200, history.page(
+                int(query['after']) if 'after' in query else None,
+                int(query['before']) if 'before' in query else None,
+                int(query.get('page', 1)),
+                int(query.get('per_page', 30)),
+            ))
+        if path.startswith('/activities/'):
+            activity_id = int(path.split('/')[2])
+            for activity in history.activities:
+                if activity['id'] == activity_id:
+                    if path.endswith('/streams'):
+                        return self._respond(request, 200, synthetic_streams(activity))
+                    return self._respond(request, 200, {**activity, 'resource_state': 3})
+        return self._respond(request, 404, {'message': 'Record Not Found'})
+
+    def close(self) -> None:
+        pass
+
+
+def fake_llm_app(
+    ttft_seconds: float,
+    tokens_per_second: float,
+    tokens: int,
+    model_delays: Optional[Dict[str, float]] = None,
+    failing_models: Optional[Set[str]] = None
+) -> FastAPI:
+    """
+    Build an OpenAI-compatible chat completions app with controllable speed.
+
+    `model_delays` and `failing_models` are read on every request, so callers
+    can change them between requests to simulate a slow or failing backend.
+
+    Args:
+        ttft_seconds: Delay before the first token
+        tokens_per_second: Generation speed after the first token
+        tokens: Number of tokens per completion
+        model_delays: Extra delay before the first token, per model
+        failing_models: Models that answer with HTTP 503
+
+    Returns:
+        FastAPI: App serving `/models/{model}/v1/chat/completions`
+    """
+    app = FastAPI()
+    words = [f'word{n} ' for n in range(tokens)]
+    model_delays = {} if model_delays is None else model_delays
+    failing_models = set() if failing_models is None else failing_models
+
+    @app.post('/models/{model:path}/v1/chat/completions')
+    async def chat(model: str, request: Request):
+        body = await request.json()
+        if model in failing_models:
+            return JSONResponse({'error': 'Model is overloaded'}, status_code=503)
+        ttft = ttft_seconds + model_delays.get(model, 0.0)
+        if not body.get('stream'):
+            await asyncio.sleep(ttft + (tokens - 1) / tokens_per_second)
+            return JSONResponse({'model': model, 'choices': [{'message': {'content': ''.join(words)}}]})
+
+        async def generate():
+            await asyncio.sleep(ttft)
+            for n, word in enumerate(words):
+                if n:
+                    await asyncio.sleep(1 / tokens_per_second)
+                yield 'data: ' + json.dumps({'model': model, 'choices': [{'delta': {'content': word}}]}) + '\n\n'
+            yield 'data: [DONE]\n\n'
+
+        return StreamingResponse(generate(), media_type='text/event-stream')
+
+    return app
+
+
+def free_port() -> int:
+    """Return a TCP port that is free on localhost."""
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class ThreadedServer:
+    """
+    Serve an ASGI app over real HTTP with uvicorn in a background thread.
+    """
+
+    def __init__(self, app: Any) -> None:
+        self.port = free_port()
+        self.url = f'http://127.0.0.1:{self.port}'
+        self._server = uvicorn.Server(uvicorn.Config(app, port=self.port, log_level='warning'))
+        self._thread = threading.Thread(target=self._server.run, daemon=True)
+
+    def __enter__(self) -> 'ThreadedServer':
+        self._thread.start()
+        while not self._server.started:
+            time.sleep(0.01)
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self._server.should_exit = True
+        self._thread.join()
+
+
+class SMTPSink:
+    """
+    Minimal asyncio SMTP server that accepts every message and records its arrival.
+    """
+
+    def __init__(self) -> None:
+        self.port = free_port()
+        self.messages: List[Tuple[float, str]] = []
+        self.connections = 0
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._arrived = asyncio.Condition()
+
+    async def start(self) -> 'SMTPSink':
+        self._server = await asyncio.start_server(self._session, '127.0.0.1', self.port)
+        return self
+
+    async def stop(self) -> None:
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def wait_for(self, count: int, timeout: float) -> float:
+        """Wait until `count` messages have arrived; return the arrival time of the last."""
+        async with self._arrived:
+            await asyncio.wait_for(self._arrived.wait_for(lambda: len(self.messages) >= count), timeout)
+        return self.messages[count - 1][0]
+
+    async def _session(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.connections += 1
+        writer.write(b'220 bench SMTP sink\r\n')
+        try:
+            while line := await reader.readline():
+                command = line.decode(errors='replace').strip().upper()
+                if command.startswith(('EHLO', 'HELO')):
+                    writer.write(b'250 bench\r\n')
+                elif command == 'DATA':
+                    writer.write(b'354 End data with <CR><LF>.<CR><LF>\r\n')
+                    await writer.drain()
+                    lines = []
+                    while (data := await reader.readline()) not in (b'.\r\n', b''):
+                        lines.append(data.decode(errors='replace'))
+                    async with self._arrived:
+                        self.messages.append((time.perf_counter(), ''.join(lines)))
+                        self._arrived.notify_all()
+                    writer.write(b'250 OK\r\n')
+                elif command == 'QUIT':
+                    writer.write(b'221 Bye\r\n')
+                    await writer.drain()
+                    break
+                else:  # MAIL, RCPT, RSET, NOOP
+                    writer.write(b'250 OK\r\n')
+                await writer.drain()
+        finally:
+            writer.close()
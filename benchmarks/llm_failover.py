@@ -0,0 +1,126 @@
+"""
+Failover scenarios for the LLM scheduler against a local fake inference server.
+
+Each scenario configures the fake server (see `benchmarks.fakes.fake_llm_app`)
+so that the primary model is healthy, slow, failing or past the deadline. It then
+asks `app.llm_scheduler.LLMScheduler` for advice twice, once complete and once
+streamed. For every request it reports the total time, the time to the first
+chunk when streaming, and which backend answered: primary, hedge, fallback or
+template. A scenario fails when another backend answers than expected or the
+response takes longer than the deadline (plus a small allowance).
+
+Usage:
+    python -m benchmarks.llm_failover --ttft 0.2 --tps 100
+"""
+
+import argparse
+import asyncio
+import json
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO_ROOT))
+
+import httpx
+
+from app import metrics
+from app.llm_processor import LLMAdapter
+from app.llm_scheduler import LLMScheduler
+from benchmarks.fakes import ThreadedServer, fake_llm_app
+
+PRIMARY, HEDGE, FALLBACK = 'bench/primary', 'bench/hedge', 'bench/fallback'
+SOURCES = ('primary', 'hedge', 'fallback', 'template')
+TEMPLATE = 'Template summary.'
+
+# name: (extra first-token delay per model, failing models, expected source)
+SCENARIOS = {
+    'healthy': ({}, set(), 'primary'),
+    'slow_primary': ({PRIMARY: 30.0}, set(), 'hedge'),
+    'failing_primary': ({}, {PRIMARY}, 'hedge'),
+    'primary_and_hedge_failing': ({}, {PRIMARY, HEDGE}, 'fallback'),
+    'primary_past_timeout': ({PRIMARY: 30.0, HEDGE: 30.0}, set(), 'fallback'),
+    'all_failing': ({}, {PRIMARY, HEDGE, FALLBACK}, 'template'),
+}
+
+
+def _responses() -> Dict[str, float]:
+    return {source: metrics.sample_value('workoutplan_llm_responses_total', source=source) for source in SOURCES}
+
+
+def _source(before: Dict[str, float]) -> Optional[str]:
+    after = _responses()
+    return next((source for source in SOURCES if after[source] > before[source]), None)
+
+
+async def run_scenario(scheduler: LLMScheduler, expected: str) -> Dict[str, Any]:
+    """Request complete and streamed advice and check which backend answered."""
+    result: Dict[str, Any] = {'expected': expected}
+
+    before = _responses()
+    start = time.perf_counter()
+    await scheduler.generate_summary('prompt', fallback=lambda: TEMPLATE)
+    result['complete'] = {'total_ms': round((time.perf_counter() - start) * 1000, 1), 'source': _source(before)}
+
+    before = _responses()
+    start = time.perf_counter()
+    first_chunk = None
+    async for _ in scheduler.generate_summary_stream('prompt', fallback=lambda: TEMPLATE):
+        if first_chunk is None:
+            first_chunk = time.perf_counter() - start
+    result['stream'] = {
+        'ttfb_ms': round((first_chunk or 0.0) * 1000, 1),
+        'total_ms': round((time.perf_counter() - start) * 1000, 1),
+        'source': _source(before),
+    }
+    return result
+
+
+async def main(args: argparse.Namespace) -> List[str]:
+    model_delays: Dict[str, float] = {}
+    failing_models: set = set()
+    failures = []
+    with ThreadedServer(fake_llm_app(args.ttft, args.tps, args.tokens, model_delays, failing_models)) as server:
+        async with httpx.AsyncClient(base_url=server.url, timeout=30.0) as client:
+            scheduler = LLMScheduler(
+                LLMAdapter(PRIMARY, timeout=args.primary_timeout, client=client),
+                hedge=LLMAdapter(HEDGE, timeout=args.primary_timeout, client=client),
+                fallbacks=[LLMAdapter(FALLBACK, timeout=args.deadline, client=client)],
+                deadline_seconds=args.deadline,
+                hedge_after_seconds=args.hedge_after,
+            )
+            results = {}
+            for name, (delays, failing, expected) in SCENARIOS.items():
+                model_delays.clear()
+                model_delays.update(delays)
+                failing_models.clear()
+                failing_models.update(failing)
+                results[name] = await run_scenario(scheduler, expected)
+                print(f'{name}: {json.dumps(results[name])}', flush=True)
+                for mode in ('complete', 'stream'):
+                    outcome = results[name][mode]
+                    if outcome['source'] != expected:
+                        failures.append(f"{name} ({mode}): answered by {outcome['source']}, expected {expected}")
+                    if outcome['total_ms'] > (args.deadline + 1.0) * 1000:
+                        failures.append(f"{name} ({mode}): took {outcome['total_ms']:.0f} ms")
+    return failures
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--ttft', type=float, default=0.2, help='Fake LLM time to first token, seconds')
+    parser.add_argument('--tps', type=float, default=100.0, help='Fake LLM tokens per second')
+    parser.add_argument('--tokens', type=int, default=50, help='Tokens per fake completion')
+    parser.add_argument('--hedge-after', type=float, default=1.0, help='Seconds before the hedge is sent')
+    parser.add_argument('--primary-timeout', type=float, default=3.0, help='Timeout of the primary and hedge')
+    parser.add_argument('--deadline', type=float, default=6.0, help='Deadline per piece of advice, seconds')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    failures = asyncio.run(main(parse_args()))
+    for failure in failures:
+        print(f'FAIL: {failure}', file=sys.stderr)
+    sys.exit(1 if failures else 0)
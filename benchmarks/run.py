@@ -0,0 +1,307 @@
+"""
+Offline end-to-end benchmarks of the webhook and advice pipeline.
+
+The app runs in a scratch workspace against local stand-ins (see
+`benchmarks.fakes`): a synthetic Strava API, a fake streaming LLM served over
+HTTP, and an SMTP sink. `stravaapi.app` is driven directly through its ASGI
+interface. For every history size the suite measures:
+
+- webhook acknowledgement latency
+- end-to-end time from webhook to delivered email, for the first (full-history)
+  sync and for an incremental one
+- `/stream_advice` time to first byte, for a first and a repeated request
+  (with the advice cache hits the repeat scored)
+- fan-out: concurrent `/stream_advice` clients arriving a little apart, with
+  the generations and Strava requests they caused, whether every client got the
+  same advice, and a `/stream_advice/events` client joining the same generation
+- memory use: process peak RSS after the pipeline runs, and peak traced
+  allocations of the microbenchmarks
+
+Before that it measures cold starts in fresh interpreters (see
+`benchmarks.startup`). The run fails if importing the app exceeds the import
+time budget.
+
+It also microbenchmarks `DataPreprocessor.process_run_data` and
+`calculate_summary_statistics`. Results are written as JSON to
+`benchmarks/results/` so runs can be compared with `benchmarks.compare`.
+
+Usage:
+    python -m benchmarks.run --sizes 100,1000,10000 --ttft 0.3 --tps 50
+"""
+
+import argparse
+import asyncio
+import gc
+import json
+import os
+import platform
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+import tracemalloc
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+RESULTS_DIR = REPO_ROOT / 'benchmarks' / 'results'
+sys.path.insert(0, str(REPO_ROOT))
+
+from benchmarks.asgi import asgi_request
+from benchmarks.fakes import FakeStravaAdapter, SMTPSink, SyntheticHistory, ThreadedServer, fake_llm_app
+from benchmarks.startup import DEFAULT_BUDGET_MS, measure_startup
+
+
+def summarize(samples: List[float]) -> Dict[str, float]:
+    """Reduce timing samples (seconds) to milliseconds percentiles."""
+    ordered = sorted(samples)
+    return {
+        'n': len(ordered),
+        'p50_ms': round(statistics.median(ordered) * 1000, 3),
+        'p95_ms': round(ordered[min(int(len(ordered) * 0.95), len(ordered) - 1)] * 1000, 3),
+        'max_ms': round(ordered[-1] * 1000, 3),
+    }
+
+
+def sse_text(body: bytes) -> str:
+    """Join the data of the `message` events in a server-sent event stream."""
+    text = []
+    for event in body.decode().split('\n\n'):
+        lines = event.split('\n')
+        if any(line.startswith('event:') for line in lines):
+            continue
+        data = [line[len('data: '):] for line in lines if line.startswith('data: ')]
+        if data:
+            text.append('\n'.join(data))
+    return ''.join(text)
+
+
+def measure(fn: Callable[[], Any], repeat: int) -> Dict[str, float]:
+    """Time `fn` `repeat` times and trace its peak allocations once."""
+    times = timeit.repeat(fn, number=1, repeat=repeat)
+    gc.collect()
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'best_ms': round(min(times) * 1000, 3), 'median_ms': round(statistics.median(times) * 1000, 3),
+            'peak_alloc_mb': round(peak / 2**20, 2)}
+
+
+def rss_mb() -> float:
+    """Peak resident set size of this process in MB."""
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(usage / (2**20 if sys.platform == 'darwin' else 2**10), 1)
+
+
+def prepare_workspace(args: argparse.Namespace, llm_url: str, smtp_port: int) -> Path:
+    """Create a scratch working directory and point the app's settings at the fakes."""
+    workspace = Path(tempfile.mkdtemp(prefix='workoutplan-bench-'))
+    (workspace / 'data').mkdir()
+    shutil.copy(REPO_ROOT / 'data' / 'prompt_template.txt', workspace / 'data' / 'prompt_template.txt')
+    with open(workspace / 'strava_tokens.json', 'w') as file:
+        json.dump({'access_token': 'bench-0', 'refresh_token': 'r', 'expires_at': time.time() + 10**7}, file)
+    os.environ.update({
+        'CLIENT_ID': 'bench', 'CLIENT_SECRET': 'bench', 'HUGGINGFACE_TOKEN': 'bench',
+        'EMAIL_SENDER': 'bench@example.com', 'EMAIL_PASSWORD': '', 'EMAIL_RECEIVER': 'athlete@example.com',
+        'LLM_API_BASE': llm_url, 'SMTP_HOST': '127.0.0.1', 'SMTP_PORT': str(smtp_port),
+        'SMTP_STARTTLS': 'false', 'WEBHOOK_DEBOUNCE_SECONDS': '0', 'EMAIL_DIGEST_SECONDS': '0',
+        'WEBHOOK_WORKERS': str(args.workers),
+    })
+    os.chdir(workspace)
+    return workspace
+
+
+def microbenchmarks(history: SyntheticHistory, repeat: int) -> Dict[str, Any]:
+    """Time run processing and summary statistics over a pre-filled activity store."""
+    from app.activity_store import ActivityStore
+    from app.data_preprocessing import DataPreprocessor
+
+    store = ActivityStore(f'./data/micro_{len(history.activities)}.db')
+    store.upsert_activities(history.store_records())
+    preprocessor = DataPreprocessor(store=store)
+    return {
+        'process_run_data': measure(preprocessor.process_run_data, repeat),
+        'calculate_summary_statistics': measure(preprocessor.calculate_summary_statistics, repeat),
+        'runs': int(preprocessor.summary_stats['total_activities'].sum()),
+    }
+
+
+async def end_to_end(
+    stravaapi: Any,
+    adapter: FakeStravaAdapter,
+    sink: SMTPSink,
+    athlete_id: int,
+    history: SyntheticHistory,
+    ack_samples: int,
+    fanout_clients: int,
+    timeout: float
+) -> Dict[str, Any]:
+    """Measure webhook, pipeline and streaming latencies for one athlete's history."""
+    adapter.histories[athlete_id] = history
+    stravaapi.athlete_registry.register(
+        athlete_id, f'{athlete_id}@example.com',
+        {'access_token': f'bench-{athlete_id}', 'refresh_token': 'r', 'expires_at': time.time() + 10**7}
+    )
+
+    async def webhook(activity_id: int) -> Dict[str, Any]:
+        return await asgi_request(stravaapi.app, 'POST', '/strava-webhook', body={
+            'object_type': 'activity', 'aspect_type': 'create', 'object_id': activity_id,
+            'owner_id': athlete_id, 'event_time': int(time.time()),
+        })
+
+    async def webhook_to_email(activity_id: int) -> Tuple[float, float]:
+        expected = len(sink.messages) + 1
+        start = time.perf_counter()
+        ack = await webhook(activity_id)
+        delivered = await sink.wait_for(expected, timeout)
+        return ack['total_s'], delivered - start
+
+    results: Dict[str, Any] = {'activities': len(history.activities)}
+    served = adapter.requests_served
+    _, cold = await webhook_to_email(history.activities[-1]['id'])
+    results['e2e_cold_sync_s'] = round(cold, 4)
+    results['strava_requests_cold'] = adapter.requests_served - served
+    _, incremental = await webhook_to_email(history.add_activity())
+    results['e2e_incremental_sync_s'] = round(incremental, 4)
+    results['peak_rss_mb_after_pipeline'] = rss_mb()
+
+    acks = [(await webhook(10**12 + athlete_id * 10**6 + n))['total_s'] for n in range(ack_samples)]
+    results['webhook_ack'] = summarize(acks)
+    while (await asyncio.to_thread(stravaapi.job_queue.stats))['pending'] or stravaapi.worker_pool.in_flight:
+        await asyncio.sleep(0.05)
+
+    history.add_activity()
+    for label in ('stream_advice_first', 'stream_advice_repeat'):
+        hits = (await asyncio.to_thread(stravaapi.advice_cache.stats))['hits']
+        response = await asgi_request(stravaapi.app, 'GET', '/stream_advice', query={'athlete_id': athlete_id})
+        results[label] = {
+            'status': response['status'],
+            'ttfb_ms': round((response['first_byte_s'] or 0) * 1000, 3),
+            'total_ms': round(response['total_s'] * 1000, 3),
+            'cache_hits': (await asyncio.to_thread(stravaapi.advice_cache.stats))['hits'] - hits,
+        }
+
+    async def client(delay: float, path: str) -> Dict[str, Any]:
+        await asyncio.sleep(delay)
+        return await asgi_request(stravaapi.app, 'GET', path, query={'athlete_id': athlete_id})
+
+    history.add_activity()
+    served = adapter.requests_served
+    started = stravaapi.metrics.sample_value('workoutplan_stream_subscribers_total', role='started')
+    responses = await asyncio.gather(
+        *(client(n * 0.05, '/stream_advice') for n in range(fanout_clients)),
+        client(fanout_clients * 0.05, '/stream_advice/events'),
+    )
+    plain, events = responses[:-1], responses[-1]
+    results['stream_advice_fanout'] = {
+        'clients': fanout_clients + 1,
+        'generations': stravaapi.metrics.sample_value('workoutplan_stream_subscribers_total', role='started') - started,
+        'strava_requests': adapter.requests_served - served,
+        'identical': len({response['body'].decode() for response in plain} | {sse_text(events['body'])}) == 1,
+        'ttfb': summarize([response['first_byte_s'] or 0 for response in plain]),
+        'total': summarize([response['total_s'] for response in plain]),
+        'events_status': events['status'],
+    }
+    return results
+
+
+async def run_end_to_end(args: argparse.Namespace, sink: SMTPSink) -> Dict[str, Any]:
+    """Import the app inside the workspace and benchmark every history size."""
+    import app.auth
+    import stravaapi
+
+    adapter = FakeStravaAdapter(latency_seconds=args.strava_latency)
+    create_client = app.auth.create_client
+
+    def bench_client():
+        client = create_client()
+        client.protocol.rsession.mount('https://', adapter)
+        return client
+
+    app.auth.create_client = bench_client
+    results = {}
+    async with stravaapi.lifespan(stravaapi.app):
+        for size in args.sizes:
+            history = SyntheticHistory(athlete_id=size, size=size, seed=args.seed)
+            results[str(size)] = await end_to_end(
+                stravaapi, adapter, sink, size, history, args.ack_samples, args.fanout_clients, args.timeout
+            )
+            results[str(size)]['microbenchmarks'] = microbenchmarks(history, args.repeat)
+            print(f'{size} activities: {json.dumps(results[str(size)])}', flush=True)
+    return results
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def main(args: argparse.Namespace) -> Tuple[Path, List[str]]:
+    startup = await asyncio.to_thread(measure_startup, args.startup_samples, args.import_budget_ms)
+    print(f'startup: {json.dumps(startup)}', flush=True)
+    sink = await SMTPSink().start()
+    with ThreadedServer(fake_llm_app(args.ttft, args.tps, args.tokens)) as llm:
+        workspace = prepare_workspace(args, llm.url, sink.port)
+        try:
+            results = await run_end_to_end(args, sink)
+        finally:
+            await sink.stop()
+            os.chdir(REPO_ROOT)
+            shutil.rmtree(workspace, ignore_errors=True)
+
+    report = {
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'params': {key: value for key, value in vars(args).items() if key != 'output'},
+        'smtp_connections': sink.connections,
+        'process_peak_rss_mb': rss_mb(),
+        'results': {'startup': startup, **results},
+    }
+    output = Path(args.output) if args.output else (
+        RESULTS_DIR / f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{report['commit'] or 'local'}.json"
+    )
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2))
+    return output, startup['failures']
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--sizes', default='100,1000,10000',
+                        type=lambda value: [int(size) for size in value.split(',')],
+                        help='Comma-separated activity history sizes (100 to 100000)')
+    parser.add_argument('--ttft', type=float, default=0.3, help='Fake LLM time to first token, seconds')
+    parser.add_argument('--tps', type=float, default=50.0, help='Fake LLM tokens per second')
+    parser.add_argument('--tokens', type=int, default=100, help='Tokens per fake completion')
+    parser.add_argument('--strava-latency', type=float, default=0.0, help='Fake Strava latency per request, seconds')
+    parser.add_argument('--workers', type=int, default=2, help='Webhook queue workers')
+    parser.add_argument('--ack-samples', type=int, default=50, help='Webhook acknowledgements to time per size')
+    parser.add_argument('--fanout-clients', type=int, default=10, help='Concurrent /stream_advice clients')
+    parser.add_argument('--repeat', type=int, default=5, help='Repetitions per microbenchmark')
+    parser.add_argument('--timeout', type=float, default=600.0, help='Seconds to wait for an email')
+    parser.add_argument('--startup-samples', type=int, default=3, help='Cold starts to measure')
+    parser.add_argument('--import-budget-ms', type=float, default=DEFAULT_BUDGET_MS,
+                        help=f'Fail if importing the app takes longer (default {DEFAULT_BUDGET_MS:.0f})')
+    parser.add_argument('--seed', type=int, default=0, help='Synthetic history seed')
+    parser.add_argument('--output', help='Result file (default: benchmarks/results/<time>-<commit>.json)')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    output_path, failures = asyncio.run(main(parse_args()))
+    print(f'Results written to {output_path}')
+    for failure in failures:
+        print(f'FAIL: {failure}', file=sys.stderr)
+    sys.exit(1 if failures else 0)
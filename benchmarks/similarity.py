@@ -0,0 +1,132 @@
+"""
+Query and update latency of the similar-activity index (`app.similarity_index`).
+
+For every history size a synthetic history is written to a scratch activity
+store, with every activity stored as a run so the searched index holds all of
+them. The benchmark then measures:
+
+- `build_ms`: loading the type from the store and fitting it, without and with
+  the inverted-file (IVF) index
+- `search_exact` / `search_ivf`: in-memory k-nearest-neighbour search latency
+- `nearest`: `SimilarityIndex.nearest` as the app calls it, including the
+  store version check, with the configured IVF threshold
+- `recall`: share of the exact k nearest neighbours the IVF search also finds
+- `apply_chunk_ms` / `apply_edit_ms`: incremental update with one sync chunk of
+  new activities (after a first, untimed one), and with one edited activity
+- `index_mb`: memory held by the loaded arrays
+
+Usage:
+    python -m benchmarks.similarity --sizes 10000,100000 --queries 500
+"""
+
+import argparse
+import json
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO_ROOT))
+
+import config
+from app.activity_store import ActivityStore
+from app.similarity_index import SimilarityIndex
+from benchmarks.fakes import SyntheticHistory
+from benchmarks.run import summarize
+
+
+def _timed(function: Any, *args: Any, **kwargs: Any) -> float:
+    start = time.perf_counter()
+    function(*args, **kwargs)
+    return time.perf_counter() - start
+
+
+def _build(db_path: str, ann_min_rows: int) -> Any:
+    """Load and fit the run index with the given IVF threshold; returns (index, type index, seconds)."""
+    config.SIMILARITY_ANN_MIN_ROWS = ann_min_rows
+    index = SimilarityIndex(db_path)
+    start = time.perf_counter()
+    index.nearest(-1, 'Run')
+    return index, index._type('Run'), time.perf_counter() - start
+
+
+def bench_size(size: int, queries: int, k: int, workdir: str) -> Dict[str, Any]:
+    """Run every measurement on a synthetic history of `size` activities."""
+    history = SyntheticHistory(1, size + 2 * config.SYNC_CHUNK_SIZE)
+    records = [dict(record, type='Run') for record in history.store_records()]
+    stored, warmup, later = records[:size], records[size:-config.SYNC_CHUNK_SIZE], records[-config.SYNC_CHUNK_SIZE:]
+    store = ActivityStore(str(Path(workdir) / f'activities_{size}.db'))
+    for start in range(0, len(stored), config.PROCESS_CHUNK_SIZE):
+        store.upsert_activities(stored[start:start + config.PROCESS_CHUNK_SIZE])
+
+    configured = config.SIMILARITY_ANN_MIN_ROWS
+    _, exact_index, exact_build = _build(store.db_path, 0)
+    ivf, ivf_index, ivf_build = _build(store.db_path, 1)
+    rng = random.Random(0)
+    rows = [rng.randrange(len(exact_index.ids)) for _ in range(queries)]
+
+    exact_times, ivf_times, found = [], [], 0
+    for row in rows:
+        start = time.perf_counter()
+        exact_rows, _ = exact_index.search(row, k)
+        exact_times.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        ivf_rows, _ = ivf_index.search(row, k)
+        ivf_times.append(time.perf_counter() - start)
+        found += len(set(exact_rows.tolist()) & set(ivf_rows.tolist()))
+
+    index, _, _ = _build(store.db_path, configured)
+    ids = [int(activity_id) for activity_id in exact_index.ids[rows]]
+    nearest_times = [_timed(index.nearest, activity_id, 'Run', k) for activity_id in ids]
+
+    # The first update pays one-time lazy imports inside NumPy.
+    store.upsert_activities(warmup)
+    ivf.apply(warmup)
+    store.upsert_activities(later)
+    apply_chunk = _timed(ivf.apply, later)
+    edited = dict(stored[rows[0]], distance=stored[rows[0]]['distance'] * 1.1)
+    store.upsert_activities([edited])
+    apply_edit = _timed(ivf.apply, [edited])
+    config.SIMILARITY_ANN_MIN_ROWS = configured
+
+    arrays = (ivf_index.ids, ivf_index.start_ts, ivf_index.raw, ivf_index.vectors, ivf_index.norms)
+    return {
+        'activities': size,
+        'k': k,
+        'build_ms': {'exact': round(exact_build * 1000, 1), 'ivf': round(ivf_build * 1000, 1)},
+        'ivf_clusters': len(ivf_index.centroids) if ivf_index.centroids is not None else 0,
+        'ivf_probes': config.SIMILARITY_ANN_PROBES,
+        'search_exact': summarize(exact_times),
+        'search_ivf': summarize(ivf_times),
+        'recall': round(found / (len(rows) * k), 4),
+        'nearest': {'ivf': index._type('Run').centroids is not None, **summarize(nearest_times)},
+        'apply_chunk_ms': round(apply_chunk * 1000, 3),
+        'apply_chunk_rows': len(later),
+        'apply_edit_ms': round(apply_edit * 1000, 3),
+        'index_mb': round(sum(array.nbytes for array in arrays) / 1e6, 2),
+    }
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--sizes', default='10000,100000', help='Comma-separated history sizes')
+    parser.add_argument('--queries', type=int, default=500, help='Queries per size')
+    parser.add_argument('--k', type=int, default=config.SIMILAR_ACTIVITIES_K, help='Neighbours per query')
+    parser.add_argument('--output', help='Also write the results as JSON to this file')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    results = {}
+    with tempfile.TemporaryDirectory(prefix='similarity-bench-') as workdir:
+        for size in (int(size) for size in args.sizes.split(',')):
+            results[str(size)] = bench_size(size, args.queries, args.k, workdir)
+            print(f'{size} activities: {json.dumps(results[str(size)])}', flush=True)
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+        print(f'Results written to {args.output}')
@@ -0,0 +1,159 @@
+"""
+Cold-start benchmark: how long a fresh process takes to acknowledge a webhook.
+
+Each sample runs in a new interpreter under `python -X importtime`, in an empty
+scratch directory. The child imports `stravaapi`, enters its lifespan, posts
+one webhook and then waits for the processing pipeline to finish loading. The
+sample records:
+
+- `import_ms`: cumulative import time of `stravaapi`, from `-X importtime`
+- `startup_ms`: time to run the lifespan startup
+- `first_ack_ms`: time from the start of the import to the webhook response
+- `pipeline_loaded_ms`: time from the start of the import until the pipeline is loaded
+- `eager_modules`: heavy dependencies that were loaded by the import itself
+
+The best import time is checked against a budget. The check fails if the budget
+is exceeded or a heavy dependency is imported eagerly again.
+
+Usage:
+    python -m benchmarks.startup --budget-ms 1200
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+
+# Dependencies only the processing pipeline needs; importing the app must not load them.
+HEAVY_MODULES = ('pandas', 'stravalib', 'httpx', 'requests', 'huggingface_hub')
+
+DEFAULT_BUDGET_MS = 1200.0
+
+
+def parse_importtime(stderr: str, module: str) -> Optional[float]:
+    """Read the cumulative import time (ms) of a top-level `module` from `-X importtime` output."""
+    for line in stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        if name.rstrip() == f' {module}':
+            return int(cumulative) / 1000
+    return None
+
+
+def child() -> None:
+    """Run one cold start in this process and print its timings as JSON."""
+    start = time.perf_counter()
+    import stravaapi
+    imported = time.perf_counter()
+    eager = [name for name in HEAVY_MODULES if name in sys.modules]
+
+    async def serve() -> Dict[str, Any]:
+        from benchmarks.asgi import asgi_request
+
+        async with stravaapi.lifespan(stravaapi.app):
+            started = time.perf_counter()
+            response = await asgi_request(stravaapi.app, 'POST', '/strava-webhook', body={
+                'object_type': 'activity', 'aspect_type': 'create', 'object_id': 1,
+                'owner_id': 1, 'event_time': int(time.time()), 'updates': {},
+            })
+            acked = time.perf_counter()
+            await stravaapi.ensure_pipeline()
+            loaded = time.perf_counter()
+        return {
+            'startup_ms': round((started - imported) * 1000, 1),
+            'first_ack_ms': round((acked - start) * 1000, 1),
+            'pipeline_loaded_ms': round((loaded - start) * 1000, 1),
+            'ack_status': json.loads(response['body']).get('status'),
+        }
+
+    print(json.dumps({'eager_modules': eager, **asyncio.run(serve())}))
+
+
+def run_sample() -> Dict[str, Any]:
+    """Run one cold start in a fresh interpreter and scratch directory."""
+    workspace = Path(tempfile.mkdtemp(prefix='workoutplan-startup-'))
+    try:
+        (workspace / 'data').mkdir()
+        shutil.copy(REPO_ROOT / 'data' / 'prompt_template.txt', workspace / 'data' / 'prompt_template.txt')
+        env = {
+            **os.environ,
+            'PYTHONPATH': os.pathsep.join(filter(None, [str(REPO_ROOT), os.environ.get('PYTHONPATH')])),
+            # Keep the queued job from running; only the acknowledgement is measured.
+            'WEBHOOK_DEBOUNCE_SECONDS': '3600',
+            'WEBHOOK_DEBOUNCE_MAX_SECONDS': '3600',
+            'LAZY_STARTUP': 'true',
+        }
+        process = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-m', 'benchmarks.startup', '--child'],
+            cwd=workspace, env=env, capture_output=True, text=True, check=True,
+        )
+    finally:
+        shutil.rmtree(workspace, ignore_errors=True)
+    sample = json.loads(process.stdout.strip().splitlines()[-1])
+    sample['import_ms'] = parse_importtime(process.stderr, 'stravaapi')
+    return sample
+
+
+def measure_startup(samples: int = 3, budget_ms: float = DEFAULT_BUDGET_MS) -> Dict[str, Any]:
+    """
+    Measure cold starts and check them against the import budget.
+
+    Args:
+        samples: Number of cold starts; the best import time is checked
+        budget_ms: Maximum import time of `stravaapi` in milliseconds
+
+    Returns:
+        Dict with the best import time, median startup timings, the eagerly
+        imported heavy modules and the budget `failures` (empty if within budget)
+    """
+    runs = [run_sample() for _ in range(samples)]
+    eager = sorted({name for run in runs for name in run['eager_modules']})
+    result = {
+        'import_ms': min(run['import_ms'] for run in runs),
+        'startup_ms': statistics.median(run['startup_ms'] for run in runs),
+        'first_ack_ms': statistics.median(run['first_ack_ms'] for run in runs),
+        'pipeline_loaded_ms': statistics.median(run['pipeline_loaded_ms'] for run in runs),
+        'ack_status': runs[0]['ack_status'],
+        'eager_modules': eager,
+        'budget_ms': budget_ms,
+    }
+    failures = []
+    if result['import_ms'] > budget_ms:
+        failures.append(f"import stravaapi took {result['import_ms']:.0f} ms, over the {budget_ms:.0f} ms budget")
+    if eager:
+        failures.append(f"import stravaapi loaded {', '.join(eager)}")
+    result['failures'] = failures
+    return result
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--samples', type=int, default=3, help='Cold starts to run (default 3)')
+    parser.add_argument('--budget-ms', type=float, default=DEFAULT_BUDGET_MS,
+                        help=f'Import time budget of stravaapi in ms (default {DEFAULT_BUDGET_MS:.0f})')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    if args.child:
+        child()
+        return 0
+
+    result = measure_startup(args.samples, args.budget_ms)
+    print(json.dumps(result, indent=2))
+    for failure in result['failures']:
+        print(f'FAIL: {failure}', file=sys.stderr)
+    return 1 if result['failures'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
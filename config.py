@@ -1,5 +1,150 @@
+import os
+
 PROMPT_TEMPLATE_PATH = './data/prompt_template.txt'
 ACTIVITY_DATA_PATH = './data/processed_run_data.json'
 SUMMARY_STATS_PATH = './data/summary_statistics.json'
 MODEL_NAME = "mistralai/Mistral-7B-Instruct-v0.3"
 
+# Local activity store and Strava sync settings
+ACTIVITY_STORE_PATH = './data/activities.db'
+RECONCILE_INTERVAL_HOURS = 24
+RECONCILE_WINDOW_DAYS = 30
+# Synced activities are written to the store one chunk (one Strava page) at a time,
+# and processed in chunks, so memory stays bounded however long the history is.
+SYNC_CHUNK_SIZE = 200
+# Incremental syncs start this long before the newest stored activity, to pick up
+# activities uploaded late with an earlier start time.
+SYNC_OVERLAP_HOURS = int(os.getenv('SYNC_OVERLAP_HOURS', '72'))
+# Activities written per transaction when backfilling from an export archive
+BACKFILL_BATCH_SIZE = 1000
+# Rolling windows, in days, of the materialized activity aggregates
+AGGREGATE_WINDOWS_DAYS = (7, 28, 90)
+PROCESS_CHUNK_SIZE = 5000
+# Most recent runs kept as full records for the prompt and snapshots; older runs
+# only contribute to the summary statistics and rollups.
+PROCESS_RECENT_RUNS = int(os.getenv('PROCESS_RECENT_RUNS', '200'))
+
+# Webhook job queue and worker pool settings
+JOB_QUEUE_PATH = './data/jobs.db'
+WEBHOOK_WORKERS = int(os.getenv('WEBHOOK_WORKERS', '2'))
+JOB_MAX_ATTEMPTS = 5
+JOB_RETRY_BASE_SECONDS = 30
+JOB_POLL_INTERVAL_SECONDS = 1
+# A claimed job returns to the queue if its process stops renewing it for this long.
+JOB_LEASE_SECONDS = int(os.getenv('JOB_LEASE_SECONDS', '60'))
+
+# LLM inference settings
+LLM_API_BASE = os.getenv('LLM_API_BASE', 'https://api-inference.huggingface.co')
+LLM_MAX_TOKENS = int(os.getenv('LLM_MAX_TOKENS', '1024'))
+LLM_MAX_CONCURRENCY = int(os.getenv('LLM_MAX_CONCURRENCY', '4'))
+LLM_REQUEST_TIMEOUT_SECONDS = 60
+LLM_READ_TIMEOUT_SECONDS = 30
+# Deadline for one piece of advice across all attempts, including waiting for a
+# generation slot. What is left after the primary model goes to the fallbacks.
+LLM_DEADLINE_SECONDS = int(os.getenv('LLM_DEADLINE_SECONDS', '90'))
+# Second model or endpoint URL raced against the primary once it is slower than
+# LLM_HEDGE_AFTER_SECONDS (to the first token, when streaming); empty disables hedging.
+LLM_HEDGE_MODEL = os.getenv('LLM_HEDGE_MODEL', '')
+LLM_HEDGE_AFTER_SECONDS = float(os.getenv('LLM_HEDGE_AFTER_SECONDS', '10'))
+# Smaller model tried when the primary (and hedge) fail; empty disables it. If it
+# fails too, the advice is a template summary of the statistics.
+LLM_FALLBACK_MODEL = os.getenv('LLM_FALLBACK_MODEL', 'microsoft/Phi-3-mini-128k-instruct')
+# Context window of the fallback model; its max_tokens is cut to what fits after the prompt.
+LLM_FALLBACK_CONTEXT_TOKENS = int(os.getenv('LLM_FALLBACK_CONTEXT_TOKENS', '131072'))
+LLM_FALLBACK_TIMEOUT_SECONDS = 30
+# Idle time after which /stream_advice/events sends a keep-alive comment
+SSE_HEARTBEAT_SECONDS = float(os.getenv('SSE_HEARTBEAT_SECONDS', '15'))
+
+# Advice cache settings
+ADVICE_CACHE_PATH = './data/advice_cache.db'
+ADVICE_CACHE_TTL_HOURS = 24 * 7
+ADVICE_CACHE_MAX_ENTRIES = 500
+ADVICE_CACHE_MAX_MB = 50
+
+# Prompt builder settings
+PROMPT_TOKEN_BUDGET = int(os.getenv('PROMPT_TOKEN_BUDGET', '3000'))
+PROMPT_WEEKLY_ROLLUP_WEEKS = 12
+# Months before the weekly rollups that the prompt reports monthly
+PROMPT_MONTHLY_ROLLUP_MONTHS = 60
+# Most similar past activities of the same type shown next to the latest one
+SIMILAR_ACTIVITIES_K = int(os.getenv('SIMILAR_ACTIVITIES_K', '5'))
+# Histories of one type at least this long are searched through an approximate
+# (inverted-file) index instead of exhaustively; 0 disables it.
+SIMILARITY_ANN_MIN_ROWS = int(os.getenv('SIMILARITY_ANN_MIN_ROWS', '20000'))
+# Clusters of the approximate index searched per query
+SIMILARITY_ANN_PROBES = 8
+
+# Optional on-disk snapshots of the processed data
+SNAPSHOT_ENABLED = os.getenv('SNAPSHOT_ENABLED', 'true').lower() == 'true'
+
+# Activity streams (per-second time series) settings
+STREAMS_ENABLED = os.getenv('STREAMS_ENABLED', 'true').lower() == 'true'
+STREAMS_DIR = './data/streams'
+# Streams are fetched for this many of the most recent runs that don't have them yet.
+STREAMS_FETCH_RECENT_RUNS = int(os.getenv('STREAMS_FETCH_RECENT_RUNS', '1'))
+# Samples further apart than this are treated as paused time.
+STREAM_MAX_GAP_SECONDS = 30
+# Lower bounds of heart-rate zones 1-5 as fractions of the heart-rate reserve.
+HEART_RATE_ZONE_BOUNDS = (0.5, 0.6, 0.7, 0.8, 0.9)
+
+# Training load settings
+ATHLETE_REST_HEARTRATE = int(os.getenv('ATHLETE_REST_HEARTRATE', '60'))
+ATHLETE_MAX_HEARTRATE = int(os.getenv('ATHLETE_MAX_HEARTRATE', '190'))
+THRESHOLD_PACE_MIN_PER_KM = float(os.getenv('THRESHOLD_PACE_MIN_PER_KM', '5.0'))
+
+# Multi-athlete settings
+ATHLETE_REGISTRY_PATH = './data/athletes.db'
+ATHLETE_DATA_DIR = './data/athletes'
+
+# Strava token settings
+# Access tokens are refreshed this many seconds before they expire.
+TOKEN_REFRESH_WINDOW_SECONDS = int(os.getenv('TOKEN_REFRESH_WINDOW_SECONDS', '600'))
+
+# Webhook deduplication settings
+# Processed activity ids are forgotten after this many days.
+DEDUP_TTL_DAYS = int(os.getenv('DEDUP_TTL_DAYS', '30'))
+DEDUP_PRUNE_INTERVAL_SECONDS = 3600
+
+# Email delivery settings
+SMTP_HOST = os.getenv('SMTP_HOST', 'smtp.gmail.com')
+SMTP_PORT = int(os.getenv('SMTP_PORT', '587'))
+SMTP_STARTTLS = os.getenv('SMTP_STARTTLS', 'true').lower() == 'true'
+SMTP_POOL_SIZE = int(os.getenv('SMTP_POOL_SIZE', '2'))
+# Pooled connections idle for longer than this are reconnected before use.
+SMTP_IDLE_TIMEOUT_SECONDS = 120
+EMAIL_MAX_ATTEMPTS = 4
+EMAIL_RETRY_BASE_SECONDS = 5
+# When > 0, advice emails to the same address within this window are sent as one digest.
+EMAIL_DIGEST_SECONDS = int(os.getenv('EMAIL_DIGEST_SECONDS', '0'))
+# Queued (digest and retried) emails wait here until they are sent.
+EMAIL_OUTBOX_PATH = './data/email_outbox.db'
+EMAIL_POLL_INTERVAL_SECONDS = 1
+
+# Strava API rate-limit settings (defaults until response headers report the real quotas)
+STRAVA_SHORT_LIMIT = int(os.getenv('STRAVA_SHORT_LIMIT', '200'))  # Requests per 15 minutes
+STRAVA_LONG_LIMIT = int(os.getenv('STRAVA_LONG_LIMIT', '2000'))  # Requests per day
+# Share of each window held back from a priority (0 = webhook, 1 = manual, 2 = backfill).
+STRAVA_PRIORITY_RESERVES = {0: 0.0, 1: 0.1, 2: 0.3}
+# Seconds a request of each priority may wait for budget before it is deferred.
+STRAVA_MAX_WAIT_SECONDS = {0: 120, 1: 5, 2: 900}
+# Below this remaining share of a window, optional work such as reconcile passes is skipped.
+STRAVA_LOW_BUDGET_FRACTION = 0.2
+
+# Webhook event coalescing: an athlete's events are merged into one job that runs
+# after this many quiet seconds, at most WEBHOOK_DEBOUNCE_MAX_SECONDS after the first event.
+WEBHOOK_DEBOUNCE_SECONDS = int(os.getenv('WEBHOOK_DEBOUNCE_SECONDS', '30'))
+WEBHOOK_DEBOUNCE_MAX_SECONDS = int(os.getenv('WEBHOOK_DEBOUNCE_MAX_SECONDS', '180'))
+# Fetch a burst's activities by id and start the advice on them while the history
+# sync runs, instead of waiting for the sync.
+WEBHOOK_FETCH_BY_ID = os.getenv('WEBHOOK_FETCH_BY_ID', 'true').lower() == 'true'
+# Larger bursts wait for the sync, which fetches up to 200 activities per request.
+WEBHOOK_FETCH_BY_ID_MAX = int(os.getenv('WEBHOOK_FETCH_BY_ID_MAX', '5'))
+
+# Observability settings
+# Prefix log lines with the trace id of the request or job they belong to.
+LOG_TRACE_IDS = os.getenv('LOG_TRACE_IDS', 'true').lower() == 'true'
+
+# Startup settings
+# Serve requests while the processing pipeline (pandas, stravalib, the LLM client)
+# loads in the background; when false, startup waits until it is loaded.
+LAZY_STARTUP = os.getenv('LAZY_STARTUP', 'true').lower() == 'true'
@@ -3,69 +3,459 @@ FastAPI application for handling Strava webhooks and generating fitness advice.
 
 This module processes Strava activity data, generates personalized advice using LLM,
 and sends email notifications for new activities.
+
+Importing the module only loads what acknowledging a webhook needs. Stores and
+handlers are created in the `lifespan` hook, and the processing pipeline
+(pandas, stravalib and the LLM client) is imported by `ensure_pipeline`, in the
+background after startup or on first use.
 """
 
 import asyncio
-import json
+import importlib
 import logging
 import os
-import uvicorn
+import time
+from contextlib import asynccontextmanager
 from datetime import datetime
-from typing import Set
+from typing import TYPE_CHECKING, Any, AsyncGenerator, Dict, List, Optional, Set, Tuple
 
 from dotenv import load_dotenv
-from fastapi import FastAPI, HTTPException, Request
-from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 
-from app.data_preprocessing import DataPreprocessor
+from app import metrics
+from app.aggregates import PERIODS, ActivityAggregates
+from app.athletes import AthleteRegistry, AthleteSettings, activity_store_path, partition_key, snapshot_paths
+from app.broadcast import GenerationBroadcaster, SharedGeneration
 from app.email_handler import EmailHandler
-from app.llm_processor import LLMAdapter
-from app.prompt_handler import PromptHandler
-from utils.db_configs import is_activity_processed, mark_activity_processed, initialize_db
+from app.job_queue import JobQueue, RetryLater, WorkerPool
+from app.strava_scheduler import Priority, StravaBudgetExhausted, strava_scheduler
+from app.training_load import TrainingLoadTracker
+from app.webhook_events import burst_activities, burst_subject, merge_event
+from utils.db_configs import claim_activity, close_db, initialize_db, release_activity
 import config
 
-#Initializing DB
-initialize_db()
+if TYPE_CHECKING:
+    from app.advice_cache import AdviceCache
+    from app.data_preprocessing import DataPreprocessor, ProcessedActivities
+    from app.llm_scheduler import LLMScheduler
+
+# Modules of the processing pipeline, imported on first use rather than with the app
+PIPELINE_MODULES = (
+    'app.data_preprocessing',
+    'app.prompt_handler',
+    'app.auth',
+    'app.llm_processor',
+    'app.llm_scheduler',
+    'app.advice_cache',
+)
 
 # Configuring logging
 logging.basicConfig(
     level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
+    format=(
+        '%(asctime)s - %(levelname)s - [%(trace_id)s] %(message)s' if config.LOG_TRACE_IDS
+        else '%(asctime)s - %(levelname)s - %(message)s'
+    ),
     datefmt='%Y-%m-%d %H:%M:%S'
 )
+for handler in logging.getLogger().handlers:
+    handler.addFilter(metrics.TraceIdFilter())
 logger = logging.getLogger(__name__)
 
 # Loading environment variables and initializing globals
 load_dotenv()
 VERIFY_TOKEN = os.getenv('STRAVA_VERIFY_TOKEN')
-processed_activities: Set[int] = set()
 
-# Initializing FastAPI app and handlers
-app = FastAPI()
-email_handler = EmailHandler()
+_snapshot_tasks: Set[asyncio.Task] = set()
+# Concurrent /stream_advice requests for one athlete share a generation
+advice_broadcaster = GenerationBroadcaster()
+
+# Created by `lifespan`
+email_handler: Optional[EmailHandler] = None
+athlete_registry: Optional[AthleteRegistry] = None
+job_queue: Optional[JobQueue] = None
+worker_pool: Optional[WorkerPool] = None
+# Created by `ensure_pipeline`
+advice_cache: Optional['AdviceCache'] = None
+llm_adapter: Optional['LLMScheduler'] = None
+_pipeline_task: Optional[asyncio.Task] = None
+
+
+def _load_pipeline() -> None:
+    """Import the processing pipeline and create the LLM scheduler; blocking, runs in a worker thread."""
+    global advice_cache, llm_adapter
+    start = time.perf_counter()
+    with metrics.timed('pipeline_load'):
+        for name in PIPELINE_MODULES:
+            importlib.import_module(name)
+        from app.advice_cache import AdviceCache, CachingLLMAdapter
+        from app.llm_processor import LLMAdapter
+        from app.llm_scheduler import LLMScheduler
+
+        cache = AdviceCache(
+            config.ADVICE_CACHE_PATH,
+            ttl_seconds=config.ADVICE_CACHE_TTL_HOURS * 3600,
+            max_entries=config.ADVICE_CACHE_MAX_ENTRIES,
+            max_bytes=config.ADVICE_CACHE_MAX_MB * 1024 * 1024,
+        )
+        advice_cache = cache
+        llm_adapter = LLMScheduler(
+            CachingLLMAdapter(LLMAdapter(model_name=config.MODEL_NAME), cache),
+            hedge=LLMAdapter(model_name=config.LLM_HEDGE_MODEL) if config.LLM_HEDGE_MODEL else None,
+            fallbacks=[
+                LLMAdapter(
+                    model_name=config.LLM_FALLBACK_MODEL,
+                    timeout=config.LLM_FALLBACK_TIMEOUT_SECONDS,
+                    context_tokens=config.LLM_FALLBACK_CONTEXT_TOKENS
+                )
+            ] if config.LLM_FALLBACK_MODEL else [],
+        )
+    logger.info(f'Processing pipeline loaded in {time.perf_counter() - start:.2f}s')
+
+
+async def ensure_pipeline() -> None:
+    """
+    Load the processing pipeline if it is not loaded yet.
+
+    The first call starts loading it in a worker thread; concurrent callers wait
+    for the same load, and a cancelled caller does not cancel it.
+    """
+    global _pipeline_task
+    if llm_adapter is not None:
+        return
+    if _pipeline_task is None or (_pipeline_task.done() and _pipeline_task.exception() is not None):
+        _pipeline_task = asyncio.create_task(asyncio.to_thread(_load_pipeline))
+    await asyncio.shield(_pipeline_task)
+
+
+def _process(preprocessor: 'DataPreprocessor') -> 'ProcessedActivities':
+    """Process the stored activities and summarize them; blocking."""
+    with metrics.timed('process_run_data'):
+        preprocessor.process_run_data()
+    with metrics.timed('summary_statistics'):
+        preprocessor.calculate_summary_statistics()
+    return preprocessor.to_result()
+
+
+def _run_preprocessing(athlete_id: Optional[int], priority: Priority) -> 'ProcessedActivities':
+    """Fetch and process an athlete's activity data; blocking, runs in a worker thread."""
+    from app.data_preprocessing import DataPreprocessor
+
+    with strava_scheduler.priority(priority), metrics.timed('strava_fetch'):
+        preprocessor = DataPreprocessor(athlete_id=athlete_id)
+        preprocessor.fetch_activities()
+    return _process(preprocessor)
+
+
+def _ingest_and_process(preprocessor: 'DataPreprocessor', activity_ids: List[int]) -> 'ProcessedActivities':
+    """Fetch a webhook's activities by id and process them with the stored history; blocking."""
+    with strava_scheduler.priority(Priority.WEBHOOK), metrics.timed('activity_fetch'):
+        preprocessor.ingest_activities(activity_ids)
+    return _process(preprocessor)
+
+
+def _sync_history(preprocessor: 'DataPreprocessor') -> None:
+    """Sync an athlete's activity history for a webhook job; blocking."""
+    with strava_scheduler.priority(Priority.WEBHOOK), metrics.timed('strava_fetch'):
+        preprocessor.fetch_activities()
+
+
+async def _save_snapshot(result: 'ProcessedActivities', athlete_id: Optional[int]) -> None:
+    from app.data_preprocessing import write_snapshot
+
+    try:
+        with metrics.timed('snapshot_write'):
+            await asyncio.to_thread(write_snapshot, result, *snapshot_paths(athlete_id))
+    except Exception as e:
+        logger.error(f'Error saving activity snapshot: {str(e)}')
 
 
-async def process_activity_data() -> bool:
+async def process_activity_data(
+    athlete_id: Optional[int] = None,
+    priority: Priority = Priority.MANUAL
+) -> Optional['ProcessedActivities']:
     """
     Process activity data and generate statistics.
 
+    The result is handed straight to prompt formatting; when snapshots are
+    enabled it is also saved to disk in the background.
+
+    Args:
+        athlete_id: Strava athlete id, or None for the default athlete
+        priority: Priority of the Strava requests made for the sync
+
     Returns:
-        bool: True if processing successful, False otherwise
+        Optional[ProcessedActivities]: Processed result, or None if processing failed
+
+    Raises:
+        StravaBudgetExhausted: If the sync could not run within the Strava rate limit
     """
     try:
-        preprocessor = DataPreprocessor()
-        preprocessor.fetch_activities()
-        preprocessor.process_run_data()
-        preprocessor.calculate_summary_statistics()
-        preprocessor.save_to_json(
-            config.ACTIVITY_DATA_PATH,
-            config.SUMMARY_STATS_PATH
-        )
+        result = await asyncio.to_thread(_run_preprocessing, athlete_id, priority)
         logger.info('Activity data processed successfully')
-        return True
+    except StravaBudgetExhausted:
+        raise
     except Exception as e:
         logger.error(f'Error processing activity data: {str(e)}')
-        return False
+        return None
+
+    _schedule_snapshot(result, athlete_id)
+    return result
+
+
+def _schedule_snapshot(result: 'ProcessedActivities', athlete_id: Optional[int]) -> None:
+    if config.SNAPSHOT_ENABLED:
+        task = asyncio.create_task(_save_snapshot(result, athlete_id))
+        _snapshot_tasks.add(task)
+        task.add_done_callback(_snapshot_tasks.discard)
+
+
+async def process_webhook_activities(
+    athlete_id: Optional[int],
+    activity_ids: List[int]
+) -> Tuple[Optional['ProcessedActivities'], Optional[asyncio.Task]]:
+    """
+    Process a webhook's activities without waiting for the history sync.
+
+    The activities are fetched by id and processed with the stored history while
+    the history sync runs concurrently, so advice generation can start after one
+    Strava request. A first sync, with nothing stored yet, runs before processing
+    (see `process_activity_data`), as does the sync of a burst of more than
+    `config.WEBHOOK_FETCH_BY_ID_MAX` activities and every sync when
+    `config.WEBHOOK_FETCH_BY_ID` is off.
+
+    Args:
+        athlete_id: Strava athlete id, or None for the default athlete
+        activity_ids: Ids of the activities the webhook events are about
+
+    Returns:
+        Tuple of the processed result (None if processing failed) and the running
+        history sync, if one was started; await it with `finish_history_sync`
+
+    Raises:
+        StravaBudgetExhausted: If the activities could not be fetched within the Strava rate limit
+    """
+    from app.data_preprocessing import DataPreprocessor
+
+    if not config.WEBHOOK_FETCH_BY_ID or not 0 < len(activity_ids) <= config.WEBHOOK_FETCH_BY_ID_MAX:
+        return await process_activity_data(athlete_id, Priority.WEBHOOK), None
+    try:
+        preprocessor = await asyncio.to_thread(DataPreprocessor, athlete_id=athlete_id)
+        has_history = await asyncio.to_thread(preprocessor.store.count) > 0
+    except Exception as e:
+        logger.error(f'Error processing activity data: {str(e)}')
+        return None, None
+    if not has_history:
+        return await process_activity_data(athlete_id, Priority.WEBHOOK), None
+
+    history_sync = asyncio.create_task(asyncio.to_thread(_sync_history, preprocessor))
+    try:
+        result = await asyncio.to_thread(_ingest_and_process, preprocessor, activity_ids)
+        logger.info(f'Activities {activity_ids} fetched and processed; history sync running')
+    except StravaBudgetExhausted:
+        await finish_history_sync(history_sync)
+        raise
+    except Exception as e:
+        logger.error(f'Error processing activity data: {str(e)}')
+        return None, history_sync
+
+    _schedule_snapshot(result, athlete_id)
+    return result, history_sync
+
+
+async def finish_history_sync(history_sync: asyncio.Task) -> None:
+    """
+    Wait for a history sync started by `process_webhook_activities` and log how it ended.
+
+    A failed sync is not retried here: the sync floor saved when the activities
+    were fetched makes the next sync cover what this one missed.
+    """
+    try:
+        await history_sync
+        logger.info('Activity history synced')
+    except StravaBudgetExhausted as e:
+        logger.warning(f'Activity history sync deferred: {str(e)}')
+    except Exception as e:
+        logger.error(f'Error syncing activity history: {str(e)}')
+
+
+def build_advice_prompt(result: 'ProcessedActivities') -> str:
+    """
+    Build the advice prompt within the configured token budget and log its size.
+
+    Args:
+        result: Processed activities, statistics and training load
+
+    Returns:
+        str: Formatted prompt for the LLM
+    """
+    from app.prompt_handler import PromptHandler
+
+    with metrics.timed('prompt_build'):
+        build = PromptHandler(config.PROMPT_TEMPLATE_PATH).build_prompt(
+            result.activities,
+            result.summary_statistics,
+            result.training_load,
+            result.rollups,
+            result.stream_metrics,
+            result.similar_efforts
+        )
+    logger.info(
+        f'Prompt tokens: {build.token_count} '
+        f'({build.weekly_rows} weekly, {build.monthly_rows} monthly rollup rows, '
+        f'{build.similar_rows} similar efforts)'
+    )
+    if build.over_budget:
+        logger.warning(
+            f'Prompt of {build.token_count} tokens exceeds the {config.PROMPT_TOKEN_BUDGET}-token '
+            'budget with every optional section dropped'
+        )
+    return build.text
+
+
+def fallback_advice(result: 'ProcessedActivities') -> str:
+    """Summarize the processed activities without an LLM; the last-resort advice."""
+    from app.prompt_handler import template_advice as build_template_advice
+
+    return build_template_advice(result.activities, result.summary_statistics, result.training_load)
+
+
+async def run_advice_job(payload: Dict[str, Any]) -> None:
+    """
+    Generate and email advice for a burst of webhook events.
+
+    All activities in the burst are covered by one sync, one LLM call and one email.
+    The stages overlap: the burst's activities are fetched by id and the LLM starts
+    on them and the stored history while the history sync runs, the SMTP
+    connection is opened during generation, and the email body is assembled from
+    the token stream as it arrives. The job finishes once the sync has too.
+
+    Args:
+        payload: Burst payload (see `app.webhook_events`), or a single Strava
+            webhook payload queued before coalescing, with `athlete_id` added
+
+    Raises:
+        RetryLater: If the Strava rate limit is exhausted, to run the job after it resets
+        RuntimeError: If any stage fails, so the worker pool retries the job
+    """
+    athlete_id = payload.get('athlete_id')
+    activities = burst_activities(payload)
+    activity_ids = [activity.get('object_id') for activity in activities]
+    settings = (
+        athlete_registry.get(athlete_id) if athlete_id is not None
+        else AthleteSettings(athlete_id=None, email_receiver=None)
+    )
+    if settings is None or not settings.enabled:
+        logger.info(f'Skipping activities {activity_ids} of inactive athlete {athlete_id}')
+        return
+
+    logger.info(
+        f'Processing queued activities {activity_ids} '
+        f'({payload.get("events", len(activities))} events)...'
+    )
+    await ensure_pipeline()
+    history_sync = None
+    try:
+        try:
+            result, history_sync = await process_webhook_activities(
+                athlete_id, [activity_id for activity_id in activity_ids if activity_id]
+            )
+        except StravaBudgetExhausted as e:
+            raise RetryLater(e.retry_after, str(e))
+        if result is None:
+            raise RuntimeError('Failed to process activity data')
+
+        prompt = build_advice_prompt(result)
+        digest = config.EMAIL_DIGEST_SECONDS > 0
+        smtp_ready = None if digest else asyncio.create_task(email_handler.prepare())
+        chunks = []
+        async for chunk in llm_adapter.generate_summary_stream(
+            prompt, fallback=lambda: fallback_advice(result)
+        ):
+            chunks.append(chunk)
+        advice = ''.join(chunks)
+
+        subject = burst_subject(activities)
+        if digest:
+            await email_handler.enqueue(subject, advice, settings.email_receiver)
+            logger.info('Email queued for the next digest')
+            return
+        await smtp_ready
+        if not await email_handler.send_email(subject, advice, settings.email_receiver):
+            raise RuntimeError('Failed to send email')
+        logger.info('Email sent successfully')
+    finally:
+        if history_sync is not None:
+            await finish_history_sync(history_sync)
+        trace = metrics.current_trace()
+        if trace is not None:
+            metrics.STRAVA_REQUESTS_PER_JOB.observe(trace.strava_requests)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Initialize the stores and handlers and start the queue workers with the app;
+    on shutdown stop them, flush queued email and close clients.
+
+    The processing pipeline loads in the background, so webhooks are acknowledged
+    (and queued) while it loads; jobs wait for it. With `config.LAZY_STARTUP`
+    off, startup waits for it instead.
+    """
+    global email_handler, athlete_registry, job_queue, worker_pool, _pipeline_task
+    initialize_db()
+    email_handler = EmailHandler()
+    athlete_registry = AthleteRegistry(config.ATHLETE_REGISTRY_PATH)
+    job_queue = JobQueue(config.JOB_QUEUE_PATH)
+    worker_pool = WorkerPool(
+        job_queue,
+        run_advice_job,
+        workers=config.WEBHOOK_WORKERS,
+        max_attempts=config.JOB_MAX_ATTEMPTS,
+        retry_base_seconds=config.JOB_RETRY_BASE_SECONDS,
+        poll_interval_seconds=config.JOB_POLL_INTERVAL_SECONDS,
+    )
+    if config.LAZY_STARTUP:
+        asyncio.create_task(ensure_pipeline())
+    else:
+        await ensure_pipeline()
+    email_handler.start()
+    await worker_pool.start()
+    yield
+    await worker_pool.stop()
+    await email_handler.stop()
+    await advice_broadcaster.close()
+    if _pipeline_task is not None and not _pipeline_task.done():
+        _pipeline_task.cancel()
+        _pipeline_task = None
+    if llm_adapter is not None:
+        from app.llm_processor import close_http_client
+
+        await close_http_client()
+    close_db()
+
+
+
+def _budget_gauge(field: str) -> Dict[tuple, float]:
+    return {(name,): window[field] for name, window in strava_scheduler.status()['windows'].items()}
+
+
+metrics.CallbackGauge(
+    'workoutplan_strava_budget_remaining', 'Strava requests left in each rate-limit window', ['window'],
+    lambda: _budget_gauge('remaining')
+)
+metrics.CallbackGauge(
+    'workoutplan_strava_budget_limit', 'Strava request limit of each rate-limit window', ['window'],
+    lambda: _budget_gauge('limit')
+)
+metrics.CallbackGauge(
+    'workoutplan_queue_jobs', 'Webhook jobs in the queue, by state', ['state'],
+    lambda: {(state,): count for state, count in job_queue.stats().items()} if job_queue is not None else {}
+)
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(metrics.TraceMiddleware)
 
 @app.get('/strava-webhook')
 async def validate_strava_webhook(request: Request) -> JSONResponse:
@@ -104,7 +494,16 @@ async def validate_strava_webhook(request: Request) -> JSONResponse:
 @app.post('/strava-webhook')
 async def handle_strava_webhook(request: Request) -> JSONResponse:
     """
-    Handle incoming Strava webhook events and generate advice.
+    Handle incoming Strava webhook events by queueing advice generation.
+
+    New activities are written to the durable job queue and acknowledged
+    immediately; the worker pool generates and emails the advice. Each
+    activity is claimed atomically in the dedup store, so retried deliveries
+    are queued once. Events are routed by `owner_id` and coalesced into the
+    athlete's pending burst job, which runs after a debounce window: a burst
+    of uploads and edits costs one sync, one LLM call and one email.
+    Different athletes are processed in parallel and each athlete's bursts
+    in order.
 
     Args:
         request: FastAPI request object
@@ -116,13 +515,6 @@ async def handle_strava_webhook(request: Request) -> JSONResponse:
         payload = await request.json()
         activity_id = int(payload.get('object_id', 0))
 
-        if is_activity_processed(activity_id):
-            logger.info(f"Skipping already processed activity: {activity_id}")
-            return JSONResponse(
-                status_code=200,
-                content={'status': 'already processed'}
-            )
-
         logger.info('\n=== WEBHOOK PAYLOAD DETAILS ===')
         logger.info(f'Full payload: {payload}')
         logger.info(f'Time: {datetime.now()}')
@@ -133,39 +525,40 @@ async def handle_strava_webhook(request: Request) -> JSONResponse:
         logger.info(f'Updates: {payload.get("updates", {})}')
         logger.info('===============================\n')
         
-        if (payload.get('object_type') == 'activity' and 
-                payload.get('aspect_type') == 'create'):
-            
-            logger.info('Processing new activity creation...')
-            mark_activity_processed(activity_id)
-
-            if await process_activity_data():
-                try:
-                    with open(config.ACTIVITY_DATA_PATH, 'r') as file:
-                        activity_data = json.load(file)
-                    with open(config.SUMMARY_STATS_PATH, 'r') as file:
-                        summary_statistics = json.load(file)
-
-                    prompt_handler = PromptHandler(config.PROMPT_TEMPLATE_PATH)
-                    prompt = prompt_handler.format_prompt(
-                        activity_data,
-                        summary_statistics
-                    )
-                    llm_adapter = LLMAdapter(model_name=config.MODEL_NAME)
-                    advice = llm_adapter.generate_summary(prompt)
-
-                    subject = 'New Workout Advice Available!'
-                    if await email_handler.send_email(subject, advice):
-                        logger.info('Email sent successfully')
-                        return JSONResponse(
-                            status_code=200,
-                            content={'status': 'processed'}
-                        )
-                    logger.error('Failed to send email')
-                    
-                except Exception as e:
-                    logger.error(f'Error generating advice: {str(e)}')
-            
+        if payload.get('object_type') == 'activity':
+            settings = athlete_registry.resolve(payload.get('owner_id'))
+            if settings is None:
+                logger.info(f'Ignoring activity of unknown athlete {payload.get("owner_id")}')
+                return JSONResponse(status_code=200, content={'status': 'unknown athlete'})
+
+            is_create = payload.get('aspect_type') == 'create'
+            if is_create and not claim_activity(activity_id):
+                logger.info(f"Skipping already processed activity: {activity_id}")
+                return JSONResponse(
+                    status_code=200,
+                    content={'status': 'already processed'}
+                )
+
+            trace = metrics.current_trace()
+            trace_id = trace.trace_id if trace is not None else None
+            try:
+                outcome = job_queue.coalesce(
+                    partition_key(settings.athlete_id),
+                    f'activity:{activity_id}:create',
+                    lambda burst: merge_event(burst, payload, settings.athlete_id, trace_id),
+                    debounce_seconds=config.WEBHOOK_DEBOUNCE_SECONDS,
+                    max_delay_seconds=config.WEBHOOK_DEBOUNCE_MAX_SECONDS,
+                )
+            except Exception:
+                if is_create:
+                    release_activity(activity_id)
+                raise
+            if outcome == 'created':
+                worker_pool.notify()
+            logger.info(f'Activity {activity_id} {payload.get("aspect_type")} event: {outcome}')
+            if outcome in ('created', 'merged'):
+                return JSONResponse(status_code=200, content={'status': 'queued'})
+
         return JSONResponse(status_code=200, content={'status': 'received'})
     except Exception as e:
         logger.error(f'Webhook error: {str(e)}')
@@ -175,54 +568,223 @@ async def handle_strava_webhook(request: Request) -> JSONResponse:
 
     
 
+@app.get('/queue-status')
+async def queue_status() -> JSONResponse:
+    """
+    Report webhook job queue depth and in-flight jobs.
+
+    Returns:
+        JSONResponse: Pending, running and dead-lettered job counts
+    """
+    status = await asyncio.to_thread(worker_pool.status)
+    return JSONResponse(content=status)
+
+
+@app.get('/cache-status')
+async def cache_status() -> JSONResponse:
+    """
+    Report advice cache hit/miss counters and size.
+
+    Returns:
+        JSONResponse: Hits, misses, entry count and bytes stored
+    """
+    await ensure_pipeline()
+    stats = await asyncio.to_thread(advice_cache.stats)
+    return JSONResponse(content=stats)
+
+
+@app.get('/strava-budget')
+async def strava_budget() -> JSONResponse:
+    """
+    Report the Strava API rate-limit budget.
+
+    Returns:
+        JSONResponse: Usage and remaining requests per quota window, plus
+        requests sent, waiting and deferred per priority
+    """
+    return JSONResponse(content=strava_scheduler.status())
+
+
+@app.get('/metrics')
+async def metrics_endpoint() -> Response:
+    """
+    Expose pipeline, LLM, Strava and queue metrics for Prometheus.
+
+    Returns:
+        Response: Metrics in the Prometheus text exposition format
+    """
+    text = await asyncio.to_thread(metrics.render)
+    return Response(text, media_type=metrics.CONTENT_TYPE_LATEST)
+
+
+@app.get('/training-load')
+async def training_load(athlete_id: Optional[int] = Query(default=None)) -> JSONResponse:
+    """
+    Report an athlete's current training-load metrics.
+
+    Args:
+        athlete_id: Strava athlete id, or omitted for the default athlete
+
+    Returns:
+        JSONResponse: ATL, CTL, TSB, acute:chronic workload ratio and mileage
+    """
+    tracker = TrainingLoadTracker(activity_store_path(athlete_id), athlete_id or 0)
+    load = await asyncio.to_thread(tracker.metrics)
+    return JSONResponse(content=load)
+
+
+@app.get('/aggregates')
+async def activity_aggregates(
+    athlete_id: Optional[int] = Query(default=None),
+    type: Optional[str] = Query(default=None),
+    period: str = Query(default='lifetime'),
+    bucket: Optional[str] = Query(default=None),
+    limit: int = Query(default=12, ge=1, le=520)
+) -> JSONResponse:
+    """
+    Report an athlete's per-sport activity aggregates.
+
+    Args:
+        athlete_id: Strava athlete id, or omitted for the default athlete
+        type: Activity type, e.g. 'Run', or omitted for every type
+        period: 'lifetime', 'week', 'month' or 'rolling'
+        bucket: Week ('YYYY-MM-DD', the Monday), month ('YYYY-MM') or rolling window
+            ('28d'). Omitted for week or month with a type: the latest `limit` buckets
+        limit: Number of buckets returned for a series
+
+    Returns:
+        JSONResponse: Count, total, mean and standard deviation per metric
+    """
+    if period not in PERIODS:
+        raise HTTPException(status_code=400, detail=f"period must be one of {', '.join(PERIODS)}")
+    aggregates = ActivityAggregates(activity_store_path(athlete_id), athlete_id or 0)
+    if bucket is None and type is not None and period in ('week', 'month'):
+        series = await asyncio.to_thread(aggregates.series, type, period, limit)
+        return JSONResponse(content=series)
+    if bucket is None:
+        bucket = f'{config.AGGREGATE_WINDOWS_DAYS[0]}d' if period == 'rolling' else ''
+    stats = await asyncio.to_thread(aggregates.get, type, period, bucket)
+    return JSONResponse(content=stats)
+
+
+async def _open_advice_stream(athlete_id: Optional[int]) -> AsyncGenerator[str, None]:
+   """Process an athlete's latest activity data and start streaming advice on it."""
+   await ensure_pipeline()
+   result = await process_activity_data(athlete_id)
+   if result is None:
+       raise RuntimeError('Failed to process activity data')
+   prompt = build_advice_prompt(result)
+   logger.info('Streaming advice started')
+   return llm_adapter.generate_summary_stream(prompt, fallback=lambda: fallback_advice(result))
+
+
+async def _shared_advice(athlete_id: Optional[int]) -> SharedGeneration:
+   """
+   Attach to the athlete's running advice generation, starting one if there is none.
+
+   The generation belongs to no single request: it runs to the end, and is cached,
+   even if the request that started it disconnects.
+
+   Raises:
+       HTTPException: 503 if the Strava rate limit is exhausted, 500 if processing failed
+   """
+   generation = advice_broadcaster.subscribe(
+       ('advice', athlete_id), lambda: _open_advice_stream(athlete_id)
+   )
+   try:
+       await generation.opened()
+   except StravaBudgetExhausted as e:
+       logger.warning(f'Deferring stream_advice: {str(e)}')
+       raise HTTPException(
+           status_code=503,
+           detail=str(e),
+           headers={'Retry-After': str(int(e.retry_after))}
+       )
+   except Exception as e:
+       logger.error(f'Error in stream_advice: {str(e)}')
+       raise HTTPException(status_code=500, detail=str(e))
+   return generation
+
+
 @app.get('/stream_advice')
-async def stream_advice() -> StreamingResponse:
+async def stream_advice(athlete_id: Optional[int] = Query(default=None)) -> StreamingResponse:
    """
    Stream fitness advice based on processed data and summary statistics.
 
+   Concurrent requests for the same athlete share one generation; a request that
+   joins late first receives the advice generated so far.
+   If the generation fails part-way, the response is cut off instead of ending
+   normally, so clients can tell the advice is incomplete.
+
+   Args:
+       athlete_id: Strava athlete id, or omitted for the default athlete
+
    Returns:
        StreamingResponse: Real-time stream of generated advice tokens
    
    Raises:
        HTTPException: If error occurs during processing or generation
    """
-   try:
-       # Process latest activity data
-       await process_activity_data()
-
-       # Load processed data
-       with open(config.ACTIVITY_DATA_PATH, 'r') as file:
-           activity_data = json.load(file)
-       with open(config.SUMMARY_STATS_PATH, 'r') as file:
-           summary_statistics = json.load(file)
-
-       # Generate and stream advice
-       prompt_handler = PromptHandler(config.PROMPT_TEMPLATE_PATH)
-       prompt = prompt_handler.format_prompt(
-           activity_data,
-           summary_statistics
-       )
-       llm_adapter = LLMAdapter(model_name=config.MODEL_NAME)
-       
-       async def advice_stream():
-           async for token in llm_adapter.generate_summary_stream(prompt):
-               yield token
-
-       logger.info('Streaming advice started')
-       return StreamingResponse(
-           advice_stream(),
-           media_type='text/plain'
-       )
-   except Exception as e:
-       logger.error(f'Error in stream_advice: {str(e)}')
-       raise HTTPException(status_code=500, detail=str(e))
+   generation = await _shared_advice(athlete_id)
+   return StreamingResponse(
+       generation.follow(),
+       media_type='text/plain'
+   )
+
+
+def _sse_event(data: str, event: Optional[str] = None) -> str:
+   """Format a server-sent event; each line of `data` becomes a `data:` field."""
+   fields = [f'event: {event}'] if event else []
+   fields += [f'data: {line}' for line in data.split('\n')]
+   return '\n'.join(fields) + '\n\n'
+
+
+@app.get('/stream_advice/events')
+async def stream_advice_events(athlete_id: Optional[int] = Query(default=None)) -> StreamingResponse:
+   """
+   Stream fitness advice as server-sent events.
+
+   Shares generations with `/stream_advice`. Each `message` event carries the text
+   generated since the previous one, so a slow client receives fewer, larger
+   events instead of holding back the generation. A comment line is sent after
+   `config.SSE_HEARTBEAT_SECONDS` without text, and a `done` event ends the stream,
+   or an `error` event if the generation failed part-way.
+
+   Args:
+       athlete_id: Strava athlete id, or omitted for the default athlete
+
+   Returns:
+       StreamingResponse: `text/event-stream` of generated advice
+
+   Raises:
+       HTTPException: If error occurs during processing or generation
+   """
+   generation = await _shared_advice(athlete_id)
+
+   async def events():
+       try:
+           async for batch in generation.follow(heartbeat_seconds=config.SSE_HEARTBEAT_SECONDS):
+               yield ': heartbeat\n\n' if batch is None else _sse_event(batch)
+       except Exception as e:
+           yield _sse_event(str(e) or type(e).__name__, event='error')
+           return
+       yield _sse_event('', event='done')
+
+   return StreamingResponse(
+       events(),
+       media_type='text/event-stream',
+       headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+   )
 
 
 @app.get('/webhook-test')
-async def test_webhook() -> JSONResponse:
+async def test_webhook(athlete_id: Optional[int] = Query(default=None)) -> JSONResponse:
    """
    Test endpoint to simulate a Strava webhook event.
 
+   Args:
+       athlete_id: Strava athlete id, or omitted for the default athlete
+
    Returns:
        JSONResponse: Status and generated advice if successful
    
@@ -231,25 +793,18 @@ async def test_webhook() -> JSONResponse:
    """
    try:
        logger.info('Starting webhook test...')
+       await ensure_pipeline()
        
        # Process activity data
-       if await process_activity_data():
+       result = await process_activity_data(athlete_id)
+       if result is not None:
            try:
-               # Load data and generate advice
-               with open(config.ACTIVITY_DATA_PATH, 'r') as file:
-                   activity_data = json.load(file)
-               with open(config.SUMMARY_STATS_PATH, 'r') as file:
-                   summary_statistics = json.load(file)
-
-               prompt_handler = PromptHandler(config.PROMPT_TEMPLATE_PATH)
-               prompt = prompt_handler.format_prompt(
-                   activity_data,
-                   summary_statistics
-               )
-               llm_adapter = LLMAdapter(model_name=config.MODEL_NAME)
-               
+               # Generate advice
+               prompt = build_advice_prompt(result)
                advice = ''
-               async for token in llm_adapter.generate_summary_stream(prompt):
+               async for token in llm_adapter.generate_summary_stream(
+                   prompt, fallback=lambda: fallback_advice(result)
+               ):
                    advice += token
                
                logger.info('Test webhook advice generated:')
@@ -285,4 +840,6 @@ async def test_webhook() -> JSONResponse:
 
 
 if __name__ == '__main__':
+   import uvicorn
+
    uvicorn.run(app, host='0.0.0.1', port=8000)
\ No newline at end of file
@@ -0,0 +1,66 @@
+"""Shared fixtures: offline activity stores built from the benchmarks' synthetic history, and a fake LLM."""
+
+import asyncio
+import sys
+from pathlib import Path
+
+import pytest
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO_ROOT))
+
+from app.activity_store import ActivityStore
+from benchmarks.fakes import SyntheticHistory
+
+
+class FakeAdapter:
+    """Streams `chunks`, then raises `error` if given; completes with their text."""
+
+    def __init__(self, model_name, chunks=('Easy ', 'run.'), error=None, delay=0.0, temperature=0.7):
+        self.model_name = model_name
+        self.chunks = list(chunks)
+        self.error = error
+        self.delay = delay
+        self.temperature = temperature
+        self.timeout = 5.0
+        self.calls = 0
+
+    async def complete(self, prompt):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        return ''.join(self.chunks)
+
+    async def stream(self, prompt):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        for chunk in self.chunks:
+            yield chunk
+        if self.error is not None:
+            raise self.error
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """Run the test in an empty directory, so relative data paths stay inside it."""
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'data').mkdir()
+    return tmp_path
+
+
+@pytest.fixture
+def history_store(workdir):
+    """An activity store holding 300 synthetic activities of athlete 1."""
+    store = ActivityStore(str(workdir / 'data' / 'activities.db'))
+    store.upsert_activities(SyntheticHistory(1, 300).store_records())
+    return store
+
+
+@pytest.fixture
+def offline_preprocessor(monkeypatch):
+    """Build `DataPreprocessor`s without Strava tokens."""
+    import app.data_preprocessing as data_preprocessing
+
+    monkeypatch.setattr(data_preprocessing, 'get_strava_client', lambda athlete_id=None: None)
+    return data_preprocessing.DataPreprocessor
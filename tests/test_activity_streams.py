@@ -0,0 +1,24 @@
+import os
+
+import numpy as np
+
+import app.activity_streams as activity_streams
+from app.activity_streams import StreamStore
+
+
+def test_concurrent_save_of_the_same_activity_keeps_one_copy(tmp_path, monkeypatch):
+    store = StreamStore(str(tmp_path / 'streams'))
+    replace = os.replace
+
+    def replace_after_another_writer(src, dst):
+        # Another worker's copy lands between our rmtree and our rename.
+        other = StreamStore(store.root)
+        monkeypatch.setattr(activity_streams.os, 'replace', replace)
+        other.save(1, {'time': np.arange(3, dtype=np.float32)})
+        replace(src, dst)
+
+    monkeypatch.setattr(activity_streams.os, 'replace', replace_after_another_writer)
+    store.save(1, {'time': np.arange(5, dtype=np.float32)})
+
+    assert len(store.load(1)['time']) == 3
+    assert [name for name in os.listdir(store.root) if name.startswith('.tmp-')] == []
@@ -0,0 +1,103 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+import app.training_load as training_load
+from app.advice_cache import AdviceCache, CachingLLMAdapter
+from app.training_load import DAY_SECONDS
+from tests.conftest import FakeAdapter
+from tests.test_prompt_handler import _prompt, _result
+
+
+def _cache(workdir, name='cache.db', **kwargs):
+    settings = dict(ttl_seconds=3600, max_entries=10, max_bytes=10**6)
+    settings.update(kwargs)
+    return AdviceCache(str(workdir / 'data' / name), **settings)
+
+
+async def _collect(stream):
+    return [chunk async for chunk in stream]
+
+
+def test_repeated_prompt_is_served_from_the_cache(workdir):
+    cache = _cache(workdir)
+    adapter = FakeAdapter('model', chunks=('Easy ', 'run ', 'today.'))
+    cached = CachingLLMAdapter(adapter, cache)
+
+    assert asyncio.run(_collect(cached.stream('prompt'))) == ['Easy ', 'run ', 'today.']
+    # Replays keep the original chunking; complete() shares the entry.
+    assert asyncio.run(_collect(cached.stream('prompt'))) == ['Easy ', 'run ', 'today.']
+    assert asyncio.run(cached.complete('prompt')) == 'Easy run today.'
+    assert adapter.calls == 1
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['entries']) == (2, 1, 1)
+
+
+def test_key_covers_model_and_temperature(workdir):
+    cache = _cache(workdir)
+    keys = {
+        cache.make_key('prompt', 'model', 0.7),
+        cache.make_key('prompt', 'model', 0.2),
+        cache.make_key('prompt', 'other', 0.7),
+        cache.make_key('prompt ', 'model', 0.7),
+    }
+    assert len(keys) == 4
+    assert cache.make_key('prompt', 'model', 0.7) == cache.make_key('prompt', 'model', 0.7)
+
+
+def test_failed_generation_is_not_cached(workdir):
+    cache = _cache(workdir)
+    adapter = FakeAdapter('model', error=OSError('503'))
+    cached = CachingLLMAdapter(adapter, cache)
+
+    assert asyncio.run(cached.generate_summary('prompt')) == 'Error: 503'
+    adapter.error = None
+    assert asyncio.run(cached.generate_summary('prompt')) == 'Easy run.'
+    assert adapter.calls == 2
+
+
+def test_expired_entries_are_misses(workdir):
+    cache = _cache(workdir, ttl_seconds=0.05)
+    cache.put('key', ['advice'])
+    assert cache.get('key') == ['advice']
+    time.sleep(0.1)
+    assert cache.get('key') is None
+
+
+def test_least_recently_used_entries_are_evicted(workdir):
+    cache = _cache(workdir, max_entries=2)
+    for key in ('a', 'b'):
+        cache.put(key, [key])
+        time.sleep(0.01)
+    cache.get('a')
+    time.sleep(0.01)
+    cache.put('c', ['c'])
+    assert [cache.get(key) for key in ('a', 'b', 'c')] == [['a'], None, ['c']]
+
+
+def test_entries_over_the_size_cap_are_evicted_oldest_first(workdir):
+    cache = _cache(workdir, max_bytes=len('["advice"]') * 2)
+    for key in ('a', 'b', 'c'):
+        cache.put(key, ['advice'])
+        time.sleep(0.01)
+    assert [cache.get(key) for key in ('a', 'b', 'c')] == [None, ['advice'], ['advice']]
+    assert cache.stats()['bytes'] == len('["advice"]') * 2
+
+
+def test_unchanged_data_hits_the_cache(workdir, history_store, offline_preprocessor, monkeypatch):
+    # Regression: the training load was evaluated at the current time, so its
+    # decaying values changed the prompt within minutes of unchanged data.
+    cache = _cache(workdir)
+    adapter = FakeAdapter('model')
+    cached = CachingLLMAdapter(adapter, cache)
+
+    offline_preprocessor(store=history_store, athlete_id=1)._ensure_derived_state()
+    tomorrow = time.time() // DAY_SECONDS * DAY_SECONDS + DAY_SECONDS
+    for hours in (1, 13):
+        monkeypatch.setattr(training_load, 'time', SimpleNamespace(time=lambda: tomorrow + hours * 3600))
+        result = _result(offline_preprocessor, history_store)
+        assert result.training_load['acute_training_load'] > 0
+        prompt = _prompt(result)
+        assert asyncio.run(cached.generate_summary(prompt)) == 'Easy run.'
+    assert adapter.calls == 1
+    assert cache.stats()['hits'] == 1
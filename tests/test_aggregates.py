@@ -0,0 +1,65 @@
+import math
+import statistics
+
+from app.aggregates import ActivityAggregates
+from app.training_load import DAY_SECONDS, start_timestamp
+
+
+def _records(store):
+    return [record for chunk in store.iter_activities(1000) for record in chunk]
+
+
+def _aggregates(store):
+    return ActivityAggregates(store.db_path, 1, windows_days=(7, 28))
+
+
+def test_incremental_aggregates_match_the_data(history_store):
+    records = _records(history_store)
+    aggregates = _aggregates(history_store)
+    for start in range(0, len(records), 50):
+        aggregates.apply(records[start:start + 50])
+
+    distances = [record['distance'] / 1000 for record in records if record['type'] == 'Run']
+    stats = aggregates.get('Run')['Run']['distance_km']
+    assert stats['n'] == len(distances)
+    assert math.isclose(stats['mean'], statistics.fmean(distances))
+    assert math.isclose(stats['std'], statistics.stdev(distances))
+    assert aggregates.verify(history_store.iter_activities(100)) == []
+
+
+def test_edits_and_deletions_replace_their_contribution(history_store):
+    records = _records(history_store)
+    aggregates = _aggregates(history_store)
+    aggregates.apply(records)
+    assert aggregates.apply(records) == 0  # Unchanged records are skipped.
+
+    edited = [dict(records[0], distance=records[0]['distance'] * 3), dict(records[1], type='Hike' if records[1]['type'] != 'Hike' else 'Run')]
+    history_store.upsert_activities(edited)
+    assert aggregates.apply(edited) == 2
+    history_store.delete_activities([records[2]['id']])
+    assert aggregates.remove([records[2]['id']]) == 1
+    assert aggregates.verify(history_store.iter_activities(100)) == []
+
+
+def test_rolling_windows_advance_without_a_rebuild(history_store):
+    records = _records(history_store)
+    newest = max(start_timestamp(record) for record in records)
+    aggregates = _aggregates(history_store)
+    aggregates.apply(records, now=newest)
+    window = aggregates.get(None, 'rolling', '28d', now=newest)
+
+    later = newest + 10 * DAY_SECONDS
+    assert aggregates.verify(history_store.iter_activities(100), now=later) == []
+    assert aggregates.get(None, 'rolling', '28d', now=later) != window
+
+
+def test_rebuild_replaces_drifted_aggregates(history_store):
+    records = _records(history_store)
+    aggregates = _aggregates(history_store)
+    aggregates.apply(records[:100])
+    # Activities written without updating the aggregates, e.g. by an older version.
+    assert aggregates.verify(history_store.iter_activities(100))
+
+    assert aggregates.rebuild(history_store.iter_activities(100)) == len(records)
+    assert aggregates.verify(history_store.iter_activities(100)) == []
+    assert aggregates.apply(records) == 0
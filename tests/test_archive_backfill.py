@@ -0,0 +1,37 @@
+from app.activity_store import ActivityStore
+from app.activity_streams import StreamStore
+from app.archive_backfill import backfill_archive
+from app.athletes import activity_store_path, streams_dir
+
+HEADER = 'Activity ID,Activity Date,Activity Name,Activity Type,Distance,Moving Time,Filename\n'
+
+
+def _gpx(points):
+    trkpts = ''.join(
+        f'<trkpt lat="{52 + n * 0.0001}" lon="13"><time>2024-03-0{day}T07:{n:02d}:00Z</time></trkpt>'
+        for day, n in points
+    )
+    return f'<gpx xmlns="http://www.topografix.com/GPX/1/1"><trk><trkseg>{trkpts}</trkseg></trk></gpx>'
+
+
+def test_archive_is_loaded_batch_by_batch(workdir):
+    archive = workdir / 'export'
+    (archive / 'activities').mkdir(parents=True)
+    rows = []
+    for day in range(1, 6):
+        name = f'activities/{day}.gpx'
+        (archive / name).write_text(_gpx([(day, n) for n in range(10)]))
+        # Older exports leave distance empty; the track fills it in.
+        rows.append(f'{day},"Mar {day}, 2024, 7:00:00 AM",Run {day},Run,,540,{name}\n')
+    rows.append('6,"Mar 6, 2024, 7:00:00 AM",Swim,Swim,1500,1800,\n')
+    # Rows are not in date order in the export.
+    (archive / 'activities.csv').write_text(HEADER + ''.join(reversed(rows)))
+
+    stats = backfill_archive(str(archive), athlete_id=7, workers=1, batch_size=2, stream_runs=2)
+
+    assert stats == {'activities': 6, 'tracks': 5, 'streams': 2}
+    records = {record['id']: record for record in ActivityStore(activity_store_path(7)).load_activities()}
+    assert set(records) == {1, 2, 3, 4, 5, 6}
+    assert all(records[day]['distance'] > 0 for day in range(1, 6))
+    streams = StreamStore(streams_dir(7))
+    assert [day for day in range(1, 6) if streams.has(day)] == [4, 5]
@@ -0,0 +1,107 @@
+import asyncio
+
+import pytest
+
+from app.broadcast import GenerationBroadcaster
+
+
+class Generation:
+    """Yields `chunks` as `release()` is called, then raises `error` if given."""
+
+    def __init__(self, chunks, error=None):
+        self.chunks = chunks
+        self.error = error
+        self.starts = 0
+        self._next = asyncio.Semaphore(0)
+
+    def release(self, count=1):
+        for _ in range(count):
+            self._next.release()
+
+    async def start(self):
+        self.starts += 1
+        return self._stream()
+
+    async def _stream(self):
+        for chunk in self.chunks:
+            await self._next.acquire()
+            yield chunk
+        if self.error is not None:
+            raise self.error
+
+
+async def _text(generation):
+    await generation.opened()
+    return ''.join([batch async for batch in generation.follow()])
+
+
+def test_concurrent_requests_share_one_generation():
+    async def scenario():
+        broadcaster = GenerationBroadcaster()
+        source = Generation(['Easy ', 'run ', 'today.'])
+        early = broadcaster.subscribe('athlete-1', source.start)
+        reader = asyncio.create_task(_text(early))
+        source.release(2)
+        await asyncio.sleep(0.01)
+
+        late = broadcaster.subscribe('athlete-1', source.start)
+        assert late is early
+        late_reader = asyncio.create_task(_text(late))
+        source.release()
+        texts = await asyncio.gather(reader, late_reader)
+
+        # Once finished, the key is free for a new generation.
+        await asyncio.sleep(0)
+        again = Generation(['Rest.'])
+        assert broadcaster.subscribe('athlete-1', again.start) is not early
+        again.release()
+        await broadcaster.close()
+        return texts, source.starts
+
+    texts, starts = asyncio.run(scenario())
+    assert texts == ['Easy run today.', 'Easy run today.']
+    assert starts == 1
+
+
+def test_failure_part_way_reaches_every_subscriber_after_the_chunks():
+    async def scenario():
+        broadcaster = GenerationBroadcaster()
+        source = Generation(['Easy '], error=OSError('connection reset'))
+        subscribers = [broadcaster.subscribe('athlete-1', source.start) for _ in range(2)]
+        source.release()
+        outcomes = []
+        for generation in subscribers:
+            received = []
+            with pytest.raises(OSError):
+                async for batch in generation.follow():
+                    received.append(batch)
+            outcomes.append(received)
+        return outcomes
+
+    assert asyncio.run(scenario()) == [['Easy '], ['Easy ']]
+
+
+def test_failure_to_start_is_raised_by_opened():
+    async def scenario():
+        async def start():
+            raise ValueError('no activities')
+
+        generation = GenerationBroadcaster().subscribe('athlete-1', start)
+        with pytest.raises(ValueError):
+            await generation.opened()
+
+    asyncio.run(scenario())
+
+
+def test_slow_subscriber_gets_batches_without_holding_back_the_generation():
+    async def scenario():
+        broadcaster = GenerationBroadcaster()
+        source = Generation([f'{n} ' for n in range(5)])
+        generation = broadcaster.subscribe('athlete-1', source.start)
+        await generation.opened()
+        source.release(5)
+        await asyncio.sleep(0.01)
+        assert generation.done  # Nobody has read anything yet.
+        return [batch async for batch in generation.follow()]
+
+    assert asyncio.run(scenario()) == ['0 1 2 3 4 ']
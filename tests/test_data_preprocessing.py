@@ -0,0 +1,158 @@
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import app.data_preprocessing as data_preprocessing
+import config
+from app.activity_store import ActivityStore
+from app.training_load import start_timestamp
+from benchmarks.fakes import SyntheticHistory
+
+
+def _start(record):
+    return datetime.strptime(record['start_date'], '%Y-%m-%dT%H:%M:%SZ').replace(tzinfo=timezone.utc)
+
+
+class FakeClient:
+    """Serves `get_activity` and `get_activities` from store records."""
+
+    def __init__(self, records):
+        self.records = {record['id']: record for record in records}
+
+    def get_activity(self, activity_id):
+        return self.records[activity_id]
+
+    def get_activities(self, after):
+        return iter(sorted(
+            (record for record in self.records.values() if _start(record) > after), key=_start
+        ))
+
+
+class RestartingIterator:
+    """Starts over once exhausted, like stravalib's `BatchedResultsIterator`."""
+
+    def __init__(self, items):
+        self.items = items
+        self.position = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.position == len(self.items):
+            self.position = 0
+            raise StopIteration
+        self.position += 1
+        return self.items[self.position - 1]
+
+
+@pytest.fixture
+def ingest_setup(workdir, offline_preprocessor, monkeypatch):
+    """A preprocessor over 299 stored activities whose client serves a newer run."""
+    monkeypatch.setattr(config, 'STREAMS_ENABLED', False)
+    monkeypatch.setattr(data_preprocessing, 'activity_to_record', lambda activity: dict(activity))
+    records = SyntheticHistory(1, 300).store_records()
+    latest = dict(records.pop(), type='Run', distance=10_000.0, average_heartrate=150.0, max_heartrate=175)
+    store = ActivityStore(str(workdir / 'data' / 'activities.db'))
+    store.upsert_activities(records)
+    preprocessor = offline_preprocessor(store=store, athlete_id=1)
+    preprocessor.client = FakeClient([latest])
+    preprocessor._ensure_derived_state()  # As the sync that stored the history did
+    return preprocessor, latest
+
+
+def _run_count(preprocessor):
+    return int(preprocessor.calculate_summary_statistics()['total_activities'][0])
+
+
+def test_ingested_activities_reach_the_aggregates_and_training_load(ingest_setup):
+    preprocessor, latest = ingest_setup
+    now = time.time()
+    runs = _run_count(preprocessor)
+    weekly = preprocessor.training_load.metrics(now)['weekly_distance_km']
+
+    assert preprocessor.ingest_activities([latest['id']]) == [latest]
+    assert _run_count(preprocessor) == runs + 1
+    assert preprocessor.training_load.metrics(now)['weekly_distance_km'] == pytest.approx(weekly + 10.0)
+
+
+def test_history_sync_applying_ingested_activities_again_changes_nothing(ingest_setup):
+    preprocessor, latest = ingest_setup
+    preprocessor.ingest_activities([latest['id']])
+    now = time.time()
+    runs = _run_count(preprocessor)
+    load = preprocessor.training_load.metrics(now)
+
+    # The sync fetches the ingested activity again, possibly while the ingest still runs.
+    threads = [threading.Thread(target=preprocessor._apply_derived, args=([latest],)) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert _run_count(preprocessor) == runs
+    assert preprocessor.training_load.metrics(now) == load
+    assert preprocessor.aggregates.verify(preprocessor.store.iter_activities(config.PROCESS_CHUNK_SIZE)) == []
+
+
+def test_sync_picks_up_activities_uploaded_late_with_an_earlier_start(ingest_setup):
+    preprocessor, _ = ingest_setup
+    stored = list(preprocessor.store.iter_activities(1000))[0]
+    newest = max(stored, key=_start)
+    late = dict(newest, id=newest['id'] + 1000, start_date=(_start(newest) - timedelta(hours=12)).strftime(
+        '%Y-%m-%dT%H:%M:%SZ'
+    ))
+    preprocessor.client = FakeClient(stored + [late])
+
+    preprocessor.sync_activities()
+    assert late['id'] in preprocessor.store.activity_ids_since(_start(late) - timedelta(seconds=1))
+
+
+def test_chunked_stops_before_a_restarting_iterator_starts_over():
+    for count in (0, 3, 4, 5):
+        chunks = list(data_preprocessing._chunked(RestartingIterator(list(range(count))), 2))
+        assert [item for chunk in chunks for item in chunk] == list(range(count))
+
+
+def test_failed_stream_write_does_not_fail_the_sync(ingest_setup, monkeypatch):
+    preprocessor, _ = ingest_setup
+    run_ids = preprocessor.store.recent_ids('Run', 2)
+    preprocessor.client.get_activity_streams = lambda activity_id, types: {'time': {'data': [0, 1, 2]}}
+    save = preprocessor.streams.save
+
+    def save_or_fail(activity_id, arrays):
+        if activity_id == run_ids[0]:
+            raise OSError(39, 'Directory not empty')
+        save(activity_id, arrays)
+
+    monkeypatch.setattr(preprocessor.streams, 'save', save_or_fail)
+    assert preprocessor.sync_streams(recent_runs=2) == 1
+    assert preprocessor.streams.has(run_ids[1]) and not preprocessor.streams.has(run_ids[0])
+
+
+def test_rollups_sum_the_stored_runs_of_each_week_but_the_latest(history_store, offline_preprocessor):
+    preprocessor = offline_preprocessor(store=history_store, athlete_id=1)
+    run_df = preprocessor.process_run_data(recent_limit=5)
+    assert len(run_df) == 5
+
+    runs = [record for records in history_store.iter_activities() for record in records if record['type'] == 'Run']
+    latest_id = int(run_df.iloc[0]['id'])
+    weeks = {}
+    for record in runs:
+        if record['id'] == latest_id:
+            continue
+        day = datetime.fromtimestamp(start_timestamp(record), tz=timezone.utc).date()
+        week = weeks.setdefault((day - timedelta(days=day.weekday())).isoformat(), [0, 0.0])
+        week[0] += 1
+        week[1] += record['distance'] / 1000
+
+    rows = preprocessor.rollups.weekly
+    assert 0 < len(rows) <= config.PROMPT_WEEKLY_ROLLUP_WEEKS
+    for row in rows:
+        week, count, km = row.split('|')[:3]
+        assert (int(count), km) == (weeks[week][0], f'{weeks[week][1]:.1f}')
+    assert [row.split('|')[0] for row in rows] == sorted(weeks, reverse=True)[:len(rows)]
+    oldest_week = rows[-1].split('|')[0]
+    assert all(row.split('|')[0] < oldest_week[:7] for row in preprocessor.rollups.monthly)
@@ -0,0 +1,67 @@
+import sqlite3
+import threading
+
+from utils.db_configs import DedupStore
+
+
+def test_each_activity_is_claimed_once(tmp_path):
+    path = str(tmp_path / 'processed.db')
+    first, second = DedupStore(path), DedupStore(path)  # E.g. two uvicorn workers
+
+    assert first.claim(1)
+    assert not first.claim(1)
+    assert not second.claim(1)
+    assert second.is_processed(1) and not second.is_processed(2)
+
+
+def test_concurrent_claims_have_one_winner(tmp_path):
+    path = str(tmp_path / 'processed.db')
+    stores = [DedupStore(path) for _ in range(4)]
+    results = []
+    barrier = threading.Barrier(len(stores))
+
+    def claim(store):
+        barrier.wait()
+        results.append(store.claim(42))
+
+    threads = [threading.Thread(target=claim, args=(store,)) for store in stores]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(results) == [False, False, False, True]
+
+
+def test_released_activity_can_be_claimed_again(tmp_path):
+    store = DedupStore(str(tmp_path / 'processed.db'))
+    assert store.claim(7)
+    store.release(7)
+    assert not store.is_processed(7)
+    assert store.claim(7)
+
+
+def test_claims_survive_a_restart_and_expire_after_the_ttl(tmp_path):
+    path = str(tmp_path / 'processed.db')
+    store = DedupStore(path, ttl_seconds=86400)
+    store.claim(1)
+    store.close()
+    with sqlite3.connect(path) as conn:
+        conn.execute("INSERT INTO processed_activities (id, processed_at) VALUES (2, datetime('now', '-2 days'))")
+
+    restarted = DedupStore(path, ttl_seconds=86400)
+    assert not restarted.claim(1)
+    assert restarted.prune() == 1
+    assert restarted.claim(2)
+
+
+def test_release_in_one_worker_lets_another_claim(tmp_path):
+    path = str(tmp_path / 'processed.db')
+    a, b = DedupStore(path), DedupStore(path)
+    assert a.claim(5)
+    assert not b.claim(5)  # b now remembers 5 as claimed.
+
+    a.release(5)
+    assert b.claim(5)
+    assert not a.claim(5)
+    a.release(5)
+    assert not b.is_processed(5)
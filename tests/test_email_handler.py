@@ -0,0 +1,98 @@
+import asyncio
+import threading
+
+from app.email_handler import EmailHandler, EmailOutbox, SMTPConnectionPool
+
+
+class FakePool:
+    """Records sent messages; the first `failures` sends raise."""
+
+    def __init__(self, failures=0):
+        self.sent = []
+        self.failures = failures
+
+    def send(self, msg):
+        if self.failures:
+            self.failures -= 1
+            raise OSError('connection refused')
+        self.sent.append((msg['To'], msg['Subject'], msg.get_payload()[0].get_payload()))
+
+    def warm_up(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def _handler(workdir, pool, **kwargs):
+    outbox = EmailOutbox(str(workdir / 'data' / 'outbox.db'))
+    kwargs.setdefault('poll_interval_seconds', 0.01)
+    return EmailHandler(pool=pool, outbox=outbox, **kwargs)
+
+
+def test_queued_digest_survives_a_restart(workdir):
+    async def scenario():
+        first = _handler(workdir, FakePool(), digest_seconds=3600)
+        await first.enqueue('Run 1', 'Easy run.', 'a@example.com')
+        await first.enqueue('Run 2', 'Tempo run.', 'a@example.com')
+        first._worker.cancel()  # The process dies before the digest is due.
+        await asyncio.gather(first._worker, return_exceptions=True)
+        assert first.outbox.count() == 2
+
+        pool = FakePool()
+        second = _handler(workdir, pool, digest_seconds=3600)
+        second.start()
+        await second.stop()
+        return pool, second.outbox.count()
+
+    pool, left = asyncio.run(scenario())
+    assert left == 0
+    assert len(pool.sent) == 1
+    receiver, subject, body = pool.sent[0]
+    assert (receiver, subject) == ('a@example.com', 'Workout Advice Digest (2 updates)')
+    assert 'Easy run.' in body and 'Tempo run.' in body
+
+
+def test_failed_sends_are_retried_and_kept_for_the_next_start(workdir):
+    async def scenario():
+        pool = FakePool(failures=1)
+        handler = _handler(workdir, pool, digest_seconds=0, retry_base_seconds=0.05)
+        await handler.enqueue('Run', 'Long run.', 'a@example.com')
+        for _ in range(100):
+            if pool.sent:
+                break
+            await asyncio.sleep(0.01)
+        sent = list(pool.sent)
+
+        pool.failures = 1
+        await handler.enqueue('Ride', 'Recovery ride.', 'a@example.com')
+        await asyncio.sleep(0.02)
+        await handler.stop()
+        return sent, handler.outbox.count()
+
+    sent, left = asyncio.run(scenario())
+    assert sent == [('a@example.com', 'Run', 'Long run.')]
+    assert left == 1  # The retry of the second email was not due at shutdown.
+
+
+def test_warm_up_does_not_open_connections_beyond_the_pool_size(monkeypatch):
+    pool = SMTPConnectionPool('localhost', 25, None, None, starttls=False, size=1)
+    opened = []
+    monkeypatch.setattr(pool, '_connect', lambda: opened.append(object()) or opened[-1])
+    monkeypatch.setattr(pool, '_is_alive', lambda server: True)
+    monkeypatch.setattr(pool, '_quit', lambda server: None)
+
+    sending, release = threading.Event(), threading.Event()
+
+    def send():
+        with pool.connection():
+            sending.set()
+            release.wait(5)
+
+    sender = threading.Thread(target=send)
+    sender.start()
+    sending.wait(5)
+    pool.warm_up()  # The only slot is in use.
+    release.set()
+    sender.join()
+    assert len(opened) == 1
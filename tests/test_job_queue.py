@@ -0,0 +1,153 @@
+import asyncio
+import time
+
+from app.job_queue import JobQueue, WorkerPool
+
+
+def _queues(tmp_path, lease_seconds=60.0):
+    path = str(tmp_path / 'jobs.db')
+    return (
+        JobQueue(path, owner='process-a', lease_seconds=lease_seconds),
+        JobQueue(path, owner='process-b', lease_seconds=lease_seconds),
+    )
+
+
+def test_starting_process_leaves_live_jobs_running(tmp_path):
+    a, b = _queues(tmp_path)
+    a.enqueue('e1', {'n': 1}, 'athlete-1')
+    a.enqueue('e2', {'n': 2}, 'athlete-1')
+    job = a.claim()
+
+    assert b.requeue_expired() == 0
+    # The partition stays serialized: its second job waits for the first.
+    assert b.claim() is None
+    assert a.stats() == {'pending': 1, 'running': 1, 'dead_letter': 0}
+    assert a.complete(job)
+
+
+def test_expired_lease_is_taken_over(tmp_path):
+    a, b = _queues(tmp_path, lease_seconds=0.05)
+    a.enqueue('e1', {'n': 1}, 'athlete-1')
+    job = a.claim()
+    time.sleep(0.1)
+
+    taken = b.claim()
+    assert taken is not None and taken.id == job.id
+    # The old owner can no longer complete or requeue the job.
+    assert not a.complete(job)
+    assert not a.retry(job, 'late', 0)
+    assert b.complete(taken)
+    assert b.stats()['running'] == 0
+
+
+def test_renewed_lease_is_not_taken_over(tmp_path):
+    a, b = _queues(tmp_path, lease_seconds=0.2)
+    a.enqueue('e1', {'n': 1})
+    job = a.claim()
+    for _ in range(4):
+        time.sleep(0.1)
+        assert a.renew([job.id]) == 1
+        assert b.claim() is None
+    assert a.complete(job)
+
+
+def test_release_owned_returns_only_own_jobs(tmp_path):
+    a, b = _queues(tmp_path)
+    a.enqueue('e1', {'n': 1}, 'athlete-1')
+    b.enqueue('e2', {'n': 2}, 'athlete-2')
+    a.claim()
+    b.claim()
+
+    assert a.release_owned() == 1
+    assert a.stats() == {'pending': 1, 'running': 1, 'dead_letter': 0}
+
+
+def test_worker_pool_start_does_not_steal_running_jobs(tmp_path):
+    a, b = _queues(tmp_path)
+    a.enqueue('e1', {'n': 1}, 'athlete-1')
+    running = a.claim()
+    handled = []
+
+    async def handler(payload):
+        handled.append(payload)
+
+    async def run_pool():
+        pool = WorkerPool(b, handler, workers=2, poll_interval_seconds=0.02)
+        await pool.start()
+        await asyncio.sleep(0.2)
+        await pool.stop()
+
+    asyncio.run(run_pool())
+    assert handled == []
+    assert a.complete(running)
+
+
+def test_duplicate_events_are_enqueued_once(tmp_path):
+    queue, _ = _queues(tmp_path)
+    assert queue.enqueue('e1', {'n': 1})
+    assert not queue.enqueue('e1', {'n': 2})
+    assert queue.claim().payload == {'n': 1}
+
+
+def test_claim_runs_partitions_in_parallel_and_each_in_order(tmp_path):
+    a, b = _queues(tmp_path)
+    a.enqueue('e1', {'n': 1}, 'athlete-1')
+    a.enqueue('e2', {'n': 2}, 'athlete-1')
+    a.enqueue('e3', {'n': 3}, 'athlete-2')
+
+    first, second = a.claim(), b.claim()
+    assert (first.event_key, second.event_key) == ('e1', 'e3')
+    assert a.claim() is None
+    assert a.complete(first)
+    assert b.claim().event_key == 'e2'
+
+
+def test_retry_delays_the_job_and_counts_the_attempt(tmp_path):
+    queue, _ = _queues(tmp_path)
+    queue.enqueue('e1', {'n': 1})
+    job = queue.claim()
+    assert queue.retry(job, 'timeout', 0.1)
+    assert queue.claim() is None
+    time.sleep(0.15)
+    assert queue.claim().attempts == 1
+
+
+def test_failing_job_is_retried_then_dead_lettered(tmp_path):
+    queue, _ = _queues(tmp_path)
+    queue.enqueue('e1', {'n': 1})
+    attempts = []
+
+    async def handler(payload):
+        attempts.append(time.monotonic())
+        raise RuntimeError('Strava unavailable')
+
+    async def run_pool():
+        pool = WorkerPool(queue, handler, workers=1, max_attempts=3, retry_base_seconds=0.02,
+                          poll_interval_seconds=0.01)
+        await pool.start()
+        for _ in range(200):
+            if queue.stats()['dead_letter']:
+                break
+            await asyncio.sleep(0.01)
+        await pool.stop()
+
+    asyncio.run(run_pool())
+    assert len(attempts) == 3
+    # Exponential backoff: 0.02s, then 0.04s.
+    assert attempts[1] - attempts[0] >= 0.02 and attempts[2] - attempts[1] >= 0.04
+    assert queue.stats() == {'pending': 0, 'running': 0, 'dead_letter': 1}
+
+
+def test_coalesce_merges_events_into_the_pending_job(tmp_path):
+    queue, _ = _queues(tmp_path)
+
+    def add(activity_id):
+        return lambda payload: {'ids': (payload or {'ids': []})['ids'] + [activity_id]}
+
+    assert queue.coalesce('athlete-1', 'e1', add(1), 0, 60) == 'created'
+    assert queue.coalesce('athlete-1', 'e2', add(2), 0, 60) == 'merged'
+    job = queue.claim()
+    assert job.payload == {'ids': [1, 2]}
+    # A running job is never changed; a new one starts behind it.
+    assert queue.coalesce('athlete-1', 'e3', add(3), 0, 60) == 'created'
+    assert queue.stats() == {'pending': 1, 'running': 1, 'dead_letter': 0}
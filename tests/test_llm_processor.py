@@ -0,0 +1,125 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+
+import app.llm_processor as llm_processor
+import config
+from app.llm_processor import LLMAdapter
+
+
+@pytest.fixture(autouse=True)
+def fresh_slots(monkeypatch):
+    """A generation semaphore and shared client per test, as each test runs its own event loop."""
+    monkeypatch.setattr(llm_processor, '_generation_slots', None)
+    monkeypatch.setattr(llm_processor, '_http_client', None)
+
+
+def _delta(content, finish_reason=None):
+    return 'data: ' + json.dumps({'choices': [{'delta': {'content': content}, 'finish_reason': finish_reason}]})
+
+
+def _completion(content):
+    return {'choices': [{'message': {'content': content}}], 'usage': {'prompt_tokens': 3, 'completion_tokens': 2}}
+
+
+def _client(handler):
+    return httpx.AsyncClient(transport=httpx.MockTransport(handler), base_url='http://llm')
+
+
+async def _collect(stream):
+    return [chunk async for chunk in stream]
+
+
+def test_adapters_share_one_client(monkeypatch):
+    requests = []
+
+    def handler(request):
+        requests.append(request.url.path)
+        return httpx.Response(200, json=_completion('Easy run.'))
+
+    shared = _client(handler)
+    monkeypatch.setattr(llm_processor, 'get_http_client', lambda: shared)
+
+    async def generate():
+        first, second = LLMAdapter('model-a'), LLMAdapter('model-b')
+        assert first.client is second.client is shared
+        return [await first.complete('prompt'), await second.complete('prompt')]
+
+    assert asyncio.run(generate()) == ['Easy run.', 'Easy run.']
+    assert requests == ['/models/model-a/v1/chat/completions', '/models/model-b/v1/chat/completions']
+
+
+def test_shared_client_is_created_once_and_recreated_after_close():
+    async def clients():
+        first = llm_processor.get_http_client()
+        assert llm_processor.get_http_client() is first
+        await llm_processor.close_http_client()
+        second = llm_processor.get_http_client()
+        await llm_processor.close_http_client()
+        return first, second
+
+    first, second = asyncio.run(clients())
+    assert first is not second and first.is_closed
+
+
+def test_concurrent_generations_are_capped(monkeypatch):
+    monkeypatch.setattr(config, 'LLM_MAX_CONCURRENCY', 2)
+    running, peak = 0, 0
+
+    async def handler(request):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.05)
+        running -= 1
+        return httpx.Response(200, json=_completion('Easy run.'))
+
+    async def generate():
+        adapter = LLMAdapter('model', client=_client(handler))
+        return await asyncio.gather(*(adapter.complete('prompt') for _ in range(5)))
+
+    assert asyncio.run(generate()) == ['Easy run.'] * 5
+    assert peak == 2
+
+
+def test_slow_generation_times_out():
+    async def slow_completion(request):
+        await asyncio.sleep(2.0)
+        return httpx.Response(200, json=_completion('Easy run.'))
+
+    async def trickle():
+        for n in range(100):
+            await asyncio.sleep(0.02)
+            yield (_delta(f'{n} ') + '\n\n').encode()
+
+    async def generate(handler, call):
+        adapter = LLMAdapter('model', timeout=0.1, client=_client(handler))
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        with pytest.raises(asyncio.TimeoutError):
+            await call(adapter)
+        return loop.time() - started
+
+    assert asyncio.run(generate(slow_completion, lambda adapter: adapter.complete('prompt'))) < 1.0
+    streaming = lambda request: httpx.Response(200, content=trickle())
+    assert asyncio.run(generate(streaming, lambda adapter: _collect(adapter.stream('prompt')))) < 1.0
+
+
+def test_stream_cut_off_before_the_end_is_an_error():
+    async def stream(lines):
+        client = _client(lambda request: httpx.Response(200, text=''.join(f'{line}\n\n' for line in lines)))
+        return await _collect(LLMAdapter('model', client=client).stream('prompt'))
+
+    assert asyncio.run(stream([_delta('Easy '), _delta('run.'), 'data: [DONE]'])) == ['Easy ', 'run.']
+    assert asyncio.run(stream([_delta('Easy '), _delta('run.', 'stop')])) == ['Easy ', 'run.']
+    with pytest.raises(ValueError, match='ended before'):
+        asyncio.run(stream([_delta('Easy ')]))
+
+
+def test_generate_summary_returns_failures_as_text():
+    client = _client(lambda request: httpx.Response(503, json={'error': 'loading'}))
+    adapter = LLMAdapter('model', client=client)
+    assert asyncio.run(adapter.generate_summary('prompt')).startswith('Error: ')
+    assert asyncio.run(_collect(adapter.generate_summary_stream('prompt')))[-1].startswith('Error: ')
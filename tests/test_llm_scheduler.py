@@ -0,0 +1,138 @@
+import asyncio
+
+import pytest
+
+from app.advice_cache import AdviceCache, CachingLLMAdapter
+from app.llm_processor import LLMAdapter
+from app.llm_scheduler import LLMScheduler, LLMStreamInterrupted, LLMUnavailable
+from tests.conftest import FakeAdapter
+
+
+async def _collect(stream):
+    chunks = []
+    async for chunk in stream:
+        chunks.append(chunk)
+    return chunks
+
+
+def _cache(workdir):
+    return AdviceCache(str(workdir / 'data' / 'cache.db'), ttl_seconds=3600, max_entries=10, max_bytes=10**6)
+
+
+def test_stream_failing_part_way_raises_and_is_not_cached(workdir):
+    cache = _cache(workdir)
+    primary = CachingLLMAdapter(FakeAdapter('primary', error=OSError('connection reset')), cache)
+    scheduler = LLMScheduler(primary, fallbacks=[FakeAdapter('fallback')])
+    received = []
+
+    async def consume():
+        async for chunk in scheduler.generate_summary_stream('prompt', fallback=lambda: 'template'):
+            received.append(chunk)
+
+    with pytest.raises(LLMStreamInterrupted):
+        asyncio.run(consume())
+    assert received == ['Easy ', 'run.']
+    assert cache.get(primary._key('prompt')) is None
+
+
+def test_max_tokens_fits_the_model_context():
+    prompt = 'word ' * 3000
+    assert LLMAdapter('large', max_tokens=1024)._request_body(prompt, stream=False)['max_tokens'] == 1024
+    small = LLMAdapter('small', max_tokens=1024, context_tokens=4096)
+    assert small._request_body(prompt, stream=False)['max_tokens'] == 4096 * 9 // 10 - 3000
+    with pytest.raises(ValueError, match='no room'):
+        small._request_body('word ' * 3500, stream=False)
+
+
+def _adapter(name, **kwargs):
+    # A failing adapter fails before its first chunk.
+    chunks = () if kwargs.get('error') else (f'{name} advice',)
+    return FakeAdapter(name, chunks=chunks, **kwargs)
+
+
+def test_slow_primary_is_hedged_and_the_first_answer_wins():
+    primary, hedge = _adapter('primary', delay=2.0), _adapter('hedge')
+    scheduler = LLMScheduler(primary, hedge=hedge, deadline_seconds=5, hedge_after_seconds=0.05)
+
+    async def generate():
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        advice = await scheduler.generate_summary('prompt')
+        return advice, loop.time() - started
+
+    advice, elapsed = asyncio.run(generate())
+    assert advice == 'hedge advice'
+    assert elapsed < 1.0  # The primary was cancelled, not awaited.
+    assert asyncio.run(_collect(scheduler.generate_summary_stream('prompt'))) == ['hedge advice']
+
+
+def test_failed_primary_is_hedged_without_waiting():
+    primary, hedge = _adapter('primary', error=OSError('503')), _adapter('hedge')
+    scheduler = LLMScheduler(primary, hedge=hedge, deadline_seconds=5, hedge_after_seconds=2.0)
+
+    async def generate():
+        return await asyncio.wait_for(scheduler.generate_summary('prompt'), 1.0)
+
+    assert asyncio.run(generate()) == 'hedge advice'
+
+
+def test_fallbacks_then_the_template_are_used_in_order():
+    failing = [_adapter(name, error=OSError('503')) for name in ('primary', 'hedge', 'small')]
+    scheduler = LLMScheduler(
+        failing[0], hedge=failing[1], fallbacks=[failing[2], _adapter('smaller')], hedge_after_seconds=0.05
+    )
+    assert asyncio.run(scheduler.generate_summary('prompt', fallback=lambda: 'template')) == 'smaller advice'
+    assert all(adapter.calls == 1 for adapter in failing)
+
+    scheduler.fallbacks = failing[2:]
+    assert asyncio.run(scheduler.generate_summary('prompt', fallback=lambda: 'template')) == 'template'
+    assert asyncio.run(_collect(scheduler.generate_summary_stream('prompt', fallback=lambda: 'template'))) == ['template']
+    with pytest.raises(LLMUnavailable):
+        asyncio.run(scheduler.generate_summary('prompt'))
+
+
+def test_deadline_bounds_a_hanging_backend():
+    scheduler = LLMScheduler(_adapter('primary', delay=10.0), fallbacks=[_adapter('small', delay=10.0)],
+                             deadline_seconds=0.2)
+
+    async def generate():
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        advice = await scheduler.generate_summary('prompt', fallback=lambda: 'template')
+        return advice, loop.time() - started
+
+    advice, elapsed = asyncio.run(generate())
+    assert advice == 'template'
+    assert elapsed < 1.0
+
+
+def test_stream_opened_as_the_race_is_abandoned_is_closed():
+    # The primary opens its stream just as the request is cancelled: the finished
+    # attempt must still be discarded, or its stream and generation slot leak.
+    scheduler = LLMScheduler(_adapter('primary'), hedge=_adapter('hedge'), hedge_after_seconds=5.0)
+    discarded = []
+
+    async def call(adapter):
+        return adapter.model_name
+
+    async def discard(opened):
+        discarded.append(opened)
+
+    async def scenario():
+        deadline = asyncio.get_running_loop().time() + 5
+        hedged = asyncio.create_task(scheduler._hedged(deadline, call, discard))
+        attempt = None
+        while attempt is None:
+            await asyncio.sleep(0)
+            attempt = next(
+                (task for task in asyncio.all_tasks() if task.get_coro().__qualname__ == 'LLMScheduler._attempt'),
+                None
+            )
+        while not attempt.done():
+            await asyncio.sleep(0)
+        hedged.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await hedged
+
+    asyncio.run(scenario())
+    assert discarded == ['primary']
@@ -0,0 +1,30 @@
+import os
+import subprocess
+import sys
+
+from app import metrics
+from tests.conftest import REPO_ROOT
+
+
+def test_render_includes_labelled_callback_gauges():
+    values = {('short',): 150.0}
+    metrics.CallbackGauge('test_budget_remaining', 'Test gauge', ['window'], lambda: values)
+    metrics.PIPELINE_ERRORS.labels(stage='test').inc()
+
+    text = metrics.render().decode()
+    assert 'test_budget_remaining{window="short"} 150.0' in text
+    assert 'workoutplan_pipeline_errors_total{stage="test"}' in text
+    assert metrics.sample_value('workoutplan_pipeline_errors_total', stage='test') >= 1
+
+
+def test_multiprocess_render_sums_every_process(tmp_path):
+    env = dict(os.environ, PROMETHEUS_MULTIPROC_DIR=str(tmp_path), PYTHONPATH=str(REPO_ROOT))
+    increment = "from app import metrics; metrics.JOBS.labels(outcome='completed').inc()"
+    for _ in range(2):
+        subprocess.run([sys.executable, '-c', increment], env=env, check=True, cwd=REPO_ROOT)
+
+    render = "import sys; from app import metrics; sys.stdout.write(metrics.render().decode())"
+    text = subprocess.run(
+        [sys.executable, '-c', render], env=env, check=True, cwd=REPO_ROOT, capture_output=True, text=True
+    ).stdout
+    assert 'workoutplan_jobs_total{outcome="completed"} 2.0' in text
@@ -0,0 +1,88 @@
+from app.prompt_handler import PromptHandler, Rollups
+from tests.conftest import REPO_ROOT
+
+TEMPLATE = str(REPO_ROOT / 'data' / 'prompt_template.txt')
+
+
+def _result(preprocessor_class, store):
+    preprocessor = preprocessor_class(store=store, athlete_id=1)
+    preprocessor.process_run_data()
+    preprocessor.calculate_summary_statistics()
+    return preprocessor.to_result()
+
+
+def _prompt(result):
+    return PromptHandler(TEMPLATE).build_prompt(
+        result.activities,
+        result.summary_statistics,
+        result.training_load,
+        result.rollups,
+        result.stream_metrics,
+        result.similar_efforts
+    ).text
+
+
+def test_prompt_is_identical_for_unchanged_data(history_store, offline_preprocessor):
+    # The advice cache is keyed on the prompt, so it may only change with the data.
+    first = _prompt(_result(offline_preprocessor, history_store))
+    second = _prompt(_result(offline_preprocessor, history_store))
+    assert first == second
+
+
+def test_prompt_leaves_out_the_training_load_evaluation_time(history_store, offline_preprocessor):
+    result = _result(offline_preprocessor, history_store)
+    assert 'as_of' in result.training_load
+    prompt = _prompt(result)
+    # The evaluation time may equal the latest run's start, which the prompt does show.
+    assert 'as_of' not in prompt
+    assert 'chronic_training_load' in prompt
+
+
+STREAM_METRICS = {
+    'splits': [{'km': n, 'seconds': 290 + n, 'pace_min_per_km': 4.9} for n in range(1, 11)],
+    'cadence_drift': 1.5,
+}
+
+
+def _similar(count):
+    efforts = [
+        {'date': f'2024-03-{n + 1:02d}', 'distance_km': 10.0 + n, 'pace_min_per_km': 5.0, 'average_heartrate': 150}
+        for n in range(count)
+    ]
+    return {'similar': efforts, 'trend': {'efforts': count}}
+
+
+def _build(result, budget, rollups=None, similar=5, stream_metrics=STREAM_METRICS):
+    return PromptHandler(TEMPLATE, token_budget=budget).build_prompt(
+        result.activities, result.summary_statistics, result.training_load,
+        rollups if rollups is not None else result.rollups, stream_metrics, _similar(similar)
+    )
+
+
+def test_tight_budget_drops_rollups_then_similar_efforts_then_stream_metrics(history_store, offline_preprocessor):
+    result = _result(offline_preprocessor, history_store)
+    full = _build(result, 100_000)
+    assert full.weekly_rows and full.monthly_rows and full.similar_rows == 5 and not full.over_budget
+
+    fewer_months = _build(result, full.token_count - 1)
+    assert fewer_months.monthly_rows < full.monthly_rows and fewer_months.similar_rows == 5
+
+    two_similar = _build(result, 100_000, rollups=Rollups(), similar=2).token_count
+    build = _build(result, two_similar)
+    assert (build.weekly_rows, build.monthly_rows, build.similar_rows) == (0, 0, 2)
+    assert build.token_count == two_similar
+
+    with_stream = _build(result, 100_000, rollups=Rollups(), similar=0).token_count
+    build = _build(result, with_stream - 1)
+    assert build.similar_rows == 0 and not build.over_budget
+    assert 'km|seconds' not in build.text and 'cadence_drift' in build.text
+
+
+def test_prompt_over_budget_without_optional_sections_is_flagged(history_store, offline_preprocessor):
+    result = _result(offline_preprocessor, history_store)
+    build = _build(result, 50)
+    assert build.over_budget
+    assert (build.weekly_rows, build.monthly_rows, build.similar_rows) == (0, 0, 0)
+    assert 'cadence_drift' not in build.text and 'Latest activity' in build.text
+    bare = _build(result, 100_000, rollups=Rollups(), similar=0, stream_metrics=None)
+    assert build.token_count == bare.token_count
@@ -0,0 +1,62 @@
+import threading
+
+from app.similarity_index import SimilarityIndex
+
+
+def _runs(store):
+    return [record for chunk in store.iter_activities(1000) for record in chunk if record['type'] == 'Run']
+
+
+def test_other_processes_catch_up_without_reloading(history_store):
+    reader = SimilarityIndex(history_store.db_path, 1)
+    writer = SimilarityIndex(history_store.db_path, 1)
+    runs = _runs(history_store)
+    reader.nearest(runs[0]['id'], 'Run')
+    loaded = reader._type('Run')
+
+    edited = dict(runs[1], distance=runs[1]['distance'] * 2)
+    retyped = dict(runs[2], type='Ride')
+    added = dict(runs[3], id=runs[3]['id'] + 10_000_000)
+    history_store.upsert_activities([edited, retyped, added])
+    writer.apply([edited, retyped, added])
+    history_store.delete_activities([runs[4]['id']])
+    writer.remove([runs[4]['id']])
+
+    reader.nearest(runs[0]['id'], 'Run')
+    assert reader._type('Run') is loaded
+    assert added['id'] in loaded.rows
+    assert runs[2]['id'] not in loaded.rows and runs[4]['id'] not in loaded.rows
+    assert loaded.raw[loaded.rows[edited['id']], 0] == edited['distance'] / 1000
+    assert reader._version == writer._version == 2
+
+
+def test_bulk_writes_make_other_processes_reload(history_store):
+    reader = SimilarityIndex(history_store.db_path, 1)
+    run_id = _runs(history_store)[0]['id']
+    reader.nearest(run_id, 'Run')
+    loaded = reader._type('Run')
+
+    SimilarityIndex(history_store.db_path, 1).invalidate()
+    reader.nearest(run_id, 'Run')
+    assert reader._type('Run') is not loaded
+
+
+def test_concurrent_updates_each_get_their_own_version(history_store):
+    runs = _runs(history_store)[:40]
+    indexes = [SimilarityIndex(history_store.db_path, 1) for _ in range(4)]
+
+    def update(index, records):
+        for record in records:
+            index.apply([record])
+
+    threads = [
+        threading.Thread(target=update, args=(index, runs[n::4])) for n, index in enumerate(indexes)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    reader = SimilarityIndex(history_store.db_path, 1)
+    reader._check_version()
+    assert reader._version == len(runs)
@@ -0,0 +1,10 @@
+from app.training_load import DAY_SECONDS, advice_time
+
+
+def test_advice_time_only_moves_with_the_data_or_the_date():
+    day = 20_000 * DAY_SECONDS
+    assert advice_time(None, now=day + 3600) == advice_time(None, now=day + 80_000) == day
+    # A run earlier today: the loads right after it.
+    assert advice_time(day + 7200, now=day + 9000) == advice_time(day + 7200, now=day + 80_000) == day + 7200
+    # Days without a run still decay the loads, once per day.
+    assert advice_time(day - DAY_SECONDS, now=day + 3600) == day
@@ -1,31 +1,192 @@
+"""
+Deduplication store for processed Strava activities.
+
+Strava retries webhook deliveries, so each activity must be claimed exactly
+once. `DedupStore` keeps one long-lived SQLite connection in WAL mode and
+claims an activity with a single INSERT OR IGNORE, which is atomic across
+requests and uvicorn workers. Ids known to be claimed are also kept in memory,
+so a repeated retry is rejected with a primary-key read instead of a write
+transaction that would queue behind the other workers' writes. The set is only
+a hint: another worker may have released the id since, so a claim is never
+rejected without SQLite confirming it. Entries older than `DEDUP_TTL_DAYS` are
+pruned periodically.
+"""
+
 import sqlite3
-from typing import Optional
+import threading
+import time
+from typing import Dict, Optional
+
+import config
 
 DB_FILE = 'processed_activities.db'
 
+
+class DedupStore:
+    """
+    SQLite-backed set of processed activity ids with an in-memory hint of claimed ones.
+    """
+
+    def __init__(
+        self,
+        db_path: str = DB_FILE,
+        ttl_seconds: float = config.DEDUP_TTL_DAYS * 86400,
+        prune_interval_seconds: float = config.DEDUP_PRUNE_INTERVAL_SECONDS
+    ) -> None:
+        """Open the database, create its table if needed and warm the in-memory set."""
+        self.db_path = db_path
+        self.ttl_seconds = ttl_seconds
+        self.prune_interval_seconds = prune_interval_seconds
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        # Activity id -> epoch time it was last seen claimed; may be stale after a release.
+        self._recent: Dict[int, float] = {}
+        self._last_pruned = 0.0
+        self.initialize()
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(
+                self.db_path, timeout=30, check_same_thread=False, isolation_level=None
+            )
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+        return self._conn
+
+    def initialize(self) -> None:
+        """Create the processed_activities table if it doesn't exist and load recent ids."""
+        with self._lock:
+            conn = self._connection()
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS processed_activities (
+                    id INTEGER PRIMARY KEY,
+                    processed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_processed_activities_processed_at "
+                "ON processed_activities (processed_at)"
+            )
+            rows = conn.execute(
+                "SELECT id, CAST(strftime('%s', processed_at) AS REAL) FROM processed_activities "
+                "WHERE processed_at >= datetime('now', ?)",
+                (f'-{int(self.ttl_seconds)} seconds',)
+            ).fetchall()
+            self._recent = {row[0]: row[1] or time.time() for row in rows}
+
+    def _is_claimed(self, conn: sqlite3.Connection, activity_id: int) -> bool:
+        row = conn.execute(
+            "SELECT 1 FROM processed_activities WHERE id = ?", (activity_id,)
+        ).fetchone()
+        if row is None:
+            self._recent.pop(activity_id, None)
+        return row is not None
+
+    def is_processed(self, activity_id: int) -> bool:
+        """Check whether an activity has already been claimed."""
+        activity_id = int(activity_id)
+        with self._lock:
+            return self._is_claimed(self._connection(), activity_id)
+
+    def claim(self, activity_id: int) -> bool:
+        """
+        Atomically mark an activity as processed.
+
+        Args:
+            activity_id: Strava activity id
+
+        Returns:
+            bool: True if this call claimed the activity, False if it was already claimed
+        """
+        activity_id = int(activity_id)
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            # A retry of a known claim costs a read, which does not take the write lock.
+            if activity_id in self._recent and self._is_claimed(conn, activity_id):
+                return False
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO processed_activities (id) VALUES (?)", (activity_id,)
+            )
+            claimed = cursor.rowcount == 1
+            self._recent[activity_id] = now
+            if now - self._last_pruned >= self.prune_interval_seconds:
+                self._prune(now)
+        return claimed
+
+    def release(self, activity_id: int) -> None:
+        """Undo a claim whose processing could not be scheduled, so a retry can claim it."""
+        activity_id = int(activity_id)
+        with self._lock:
+            self._connection().execute(
+                "DELETE FROM processed_activities WHERE id = ?", (activity_id,)
+            )
+            self._recent.pop(activity_id, None)
+
+    def _prune(self, now: float) -> int:
+        cursor = self._connection().execute(
+            "DELETE FROM processed_activities WHERE processed_at < datetime('now', ?)",
+            (f'-{int(self.ttl_seconds)} seconds',)
+        )
+        cutoff = now - self.ttl_seconds
+        self._recent = {
+            activity_id: claimed_at
+            for activity_id, claimed_at in self._recent.items()
+            if claimed_at >= cutoff
+        }
+        self._last_pruned = now
+        return cursor.rowcount
+
+    def prune(self) -> int:
+        """
+        Forget activities claimed more than the TTL ago.
+
+        Returns:
+            int: Number of rows deleted
+        """
+        with self._lock:
+            return self._prune(time.time())
+
+    def close(self) -> None:
+        """Close the database connection; it is reopened on next use."""
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+_store: Optional[DedupStore] = None
+
+
+def get_dedup_store() -> DedupStore:
+    """Return the process-wide dedup store, creating it on first use."""
+    global _store
+    if _store is None:
+        _store = DedupStore()
+    return _store
+
+
 def initialize_db():
     """Initialize the database and create the processed_activities table if it doesn't exist."""
-    with sqlite3.connect(DB_FILE) as conn:
-        cursor = conn.cursor()
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS processed_activities (
-                id INTEGER PRIMARY KEY,
-                processed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        conn.commit()
+    get_dedup_store()
 
 def is_activity_processed(activity_id: int) -> bool:
     """Check if an activity ID has already been processed."""
-    with sqlite3.connect(DB_FILE) as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT 1 FROM processed_activities WHERE id = ?", (activity_id,))
-        result = cursor.fetchone()
-    return result is not None
+    return get_dedup_store().is_processed(activity_id)
 
 def mark_activity_processed(activity_id: int) -> None:
     """Mark an activity as processed by storing it in the database."""
-    with sqlite3.connect(DB_FILE) as conn:
-        cursor = conn.cursor()
-        cursor.execute("INSERT INTO processed_activities (id) VALUES (?)", (activity_id,))
-        conn.commit()
+    get_dedup_store().claim(activity_id)
+
+def claim_activity(activity_id: int) -> bool:
+    """Atomically mark an activity as processed; return False if it already was."""
+    return get_dedup_store().claim(activity_id)
+
+def release_activity(activity_id: int) -> None:
+    """Undo a claim so the activity can be processed again."""
+    get_dedup_store().release(activity_id)
+
+def close_db() -> None:
+    """Close the dedup store's database connection."""
+    if _store is not None:
+        _store.close()
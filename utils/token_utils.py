@@ -2,50 +2,133 @@
 Token management utilities for Strava API.
 
 This module provides functionality to load, save, and refresh tokens
-needed for authenticating with the Strava API.
+needed for authenticating with the Strava API. Tokens for the default
+athlete live in `TOKEN_FILE`; each onboarded athlete has its own file in
+`TOKEN_DIR`, named after their Strava athlete id.
+
+Strava rotates the refresh token on every refresh, so refreshes must never
+race: `TokenManager` keeps tokens in memory, lets a single caller per athlete
+refresh (in this process via a lock, across uvicorn workers via a file lock)
+and writes token files atomically.
 """
 
 import os
 import time
 import json
-from typing import Optional, Dict
+import tempfile
+import threading
+from contextlib import contextmanager
+from typing import Callable, Iterator, Optional, Dict
 from stravalib.client import Client
 
+import config
+
+try:
+    import fcntl
+except ImportError:  # Windows: only in-process locking is available
+    fcntl = None
+
 TOKEN_FILE = 'strava_tokens.json'
+TOKEN_DIR = 'tokens'
+
+
+def token_path(athlete_id: Optional[int] = None) -> str:
+    """
+    Get the token file for an athlete.
+
+    Args:
+        athlete_id (Optional[int]): Strava athlete id, or None for the default athlete.
+
+    Returns:
+        str: Path of the athlete's token file.
+    """
+    if athlete_id is None:
+        return TOKEN_FILE
+    return os.path.join(TOKEN_DIR, f'{int(athlete_id)}.json')
 
 
-def load_tokens() -> Optional[Dict[str, str]]:
+def load_tokens(athlete_id: Optional[int] = None) -> Optional[Dict[str, str]]:
     """
     Load tokens from a file.
 
+    Args:
+        athlete_id (Optional[int]): Strava athlete id, or None for the default athlete.
+
     Returns:
         Optional[Dict[str, str]]: A dictionary containing token data, or None if the file does not exist.
     """
     try:
-        with open(TOKEN_FILE, 'r') as file:
+        with open(token_path(athlete_id), 'r') as file:
             return json.load(file)
     except FileNotFoundError:
         return None
 
 
-def save_tokens(tokens: Dict[str, str]) -> None:
+def save_tokens(tokens: Dict[str, str], athlete_id: Optional[int] = None) -> None:
     """
-    Save tokens to a file.
+    Save tokens to a file atomically.
+
+    The tokens are written to a temporary file in the same directory and renamed
+    over the token file, so readers never see a partially written file.
 
     Args:
         tokens (Dict[str, str]): A dictionary containing token data.
+        athlete_id (Optional[int]): Strava athlete id, or None for the default athlete.
     """
-    with open(TOKEN_FILE, 'w') as file:
-        json.dump(tokens, file)
+    path = token_path(athlete_id)
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tokens-', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as file:
+            json.dump(tokens, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
 
 
-def refresh_tokens(client: Client, tokens: Dict[str, str]) -> Dict[str, str]:
+@contextmanager
+def token_file_lock(athlete_id: Optional[int] = None) -> Iterator[None]:
     """
-    Refresh the access token if it has expired.
+    Hold an exclusive lock on an athlete's token file across processes.
+
+    Args:
+        athlete_id (Optional[int]): Strava athlete id, or None for the default athlete.
+    """
+    if fcntl is None:
+        yield
+        return
+    lock_path = token_path(athlete_id) + '.lock'
+    os.makedirs(os.path.dirname(lock_path) or '.', exist_ok=True)
+    with open(lock_path, 'a') as lock_file:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+def refresh_tokens(
+    client: Client,
+    tokens: Dict[str, str],
+    athlete_id: Optional[int] = None,
+    safety_window: float = 0
+) -> Dict[str, str]:
+    """
+    Refresh the access token if it has expired or expires within `safety_window` seconds.
+
+    Callers that may run concurrently should go through `TokenManager`, which
+    serializes refreshes.
 
     Args:
         client (Client): The Strava client instance.
         tokens (Dict[str, str]): A dictionary containing the current token data.
+        athlete_id (Optional[int]): Strava athlete id, or None for the default athlete.
+        safety_window (float): Seconds before expiry at which to refresh early.
 
     Returns:
         Dict[str, str]: The updated token data.
@@ -59,7 +142,7 @@ def refresh_tokens(client: Client, tokens: Dict[str, str]) -> Dict[str, str]:
     if not client_id or not client_secret:
         raise ValueError("CLIENT_ID or CLIENT_SECRET is missing in environment variables.")
 
-    if time.time() > tokens['expires_at']:
+    if time.time() > tokens['expires_at'] - safety_window:
         print("Refreshing access token...")
         refresh_response = client.refresh_access_token(
             client_id=client_id,
@@ -71,7 +154,109 @@ def refresh_tokens(client: Client, tokens: Dict[str, str]) -> Dict[str, str]:
             'refresh_token': refresh_response['refresh_token'],
             'expires_at': refresh_response['expires_at']
         })
-        save_tokens(tokens)
+        save_tokens(tokens, athlete_id)
     else:
         print("Access token is still valid.")
     return tokens
+
+
+class TokenManager:
+    """
+    In-memory token cache with single-flight refresh and reusable Strava clients.
+    """
+
+    def __init__(self, safety_window: float = config.TOKEN_REFRESH_WINDOW_SECONDS) -> None:
+        """
+        Initialize an empty cache.
+
+        Args:
+            safety_window (float): Seconds before expiry at which tokens are refreshed.
+        """
+        self.safety_window = safety_window
+        self._tokens: Dict[Optional[int], Dict[str, str]] = {}
+        self._clients: Dict[Optional[int], Client] = {}
+        self._locks: Dict[Optional[int], threading.Lock] = {}
+        self._guard = threading.Lock()
+
+    def _lock(self, athlete_id: Optional[int]) -> threading.Lock:
+        with self._guard:
+            return self._locks.setdefault(athlete_id, threading.Lock())
+
+    def _is_fresh(self, tokens: Optional[Dict[str, str]]) -> bool:
+        return tokens is not None and time.time() < tokens['expires_at'] - self.safety_window
+
+    def get_tokens(self, athlete_id: Optional[int] = None) -> Dict[str, str]:
+        """
+        Return valid tokens for an athlete, refreshing them if they are about to expire.
+
+        Only one caller refreshes at a time; the others wait and then use its result.
+        The token file is re-read under the cross-process lock, so a refresh already
+        done by another worker process is picked up instead of repeated.
+
+        Args:
+            athlete_id (Optional[int]): Strava athlete id, or None for the default athlete.
+
+        Returns:
+            Dict[str, str]: Token data with an access token valid beyond the safety window.
+
+        Raises:
+            RuntimeError: If no tokens are stored for the athlete.
+        """
+        tokens = self._tokens.get(athlete_id)
+        if self._is_fresh(tokens):
+            return tokens
+
+        with self._lock(athlete_id):
+            tokens = self._tokens.get(athlete_id)
+            if self._is_fresh(tokens):
+                return tokens
+            with token_file_lock(athlete_id):
+                tokens = load_tokens(athlete_id)
+                if not tokens:
+                    raise RuntimeError("Tokens not found. You need to authenticate first.")
+                if not self._is_fresh(tokens):
+                    tokens = refresh_tokens(Client(), tokens, athlete_id, self.safety_window)
+            self._tokens[athlete_id] = tokens
+            return tokens
+
+    def get_client(
+        self,
+        athlete_id: Optional[int] = None,
+        client_factory: Callable[[], Client] = Client
+    ) -> Client:
+        """
+        Return the athlete's authenticated Strava client, reusing it across calls.
+
+        Args:
+            athlete_id (Optional[int]): Strava athlete id, or None for the default athlete.
+            client_factory (Callable[[], Client]): Builds the client on first use.
+
+        Returns:
+            Client: An authenticated Strava client instance.
+        """
+        tokens = self.get_tokens(athlete_id)
+        with self._guard:
+            client = self._clients.get(athlete_id)
+            if client is None:
+                client = self._clients[athlete_id] = client_factory()
+        if client.access_token != tokens['access_token']:
+            client.access_token = tokens['access_token']
+            client.refresh_token = tokens['refresh_token']
+            client.token_expires_at = tokens['expires_at']
+        return client
+
+    def store(self, tokens: Dict[str, str], athlete_id: Optional[int] = None) -> None:
+        """
+        Persist tokens from a new OAuth exchange and replace any cached ones.
+
+        Args:
+            tokens (Dict[str, str]): A dictionary containing token data.
+            athlete_id (Optional[int]): Strava athlete id, or None for the default athlete.
+        """
+        with self._lock(athlete_id):
+            with token_file_lock(athlete_id):
+                save_tokens(tokens, athlete_id)
+            self._tokens[athlete_id] = dict(tokens)
+
+
+token_manager = TokenManager()